@@ -0,0 +1,1360 @@
+"""Micro-benchmarks for the paystub processing hot paths.
+
+Run with ``python benchmarks.py [name ...]``. Nothing here talks to Google
+Cloud; the emulator hosts below only let server_new build its clients
+without credentials.
+
+``paystub_stages`` and ``end_to_end`` run on a generated corpus of paystub
+PDFs (``--corpus-dir`` writes it out). Save a run with ``--output`` and pass
+it back as ``--baseline`` to fail when a timing or accuracy gets worse.
+"""
+import argparse
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from fpdf import FPDF
+from flask_mail import Connection
+from PIL import Image, ImageDraw, ImageFont
+
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', 'localhost:8681')
+os.environ.setdefault('STORAGE_EMULATOR_HOST', 'http://localhost:9023')
+os.environ.setdefault('GOOGLE_CLOUD_PROJECT', 'benchmark')
+
+import server_new  # noqa: E402
+
+FILLER_WORDS = [
+    'deduction', 'federal', 'state', 'tax', 'medicare', 'social', 'security',
+    'ytd', 'current', 'rate', 'amount', 'total', 'period', 'earnings', 'hours',
+    'regular', 'net', 'gross', 'pay', 'employee', 'benefits'
+]
+
+
+def timed(fn, *args, repeat: int = 5) -> float:
+    """Return the best wall time of several runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_stub_text(filler_lines: int, fields_first: bool = False, seed: int = 1) -> str:
+    """Build extracted-text-like content with YTD table filler around the labelled fields"""
+    rng = random.Random(seed)
+    filler = "".join(
+        f"{rng.choice(FILLER_WORDS)} {rng.choice(FILLER_WORDS)} {rng.randint(1, 9999)}.{rng.randint(0, 99):02d}\n"
+        for _ in range(filler_lines)
+    )
+    fields = (
+        "Employee Name: Jane Doe\n"
+        "Total Hours: 45.5\n"
+        "Gross Pay: $1,234.50\n"
+        "Net Pay: $987.65\n"
+    )
+    return fields + filler if fields_first else filler + fields
+
+
+def legacy_parse(text: str) -> dict:
+    """The original parse loop: one re.search per pattern over the whole text"""
+    results = {}
+    for key, pattern_list in server_new.PaystubProcessor.PATTERNS.items():
+        for pattern in pattern_list:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                value = match.group(1).replace(',', '')
+                try:
+                    results[key] = float(value) if key != 'employee_name' else value.strip()
+                    break
+                except ValueError:
+                    continue
+        if key not in results:
+            results[key] = None
+    return results
+
+
+def bench_field_extractor() -> dict:
+    """Compare the single-pass FieldExtractor with the per-pattern regex cascade"""
+    extractor = server_new.FieldExtractor(server_new.PaystubProcessor.PATTERNS)
+    results = {}
+    for layout, fields_first in (('fields_first', True), ('fields_last', False)):
+        for lines in (100, 1000, 10000, 50000):
+            text = synthetic_stub_text(lines, fields_first)
+            assert extractor.extract(text) == legacy_parse(text)
+            legacy = timed(legacy_parse, text)
+            single_pass = timed(extractor.extract, text)
+            results[f'{layout}_{len(text)}_chars'] = {
+                'legacy_seconds': round(legacy, 6),
+                'single_pass_seconds': round(single_pass, 6),
+                'speedup': round(legacy / single_pass, 2)
+            }
+    return results
+
+
+def synthetic_pay_periods(rows: int, seed: int = 1) -> dict:
+    """Build columns of pay periods around the minimum wage and overtime boundaries"""
+    rng = np.random.default_rng(seed)
+    hours = np.round(rng.uniform(0, 80, rows), 2)
+    hours[rng.random(rows) < 0.05] = 40.0
+    hours[rng.random(rows) < 0.02] = 0.0
+    rate = rng.uniform(server_new.MINIMUM_WAGE * 0.8, server_new.MINIMUM_WAGE * 2, rows)
+    overtime = np.maximum(hours - 40, 0) * rate * rng.uniform(1.0, 2.0, rows)
+    gross = np.round(np.minimum(hours, 40) * rate + overtime, 2)
+    net = np.round(gross * rng.uniform(0.6, 0.9, rows), 2)
+    net[rng.random(rows) < 0.02] = 0.0
+    counts = rng.integers(0, 4, rows)
+    return {
+        'net_pay': net,
+        'gross_pay': gross,
+        'total_hours': hours,
+        'exceeded_shifts_count': counts,
+        'shifts_exceeded_10_hours': counts > 0
+    }
+
+
+def bench_compliance_batch() -> dict:
+    """Compare rows per second of the scalar and vectorized compliance checks"""
+    processor = server_new.processor
+    results = {}
+    for rows in (1000, 10000, 100000):
+        columns = synthetic_pay_periods(rows)
+        records = [
+            (
+                {'net_pay': float(net), 'gross_pay': float(gross), 'total_hours': float(hours)},
+                {'shifts_exceeded_10_hours': bool(flag), 'exceeded_shifts_count': int(count)}
+            )
+            for net, gross, hours, count, flag in zip(
+                columns['net_pay'], columns['gross_pay'], columns['total_hours'],
+                columns['exceeded_shifts_count'], columns['shifts_exceeded_10_hours']
+            )
+        ]
+
+        def scalar():
+            return [processor.perform_compliance_checks(data, user_input) for data, user_input in records]
+
+        batch = processor.perform_compliance_checks_batch(**columns)
+        for i, expected in enumerate(scalar()):
+            for name in ('minimum_wage', 'overtime_compliant', 'total_compensation_valid',
+                         'long_shift_additional_pay_violation'):
+                assert bool(batch[name][i]) == expected[name], (name, i)
+            assert batch['additional_pay_owed'][i] == expected.get('additional_pay_owed', 0.0), i
+
+        scalar_seconds = timed(scalar, repeat=3)
+        batch_seconds = timed(lambda: processor.perform_compliance_checks_batch(**columns), repeat=3)
+        results[f'{rows}_rows'] = {
+            'scalar_rows_per_second': round(rows / scalar_seconds),
+            'batch_rows_per_second': round(rows / batch_seconds),
+            'speedup': round(scalar_seconds / batch_seconds, 1)
+        }
+    return results
+
+
+def legacy_render(employee_data: dict, compliance_results: dict, user_input: dict = None) -> bytes:
+    """The original report renderer: the whole page laid out with FPDF calls on every report"""
+    if user_input is None:
+        user_input = {}
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Report Title
+    pdf.set_text_color(0, 0, 0)  # Black
+    pdf.set_font("Arial", 'B', 14)  # Larger, bold font for title
+    pdf.cell(0, 10, "Pay Stub Compliance Report", ln=True, align='C')
+    pdf.ln(10)
+
+    # Employee Information
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, f"Employee: {employee_data.get('employee_name', 'Unknown')}", ln=True)
+    pdf.ln(5)
+
+    # Paystub Details
+    pdf.set_font("Arial", 'B', 12)  # Bold for section title
+    pdf.cell(0, 10, "Paystub Details:", ln=True)
+    pdf.set_font("Arial", '', 12)  # Back to normal
+
+    pdf.cell(0, 10, f"Total Hours: {employee_data.get('total_hours', 'N/A')}", ln=True)
+
+    # Format currency with two decimal places
+    gross_pay = employee_data.get('gross_pay', 'N/A')
+    if isinstance(gross_pay, (int, float)):
+        gross_pay = f"${gross_pay:.2f}"
+    elif gross_pay != 'N/A':
+        gross_pay = f"${gross_pay}"
+
+    net_pay = employee_data.get('net_pay', 'N/A')
+    if isinstance(net_pay, (int, float)):
+        net_pay = f"${net_pay:.2f}"
+    elif net_pay != 'N/A':
+        net_pay = f"${net_pay}"
+
+    pdf.cell(0, 10, f"Gross Pay: {gross_pay}", ln=True)
+    pdf.cell(0, 10, f"Net Pay: {net_pay}", ln=True)
+    pdf.ln(5)
+
+    # Compliance Checks
+    pdf.set_font("Arial", 'B', 12)  # Bold for section title
+    pdf.cell(0, 10, "Compliance Check Results:", ln=True)
+    pdf.set_font("Arial", '', 12)  # Back to normal
+
+    for check, result in compliance_results.items():
+        if not isinstance(result, bool):  # Skip amounts and the wage rule
+            continue
+
+        check_name = check.replace('_', ' ').title()
+
+        # First part of text - always black
+        pdf.set_text_color(0, 0, 0)  # Black
+        pdf.cell(pdf.get_string_width(f"{check_name}: "), 10, f"{check_name}: ")
+
+        # Status text with color
+        if result:
+            if check == 'long_shift_additional_pay_violation':
+                pdf.set_text_color(220, 0, 0)  # Red for VIOLATION
+                status = "VIOLATION"
+            else:
+                pdf.set_text_color(0, 128, 0)  # Green for PASSED
+                status = "PASSED"
+        else:
+            if check == 'long_shift_additional_pay_violation':
+                pdf.set_text_color(0, 128, 0)  # Green for NO VIOLATION
+                status = "NO VIOLATION"
+            else:
+                pdf.set_text_color(220, 0, 0)  # Red for FAILED
+                status = "FAILED"
+
+        pdf.cell(0, 10, status, ln=True)
+
+    rule = compliance_results.get('wage_rule') or server_new.wage_rules.resolve(user_input)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(5)
+    pdf.set_font("Arial", '', 10)
+    pdf.multi_cell(0, 8,
+        f"Rules applied: {rule.get('name') or 'Default wage rule'} "
+        f"({rule['jurisdiction']}, effective {rule['effective_date']}); "
+        f"minimum wage ${rule['minimum_wage']:.2f}/hour, overtime at {rule['overtime_rate']}x"
+    )
+    pdf.set_font("Arial", '', 12)
+
+    # Add Long Shift alert if applicable
+    if compliance_results.get('long_shift_additional_pay_violation'):
+        additional_pay = compliance_results.get('additional_pay_owed', 0)
+        exceeded_shifts_count = user_input.get('exceeded_shifts_count', 0)
+
+        pdf.ln(10)
+        pdf.set_text_color(255, 128, 0)  # Orange for Pro Tip
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 10, "IMPORTANT: Long Shift Compensation Alert!", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", '', 12)
+        pdf.multi_cell(0, 10,
+            f"Under {rule.get('name') or 'your local labor law'}, for each shift exceeding "
+            f"{rule['long_shift_threshold']} hours, you are owed an additional {rule['long_shift_bonus']} "
+            f"hour at minimum wage (${rule['minimum_wage']}/hour). "
+            f"With {exceeded_shifts_count} shifts exceeding {rule['long_shift_threshold']} hours, "
+            f"total additional compensation: ${additional_pay:.2f}"
+        )
+
+        pdf.ln(5)
+        pdf.set_text_color(255, 128, 0)  # Orange for Pro Tip
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 10, "PRO TIP: Automate Your Wage Tracking!", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", '', 12)
+        pdf.multi_cell(0, 10,
+            "Pro Tip automatically tracks and calculates these "
+            "complex wage requirements, ensuring you never miss out on "
+            "your rightful compensation. Upgrade to simplify your "
+            "wage compliance monitoring!"
+        )
+
+    # Reset text color to black for any following content
+    pdf.set_text_color(0, 0, 0)
+
+    # Add timestamp at the bottom
+    pdf.ln(10)
+    pdf.set_font("Arial", '', 10)
+    pdf.set_text_color(128, 128, 128)  # Gray
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    pdf.cell(0, 10, f"Report generated: {timestamp}", ln=True, align='C')
+
+    # FPDF 1.x returns the document as a latin-1 string
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def synthetic_reports(count: int, seed: int = 1) -> list:
+    """Build report inputs with a mix of passing, failing and long shift results"""
+    rng = random.Random(seed)
+    rule = server_new.wage_rules.resolve({})
+    reports = []
+    for i in range(count):
+        hours = round(rng.uniform(20, 60), 2)
+        gross = round(hours * rng.uniform(10, 30), 2)
+        checks = {name: rng.random() < 0.7 for name in server_new.ReportRenderer.CHECKS}
+        checks['additional_pay_owed'] = round(rng.uniform(0, 80), 2)
+        checks['wage_rule'] = rule
+        reports.append((
+            {'employee_name': f'Employee {i}', 'total_hours': hours, 'gross_pay': gross, 'net_pay': round(gross * 0.8, 2)},
+            checks,
+            {'exceeded_shifts_count': rng.randint(0, 4)}
+        ))
+    return reports
+
+
+def bench_report_renderer() -> dict:
+    """Compare reports per second on one core of the legacy renderer and ReportRenderer"""
+    renderer = server_new.report_renderer
+    reports = synthetic_reports(200)
+
+    def per_second(fn) -> int:
+        return round(len(reports) / timed(fn, repeat=3))
+
+    return {
+        'legacy_reports_per_second': per_second(lambda: [legacy_render(*report) for report in reports]),
+        'render_reports_per_second': per_second(lambda: [renderer.render(*report) for report in reports]),
+        'batch_reports_per_second': per_second(lambda: renderer.render_batch(reports)),
+        'combined_reports_per_second': per_second(lambda: renderer.render_batch(reports, combined=True)),
+        'legacy_bytes_per_report': round(sum(len(legacy_render(*report)) for report in reports) / len(reports)),
+        'render_bytes_per_report': round(sum(len(renderer.render(*report)) for report in reports) / len(reports)),
+        'combined_bytes_per_report': round(len(renderer.render_batch(reports, combined=True)) / len(reports))
+    }
+
+
+class MemoryBlob:
+    """Just enough of a GCS blob to store uploads and reports and sign links"""
+
+    def __init__(self, bucket: 'MemoryBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_disposition = None
+
+    def exists(self) -> bool:
+        return self.name in self.bucket.objects
+
+    def upload_from_string(self, data: bytes, content_type: str = None, if_generation_match: int = None):
+        if if_generation_match == 0 and self.name in self.bucket.objects:
+            raise server_new.gcs_exceptions.PreconditionFailed(self.name)
+        self.bucket.objects[self.name] = data
+
+    def upload_from_file(self, file, if_generation_match: int = None):
+        self.upload_from_string(file.read(), if_generation_match=if_generation_match)
+
+    def download_as_bytes(self, start: int = 0, end: int = None) -> bytes:
+        data = self.bucket.objects[self.name]
+        # Like GCS, end is the inclusive last byte
+        return data[start:None if end is None else end + 1]
+
+    def download_to_filename(self, filename: str):
+        with open(filename, 'wb') as f:
+            f.write(self.bucket.objects[self.name])
+
+    def generate_signed_url(self, **kwargs) -> str:
+        self.bucket.signed += 1
+        return f"https://storage.googleapis.com/benchmark/{self.name}?X-Goog-Signature={'0' * 512}"
+
+
+class MemoryBucket:
+    """In-memory stand-in for the report bucket"""
+
+    def __init__(self):
+        self.objects = {}
+        self.signed = 0
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+
+def bench_report_delivery() -> dict:
+    """Compare email sizes of attached reports and signed download links"""
+    storage_service = server_new.processor.storage_service
+    bucket, storage_service.bucket = storage_service.bucket, MemoryBucket()
+    default_delivery = server_new.REPORT_DELIVERY
+    reports = synthetic_reports(200)
+    report = server_new.report_renderer.render(*reports[0])
+    flagged_report = server_new.report_renderer.render_batch(reports, combined=True)
+    summary = {'employees': len(reports), 'flagged': len(reports), 'incomplete': 0}
+
+    results = {}
+    try:
+        with server_new.app.app_context():
+            for delivery in ('attachment', 'link'):
+                server_new.REPORT_DELIVERY = delivery
+                report_email = server_new.processor.report_message('user@example.com', report, 'report')
+                # A retried job stores its report once and reuses the signed link
+                server_new.processor.report_message('user@example.com', report, 'report')
+                register_email = server_new.processor.register_summary_message(
+                    'employer@example.com', summary, b'employee\n', flagged_report
+                )
+                results[delivery] = {
+                    'report_email_bytes': len(report_email.as_string()),
+                    'register_email_bytes': len(register_email.as_string())
+                }
+        results['link']['stored_bytes'] = sum(len(data) for data in storage_service.bucket.objects.values())
+        results['link']['urls_signed'] = storage_service.bucket.signed
+    finally:
+        server_new.REPORT_DELIVERY = default_delivery
+        storage_service.bucket = bucket
+    return results
+
+
+class MemoryFirestore:
+    """Just enough of a Firestore client for status documents and rollups, with a simulated round trip per request.
+
+    Top-level documents are stored by ID, whatever their collection;
+    documents in subcollections by their path below that ID.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.documents = {}
+        self.commits = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+        # Held from a transaction's begin to its commit, so transactions run one at a time
+        self._transaction_lock = threading.Lock()
+
+    def collection(self, name: str) -> 'MemoryFirestore':
+        return self
+
+    def document(self, doc_id: str) -> 'MemoryDocument':
+        return MemoryDocument(self, doc_id)
+
+    def batch(self) -> 'MemoryWriteBatch':
+        return MemoryWriteBatch(self)
+
+    def transaction(self) -> 'MemoryTransaction':
+        return MemoryTransaction(self)
+
+    def get_all(self, references: list, field_paths: list = None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.reads += len(references)
+            documents = [self.documents.get(reference.path) for reference in references]
+        for reference, document in zip(references, documents):
+            if document is not None and field_paths:
+                document = {name: document[name] for name in field_paths if name in document}
+            yield MemorySnapshot(reference.id, document, reference)
+
+    def _write(self, path: str, document: dict, merge: bool = False):
+        """Store a document; with merge, fields are updated and Increment transforms applied. Call with _lock held"""
+        if not merge:
+            self.documents[path] = document
+            return
+        merged = dict(self.documents.get(path) or {})
+        for name, value in document.items():
+            if isinstance(value, server_new.firestore.Increment):
+                value = merged.get(name, 0) + value.value
+            merged[name] = value
+        self.documents[path] = merged
+
+
+class MemoryCollection:
+    """Subcollection of a MemoryFirestore document"""
+
+    def __init__(self, client: MemoryFirestore, path: str):
+        self.client = client
+        self.path = path
+
+    def document(self, doc_id: str) -> 'MemoryDocument':
+        return MemoryDocument(self.client, doc_id, f"{self.path}/{doc_id}")
+
+
+class MemoryDocument:
+    """Document reference of MemoryFirestore"""
+
+    def __init__(self, client: MemoryFirestore, doc_id: str, path: str = None):
+        self.client = client
+        self.id = doc_id
+        self.path = path or doc_id
+
+    def collection(self, name: str) -> MemoryCollection:
+        return MemoryCollection(self.client, f"{self.path}/{name}")
+
+    def get(self, transaction: 'MemoryTransaction' = None) -> 'MemorySnapshot':
+        time.sleep(self.client.latency)
+        with self.client._lock:
+            self.client.reads += 1
+            return MemorySnapshot(self.id, self.client.documents.get(self.path), self)
+
+    def set(self, document: dict, merge: bool = False):
+        time.sleep(self.client.latency)
+        with self.client._lock:
+            self.client.commits += 1
+            self.client._write(self.path, document, merge)
+
+
+class MemorySnapshot:
+    """Document snapshot of MemoryFirestore"""
+
+    def __init__(self, doc_id: str, document: dict, reference: MemoryDocument = None):
+        self.id = doc_id
+        self.document = document
+        self.exists = document is not None
+        self.reference = reference
+
+    def to_dict(self) -> dict:
+        return dict(self.document)
+
+
+class MemoryWriteBatch:
+    """Write batch of MemoryFirestore"""
+
+    def __init__(self, client: MemoryFirestore):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference: MemoryDocument, document: dict):
+        self.writes.append((reference.path, document))
+
+    def commit(self):
+        time.sleep(self.client.latency)
+        with self.client._lock:
+            self.client.commits += 1
+            self.client.documents.update(self.writes)
+
+
+class MemoryTransaction:
+    """Transaction of MemoryFirestore, driven by firestore.transactional through the same private hooks as a real one"""
+
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, client: MemoryFirestore):
+        self.client = client
+        self.writes = []
+        self._id = None
+
+    def set(self, reference: MemoryDocument, document: dict, merge: bool = False):
+        self.writes.append((reference.path, document, merge))
+
+    def _clean_up(self):
+        self.writes = []
+
+    def _begin(self, retry_id: bytes = None):
+        self.client._transaction_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        time.sleep(self.client.latency)
+        try:
+            with self.client._lock:
+                self.client.commits += 1
+                for path, document, merge in self.writes:
+                    self.client._write(path, document, merge)
+        finally:
+            self._end()
+
+    def _rollback(self):
+        self._end()
+
+    def _end(self):
+        self.writes = []
+        if self._id is not None:
+            self._id = None
+            self.client._transaction_lock.release()
+
+
+def bench_status_writer(jobs: int = 200, threads: int = 8, latency: float = 0.02, work: float = 0.05) -> dict:
+    """Compare Firestore commits and per-job status time with every update written through and write-behind"""
+    db = server_new.db
+    results = {}
+    try:
+        for interval in (0, server_new.STATUS_FLUSH_INTERVAL or 0.5):
+            server_new.db = client = MemoryFirestore(latency)
+            server_new.status_writer = writer = server_new.StatusWriter('processing_status', interval, 500)
+            status_seconds = []
+
+            def job(i: int):
+                file_url = f'paystub_uploads/sha256/{i:064x}.pdf'
+                seconds = 0.0
+                for status in ('processing', 'processing', 'completed'):
+                    start = time.perf_counter()
+                    server_new.processor.update_processing_status(file_url, 'user@example.com', status)
+                    seconds += time.perf_counter() - start
+                    time.sleep(work / 2)
+                status_seconds.append(seconds)
+
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(job, range(jobs)))
+            writer.flush()
+            assert all(doc['status'] == 'completed' for doc in client.documents.values())
+            results['write_through' if interval <= 0 else f'write_behind_{interval}s'] = {
+                'commits_per_job': round(client.commits / jobs, 2),
+                'status_ms_per_job': round(1000 * sum(status_seconds) / jobs, 1)
+            }
+    finally:
+        server_new.db = db
+        server_new.status_writer = server_new.StatusWriter(
+            'processing_status', server_new.STATUS_FLUSH_INTERVAL, server_new.STATUS_BATCH_SIZE
+        )
+    return results
+
+
+def bench_status_push(jobs: int = 20, steps: int = 4, step_seconds: float = 0.5, poll_seconds: float = 0.1) -> dict:
+    """Compare status requests and Firestore reads of polling /check-status with /status-events and long polling"""
+    db, writer, broker = server_new.db, server_new.status_writer, server_new.status_broker
+    server_new.limiter.enabled = False
+    client = server_new.app.test_client()
+    results = {}
+
+    def run_job(file_url: str):
+        for step in range(steps):
+            status = 'completed' if step == steps - 1 else 'processing'
+            server_new.processor.update_processing_status(file_url, 'user@example.com', status, f'Step {step}')
+            time.sleep(step_seconds)
+
+    def poll(file_url: str) -> int:
+        requests = 0
+        while True:
+            requests += 1
+            if client.get('/check-status', query_string={'file_url': file_url}).get_json()['status'] == 'completed':
+                return requests
+            time.sleep(poll_seconds)
+
+    def stream(file_url: str) -> int:
+        body = client.get('/status-events', query_string={'file_url': file_url}).get_data(as_text=True)
+        assert '"status": "completed"' in body
+        return 1
+
+    def long_poll(file_url: str) -> int:
+        requests, since = 0, None
+        while True:
+            requests += 1
+            event = client.get('/check-status', query_string={'file_url': file_url, 'wait': 30, 'since': since}).get_json()
+            if event['status'] == 'completed':
+                return requests
+            since = event['event_id']
+
+    try:
+        for name, watch in (('polling', poll), ('events', stream), ('long_polling', long_poll)):
+            # Every status is written through so each poll reads what is stored
+            server_new.db = firestore = MemoryFirestore(0)
+            server_new.status_writer = server_new.StatusWriter('processing_status', 0, 500)
+            server_new.status_broker = server_new.StatusBroker(2 * jobs, 4096, listen=False, local_jobs=True)
+            file_urls = [f'paystub_uploads/sha256/{name}{i:058x}.pdf' for i in range(jobs)]
+            for file_url in file_urls:
+                server_new.processor.update_processing_status(file_url, 'user@example.com', 'uploaded', write_through=True)
+
+            with ThreadPoolExecutor(2 * jobs) as executor:
+                watchers = [executor.submit(watch, file_url) for file_url in file_urls]
+                list(executor.map(run_job, file_urls))
+                requests = sum(watcher.result() for watcher in watchers)
+            results[name] = {
+                'requests_per_job': round(requests / jobs, 1),
+                'firestore_reads_per_job': round(firestore.reads / jobs, 1)
+            }
+    finally:
+        server_new.db, server_new.status_writer, server_new.status_broker = db, writer, broker
+        server_new.limiter.enabled = True
+    return results
+
+
+def bench_status_batch(files: int = 200, latency: float = 0.01) -> dict:
+    """Compare one /check-status request per file with /check-status-batch, with a simulated read round trip"""
+    db, writer, cache = server_new.db, server_new.status_writer, server_new.status_cache
+    server_new.limiter.enabled = False
+    client = server_new.app.test_client()
+    file_urls = [f'paystub_uploads/sha256/{i:064x}.pdf' for i in range(files)]
+    try:
+        server_new.db = firestore = MemoryFirestore(latency)
+        server_new.status_writer = server_new.StatusWriter('processing_status', 0, 500)
+        server_new.status_cache = server_new.StatusCache(60, files)
+        for file_url in file_urls:
+            server_new.processor.update_processing_status(file_url, 'user@example.com', 'completed')
+
+        def per_file():
+            for file_url in file_urls:
+                client.get('/check-status', query_string={'file_url': file_url})
+
+        def batch():
+            client.post('/check-status-batch', json={'file_urls': file_urls})
+
+        results = {}
+        for name, fn in (('per_file', per_file), ('batch', batch), ('batch_cached', batch)):
+            reads = firestore.reads
+            start = time.perf_counter()
+            fn()
+            results[name] = {
+                'ms': round(1000 * (time.perf_counter() - start), 1),
+                'firestore_reads': firestore.reads - reads
+            }
+        return results
+    finally:
+        server_new.db, server_new.status_writer, server_new.status_cache = db, writer, cache
+        server_new.limiter.enabled = True
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Accept one SMTP session and discard its messages"""
+
+    def handle(self):
+        """Answer SMTP commands until QUIT or disconnect"""
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        # Stands in for the TLS handshake and AUTH round trips of a real server
+        time.sleep(sink.handshake_delay)
+        self.wfile.write(b"220 sink ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.wfile.write(b"250-sink\r\n250 8BITMIME\r\n")
+            elif command == b"DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with sink.lock:
+                    sink.messages += 1
+                self.wfile.write(b"250 OK\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Local debugging SMTP server on a free port that counts and discards mail"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake_delay: float = 0.0):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.handshake_delay = handshake_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def bench_smtp_pool() -> dict:
+    """Compare messages per second of a connection per message (mail.send) with the pool and the outbox"""
+    report = server_new.report_renderer.render(*synthetic_reports(1)[0])
+    results = {}
+    for delay in (0.0, 0.05):
+        count = 40 if delay else 400
+        sink = SMTPSink(delay)
+        state = server_new.mail.init_mail({
+            'MAIL_SERVER': '127.0.0.1',
+            'MAIL_PORT': sink.server_address[1],
+            'MAIL_DEFAULT_SENDER': 'bench@example.com'
+        })
+        messages = [server_new.processor.report_message(f'user{i}@example.com', report) for i in range(count)]
+
+        def per_message_connection():
+            with server_new.app.app_context():
+                for message in messages:
+                    with Connection(state) as connection:
+                        connection.send(message)
+
+        pool = server_new.SMTPConnectionPool(state, 4, 60, 1000)
+
+        def pooled():
+            for message in messages:
+                pool.send(message)
+
+        outbox = server_new.MailOutbox(pool, 2, 10, count)
+
+        def outboxed():
+            for message in messages:
+                outbox.submit(message)
+            outbox.flush(300)
+
+        timings = {}
+        for name, fn in (('per_message_connection', per_message_connection), ('pool', pooled), ('outbox', outboxed)):
+            before = sink.connections
+            seconds = timed(fn, repeat=1)
+            timings[name] = {
+                'messages_per_second': round(count / seconds, 1),
+                'connections': sink.connections - before
+            }
+        assert sink.messages == 3 * count
+        sink.shutdown()
+        results[f'handshake_{int(delay * 1000)}ms'] = timings
+    return results
+
+
+def bench_metrics(observations: int = 200000, threads: int = 8) -> dict:
+    """Cost of recording metrics and rendering /metrics, next to the time to process one paystub report"""
+    registry = server_new.MetricsRegistry('bench')
+    histogram = registry.histogram('stage_seconds', 'Benchmark stage latency', server_new.LATENCY_BUCKETS, ('stage',))
+    counter = registry.counter('stage_failures_total', 'Benchmark stage failures', ('stage',))
+
+    def observe(count: int = observations):
+        for i in range(count):
+            histogram.observe(0.0001 * (i % 1000), 'extract')
+
+    def observe_threaded():
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(observe, [observations // threads] * threads))
+
+    def increment():
+        for _ in range(observations):
+            counter.inc('extract')
+
+    def stage(job):
+        return True
+
+    timed_stage = server_new.timed_stage('benchmark')(stage)
+
+    def plain_stages():
+        for _ in range(observations):
+            stage(None)
+
+    def timed_stages():
+        for _ in range(observations):
+            timed_stage(None)
+
+    for name in ('download', 'extract', 'parse', 'check', 'render', 'email', 'rollup', 'status_write'):
+        histogram.observe(0.01, name)
+        counter.inc(name)
+    report = synthetic_reports(1)[0]
+    per_call = {
+        name: round(1e9 * timed(fn, repeat=3) / observations, 1)
+        for name, fn in (
+            ('histogram_observe', observe),
+            (f'histogram_observe_{threads}_threads', observe_threaded),
+            ('counter_inc', increment)
+        )
+    }
+    # The decorator's cost on top of calling the stage directly
+    per_call['timed_stage_overhead'] = round(
+        1e9 * (timed(timed_stages, repeat=3) - timed(plain_stages, repeat=3)) / observations, 1
+    )
+    return {
+        'ns_per_call': per_call,
+        'render_ms': round(1000 * timed(registry.render), 3),
+        'render_report_ms': round(1000 * timed(server_new.report_renderer.render, *report), 3)
+    }
+
+
+def bench_stack_sampler(seconds: float = 3.0, threads: int = 4) -> dict:
+    """Field extraction throughput on several threads with and without the stack sampler running"""
+    extractor = server_new.FieldExtractor(server_new.PaystubProcessor.PATTERNS)
+    text = synthetic_stub_text(1000)
+
+    def throughput() -> float:
+        stop = threading.Event()
+        counts = [0] * threads
+
+        def work(index):
+            while not stop.is_set():
+                extractor.extract(text)
+                counts[index] += 1
+
+        workers = [threading.Thread(target=work, args=(i,), name=f'bench-{i}') for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        return sum(counts) / seconds
+
+    results = {'baseline_per_second': round(throughput(), 1)}
+    for interval in (0.01, 0.001):
+        sampler = server_new.StackSampler(seconds, server_new.PROFILE_MAX_OVERHEAD)
+        session = {}
+        thread = threading.Thread(target=lambda: session.update(sampler.sample(seconds, interval, 'bench')))
+        thread.start()
+        sampled = throughput()
+        thread.join()
+        results[f'sampling_every_{interval * 1000:g}ms'] = {
+            'per_second': round(sampled, 1),
+            'slowdown': round(1 - sampled / results['baseline_per_second'], 4),
+            'samples': session['samples'],
+            'reported_overhead': session['overhead']
+        }
+    return results
+
+
+def bench_memory_tracing(jobs: int = 50) -> dict:
+    """Extract-and-render throughput without tracemalloc and while tracing, with the per-stage peaks it records"""
+    reports = synthetic_reports(jobs)
+    pdfs = [server_new.render_report(*report) for report in reports]
+    stages = (
+        ('extract', lambda i: server_new.extract_and_parse_pdf(pdfs[i])),
+        ('render', lambda i: server_new.render_report(*reports[i]))
+    )
+
+    def run(traced: bool = False):
+        for i in range(jobs):
+            job = {'file_url': f'bench/{i}.pdf'}
+            if traced:
+                tracer.mark_job(job)
+            for name, stage in stages:
+                with tracer.stage(job, name) if traced else contextlib.nullcontext():
+                    stage(i)
+            if traced:
+                tracer.finish_job(job)
+
+    results = {'untraced_jobs_per_second': round(jobs / timed(run, repeat=3), 1)}
+    for frames in (1, 10):
+        tracer = server_new.AllocationTracer(frames, 0, jobs, 10)
+        seconds = timed(run, True, repeat=3)
+        peaks = {
+            name: round(sum(job['stages'][name]['peak_bytes'] for job in tracer.recent) / len(tracer.recent))
+            for name, _ in stages
+        }
+        results[f'traced_{frames}_frames'] = {
+            'jobs_per_second': round(jobs / seconds, 1),
+            'slowdown': round(seconds * results['untraced_jobs_per_second'] / jobs, 2),
+            'avg_stage_peak_bytes': peaks,
+            'avg_retained_bytes': round(sum(job['retained_bytes'] for job in tracer.recent) / len(tracer.recent))
+        }
+    return results
+
+
+# Label spellings of each field, in the order of PaystubProcessor.PATTERNS
+PAYSTUB_LABELS = {
+    'employee_name': ('Employee Name:', 'Name:', 'Employee:'),
+    'net_pay': ('Net Pay:', 'Net Pay', 'Total Net Pay:'),
+    'total_hours': ('Total Hours:', 'Hours Worked:', 'Hours:'),
+    'gross_pay': ('Gross Pay:', 'Gross Earnings:', 'Total Gross:')
+}
+PAYSTUB_FIELDS = ('employee_name', 'total_hours', 'gross_pay', 'net_pay')
+EARNING_ROWS = ('Regular', 'Overtime', 'Holiday', 'Vacation', 'Sick Leave', 'Bonus', 'Shift Differential')
+DEDUCTION_ROWS = (
+    'Federal Income Tax', 'Social Security', 'Medicare', 'State Income Tax', 'State Disability',
+    '401(k)', 'Medical', 'Dental', 'Vision', 'Union Dues'
+)
+FIRST_NAMES = ('Jane', 'John', 'Maria', 'Wei', 'Aisha', 'Carlos', 'Priya', 'Tomasz')
+LAST_NAMES = ('Doe', 'Smith', 'Garcia', 'Chen', 'Okafor', 'Nguyen', 'Patel', 'Kowalski')
+ROWS_PER_PAGE = 50
+
+
+def synthetic_employee(rng: random.Random) -> dict:
+    """Field values of one pay period, some below the minimum wage or without overtime premium"""
+    hours = round(rng.uniform(20, 60), 2)
+    rate = rng.uniform(server_new.MINIMUM_WAGE * 0.9, server_new.MINIMUM_WAGE * 3)
+    gross = round(hours * rate + max(hours - 40, 0) * rate * rng.choice((0, 0.5)), 2)
+    return {
+        'employee_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'total_hours': hours,
+        'gross_pay': gross,
+        'net_pay': round(gross * rng.uniform(0.7, 0.85), 2)
+    }
+
+
+def field_rows(employee: dict, variant: int) -> list:
+    """(label, value) rows of the parsed fields, with label spelling number variant of each"""
+    values = {
+        'employee_name': employee['employee_name'],
+        'total_hours': f"{employee['total_hours']:.2f}",
+        'gross_pay': f"${employee['gross_pay']:,.2f}",
+        'net_pay': f"${employee['net_pay']:,.2f}"
+    }
+    return [(PAYSTUB_LABELS[field][variant], values[field]) for field in PAYSTUB_FIELDS]
+
+
+def table_rows(rng: random.Random, count: int) -> list:
+    """Earnings and deduction rows with hours, current and YTD amounts"""
+    rows = []
+    for _ in range(count):
+        current = rng.uniform(5, 900)
+        rows.append((
+            rng.choice(EARNING_ROWS + DEDUCTION_ROWS),
+            f"{rng.uniform(0, 40):.2f}",
+            f"{current:,.2f}",
+            f"{current * rng.randint(2, 26):,.2f}"
+        ))
+    return rows
+
+
+def page_header(title: str, number: int, count: int) -> tuple:
+    """Employer, pay period and page number row at the top of every page"""
+    return ('Acme Staffing LLC', title, 'Period 09/01/2026 - 09/14/2026', f'Page {number} of {count}')
+
+
+def paystub_pages(employee: dict, variant: int, page_count: int, fields_last: bool, rng: random.Random) -> list:
+    """Rows of a paystub spread over page_count pages, with the fields on the first or the last page"""
+    fields = field_rows(employee, variant)
+    filler = table_rows(rng, page_count * (ROWS_PER_PAGE - 1) - len(fields))
+    body = filler + fields if fields_last else fields + filler
+    per_page = ROWS_PER_PAGE - 1
+    return [
+        [page_header('Earnings Statement', number + 1, page_count)] + body[number * per_page:(number + 1) * per_page]
+        for number in range(page_count)
+    ]
+
+
+def register_pages(employees: list, per_page: int, rng: random.Random) -> list:
+    """Rows of a payroll register with per_page employees on each page"""
+    page_count = -(-len(employees) // per_page)
+    pages = []
+    for number in range(page_count):
+        rows = [page_header('Payroll Register', number + 1, page_count)]
+        for employee in employees[number * per_page:(number + 1) * per_page]:
+            rows += field_rows(employee, 0) + table_rows(rng, 4)
+        pages.append(rows)
+    return pages
+
+
+def render_pdf(pages: list, table: bool = False) -> bytes:
+    """Lay out pages of rows as a text PDF, each row on one line or as table columns"""
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+    pdf.set_font('Helvetica', size=9)
+    for rows in pages:
+        pdf.add_page()
+        for row in rows:
+            if not table:
+                pdf.cell(0, 5, '    '.join(row), ln=1)
+                continue
+            pdf.cell(60, 5, row[0])
+            for column, text in enumerate(row[1:], 1):
+                pdf.cell(130 / (len(row) - 1), 5, text, ln=int(column == len(row) - 1), align='R')
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def scanned_pdf(pages: list, seed: int = 1) -> bytes:
+    """Rasterize pages of rows at 150 dpi with a slight skew and speckle, so the PDF has no text layer"""
+    rng = np.random.default_rng(seed)
+    font = ImageFont.load_default(size=20)
+    directory = tempfile.mkdtemp(prefix='bench_scan_')
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+    try:
+        for number, rows in enumerate(pages):
+            image = Image.new('L', (1240, 1754), 255)
+            draw = ImageDraw.Draw(image)
+            for line, row in enumerate(rows):
+                draw.text((90, 90 + 31 * line), '    '.join(row), fill=30, font=font)
+            image = image.rotate(float(rng.uniform(-1.5, 1.5)), resample=Image.BILINEAR, fillcolor=255)
+            pixels = np.asarray(image).copy()
+            pixels[rng.random(pixels.shape) < 0.003] = 0
+            path = os.path.join(directory, f'page{number}.png')
+            Image.fromarray(pixels).save(path)
+            # FPDF 1.x only embeds images from files
+            pdf.add_page()
+            pdf.image(path, 0, 0, 210, 297)
+        return pdf.output(dest='S').encode('latin-1')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def paystub_corpus(seed: int = 1) -> list:
+    """
+    Build synthetic paystub PDFs together with the field values they were generated from.
+
+    Each layout (fields on one line, table columns, fields on the last page)
+    comes in 1, 3 and 12 pages and cycles through the label spellings of
+    PaystubProcessor.PATTERNS. The scan has no text layer, and the registers
+    hold five employees per page behind the default REGISTER_BOUNDARY_PATTERN.
+
+    :param seed: Seed of the field values and filler rows
+    :return: Dicts with name, kind ('paystub', 'scan' or 'register'), pages, pdf
+        and expected (the employee's fields, or a list of them for a register)
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i, layout in enumerate(('labelled', 'table', 'fields_last')):
+        for j, page_count in enumerate((1, 3, 12)):
+            variant = (i + j) % 3
+            employee = synthetic_employee(rng)
+            pages = paystub_pages(employee, variant, page_count, layout == 'fields_last', rng)
+            corpus.append({
+                'name': f'{layout}_{page_count}p_labels{variant}',
+                'kind': 'paystub',
+                'pages': page_count,
+                'pdf': render_pdf(pages, table=layout == 'table'),
+                'expected': employee
+            })
+
+    employee = synthetic_employee(rng)
+    corpus.append({
+        'name': 'scanned_1p',
+        'kind': 'scan',
+        'pages': 1,
+        'pdf': scanned_pdf(paystub_pages(employee, 0, 1, False, rng), seed),
+        'expected': employee
+    })
+
+    for count in (20, 200):
+        employees = [synthetic_employee(rng) for _ in range(count)]
+        pages = register_pages(employees, 5, rng)
+        corpus.append({
+            'name': f'register_{count}_employees',
+            'kind': 'register',
+            'pages': len(pages),
+            'pdf': render_pdf(pages),
+            'expected': employees
+        })
+    return corpus
+
+
+def field_accuracy(data: dict, expected: dict) -> float:
+    """Share of the fields parsed exactly as generated"""
+    correct = 0
+    for field, value in expected.items():
+        found = data.get(field)
+        if field == 'employee_name' and found:
+            # The name pattern runs on over the following lines
+            found = next((line.strip() for line in found.splitlines() if line.strip()), '')
+        correct += found == value
+    return correct / len(expected)
+
+
+def best_of_rounds(runs: dict, rounds: int) -> dict:
+    """
+    Time every run once per round and keep the best time of each.
+
+    Interleaving the runs keeps a burst of load on the host from landing on
+    every repetition of the same one.
+
+    :param runs: Callables without arguments, by key
+    :param rounds: Number of times each callable runs
+    :return: Best wall time of each key, in seconds
+    """
+    best = dict.fromkeys(runs, float('inf'))
+    for _ in range(rounds):
+        for key, run in runs.items():
+            best[key] = min(best[key], timed(run, repeat=1))
+    return best
+
+
+def bench_paystub_stages(seed: int = 1, rounds: int = 5) -> dict:
+    """Time extract_pdf_text, parse_paystub_data, perform_compliance_checks and generate_compliance_report per corpus file"""
+    directory = tempfile.mkdtemp(prefix='bench_corpus_')
+    processor = server_new.PaystubProcessor(temp_dir=directory)
+    boundary = re.compile(server_new.REGISTER_BOUNDARY_PATTERN, re.IGNORECASE)
+    user_input = {'shifts_exceeded_10_hours': True, 'exceeded_shifts_count': 2}
+    results = {}
+    runs = {}
+    try:
+        for document in paystub_corpus(seed):
+            name = document['name']
+            path = os.path.join(directory, f"{name}.pdf")
+            with open(path, 'wb') as f:
+                f.write(document['pdf'])
+            text = processor.extract_pdf_text(path)
+            entry = results[name] = {'pages': document['pages']}
+            runs[name, 'extract'] = functools.partial(processor.extract_pdf_text, path)
+
+            if document['kind'] == 'scan':
+                entry.update(bench_ocr(document))
+            elif document['kind'] == 'register':
+                segments = [segment.text for segment in server_new.split_register([(1, text)], boundary)]
+                parsed = [processor.parse_paystub_data(segment) for segment in segments]
+                entry['employees_found'] = len(parsed)
+                entry['field_accuracy'] = sum(
+                    field_accuracy(data, employee) for data, employee in zip(parsed, document['expected'])
+                ) / len(document['expected'])
+                runs[name, 'parse'] = lambda segments=segments: [processor.parse_paystub_data(s) for s in segments]
+                runs[name, 'check'] = lambda parsed=parsed: [
+                    processor.perform_compliance_checks(data, user_input) for data in parsed
+                ]
+            else:
+                data = processor.parse_paystub_data(text)
+                checks = processor.perform_compliance_checks(data, user_input)
+                entry['field_accuracy'] = field_accuracy(data, document['expected'])
+                runs[name, 'parse'] = functools.partial(processor.parse_paystub_data, text)
+                runs[name, 'check'] = functools.partial(processor.perform_compliance_checks, data, user_input)
+                runs[name, 'report'] = functools.partial(processor.generate_compliance_report, data, checks, user_input)
+
+        for (name, stage), seconds in best_of_rounds(runs, rounds).items():
+            results[name][f'{stage}_seconds'] = seconds
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for entry in results.values():
+        if 'report_seconds' in entry:
+            entry['total_seconds'] = sum(entry[f'{stage}_seconds'] for stage in ('extract', 'parse', 'check', 'report'))
+        for key, value in entry.items():
+            if isinstance(value, float):
+                entry[key] = round(value, 6 if key.endswith('_seconds') else 4)
+    return results
+
+
+def bench_ocr(document: dict) -> dict:
+    """OCR a scan once with an empty page cache, or report that tesseract or poppler is missing"""
+    extractor = server_new.ocr_extractor
+    if not (extractor.available() and shutil.which('pdftoppm')):
+        return {'ocr': 'unavailable'}
+
+    db = server_new.db
+    try:
+        # Page texts are cached in Firestore; start from an empty in-memory one
+        server_new.db = MemoryFirestore(0)
+        extractor = server_new.OCRExtractor(extractor.runner, server_new.ResultCache('ocr_pages', 100), extractor.lang, 0)
+        start = time.perf_counter()
+        result = extractor.extract_and_parse(document['pdf'])
+        return {
+            'ocr_seconds': time.perf_counter() - start,
+            'field_accuracy': field_accuracy(result['data'], document['expected'])
+        }
+    finally:
+        server_new.db = db
+
+
+def bench_end_to_end(seed: int = 1, rounds: int = 5) -> dict:
+    """Run process_paystub_async on the corpus paystubs against in-memory GCS, Firestore and a local SMTP server"""
+    documents = [document for document in paystub_corpus(seed) if document['kind'] == 'paystub']
+    storage_service = server_new.processor.storage_service
+    saved = (
+        storage_service.bucket, server_new.db, server_new.status_writer, server_new.mail_outbox,
+        server_new.RESULT_CACHE_ENABLED, server_new.ROLLUPS_ENABLED
+    )
+    sink = SMTPSink()
+    state = server_new.mail.init_mail({
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': sink.server_address[1],
+        'MAIL_DEFAULT_SENDER': 'bench@example.com'
+    })
+    results = {}
+    try:
+        storage_service.bucket = bucket = MemoryBucket()
+        server_new.db = firestore = MemoryFirestore(0)
+        server_new.status_writer = server_new.StatusWriter('processing_status', 0, 500)
+        server_new.mail_outbox = server_new.MailOutbox(server_new.SMTPConnectionPool(state, 2, 60, 1000), 2, 10, 100)
+        # Every run should do the full work rather than reuse an earlier result
+        server_new.RESULT_CACHE_ENABLED = False
+        server_new.ROLLUPS_ENABLED = False
+
+        user_input = {'shifts_exceeded_10_hours': True, 'exceeded_shifts_count': 2}
+
+        def run(file_url: str):
+            doc_id = server_new.processor.generate_document_id(file_url)
+            firestore.documents.pop(doc_id, None)
+            server_new.process_paystub_async(file_url, 'user@example.com', user_input)
+            # The job ends when the outbox has sent the email and written the final status
+            while firestore.documents.get(doc_id, {}).get('status') not in ('completed', 'failed'):
+                time.sleep(0.001)
+            assert firestore.documents[doc_id]['status'] == 'completed', firestore.documents[doc_id].get('message')
+
+        runs = {}
+        for document in documents:
+            # Stored under the content address, processed through a per-upload handle like /upload-paystub returns
+            content_hash = hashlib.sha256(document['pdf']).hexdigest()
+            bucket.objects[f"{server_new.UPLOAD_PREFIX}{content_hash}.pdf"] = document['pdf']
+            file_url = f"{server_new.UPLOAD_PREFIX}{content_hash}/{uuid.uuid4().hex}.pdf"
+            runs[document['name']] = functools.partial(run, file_url)
+
+        for document, seconds in zip(documents, best_of_rounds(runs, rounds).values()):
+            results[document['name']] = {'pages': document['pages'], 'job_seconds': round(seconds, 6)}
+
+        total = sum(entry['job_seconds'] for entry in results.values())
+        results['jobs_per_second'] = round(len(documents) / total, 2)
+        results['emails_sent'] = sink.messages
+    finally:
+        (storage_service.bucket, server_new.db, server_new.status_writer, server_new.mail_outbox,
+         server_new.RESULT_CACHE_ENABLED, server_new.ROLLUPS_ENABLED) = saved
+        sink.shutdown()
+    return results
+
+
+BENCHMARKS = {
+    'field_extractor': bench_field_extractor,
+    'compliance_batch': bench_compliance_batch,
+    'report_renderer': bench_report_renderer,
+    'report_delivery': bench_report_delivery,
+    'status_writer': bench_status_writer,
+    'status_push': bench_status_push,
+    'status_batch': bench_status_batch,
+    'smtp_pool': bench_smtp_pool,
+    'metrics': bench_metrics,
+    'stack_sampler': bench_stack_sampler,
+    'memory_tracing': bench_memory_tracing,
+    'paystub_stages': bench_paystub_stages,
+    'end_to_end': bench_end_to_end,
+}
+
+
+# Timings below this many seconds are within run-to-run noise
+REGRESSION_FLOOR_SECONDS = 0.001
+
+
+def find_regressions(results, baseline, tolerance: float, path: str = '') -> list:
+    """
+    Compare benchmark results with a baseline run of the same benchmarks.
+
+    Keys ending in _seconds or _ms are lower-is-better, keys containing
+    per_second or speedup are higher-is-better, and accuracies must not drop
+    at all. Anything else (sizes, counts, labels) is informational.
+
+    :param results: Results of this run
+    :param baseline: Results of the baseline run
+    :param tolerance: Allowed relative slowdown, e.g. 0.5 for 50%
+    :return: Descriptions of the metrics that got worse
+    """
+    if isinstance(results, dict) and isinstance(baseline, dict):
+        regressions = []
+        for key in results.keys() & baseline.keys():
+            regressions += find_regressions(results[key], baseline[key], tolerance, f'{path}.{key}' if path else key)
+        return regressions
+
+    if isinstance(results, bool) or not isinstance(results, (int, float)) or not isinstance(baseline, (int, float)):
+        return []
+    key = path.rsplit('.', 1)[-1]
+    if 'accuracy' in key:
+        worse = results < baseline
+    elif key.endswith('_seconds') or key.endswith('_ms'):
+        floor = REGRESSION_FLOOR_SECONDS * (1000 if key.endswith('_ms') else 1)
+        worse = results > max(baseline * (1 + tolerance), baseline + floor)
+    elif 'per_second' in key or 'speedup' in key:
+        worse = results < baseline / (1 + tolerance)
+    else:
+        return []
+    return [f"{path}: {results} (baseline {baseline})"] if worse else []
+
+
+def main():
+    """Run the selected benchmarks, print their results as JSON and fail on a regression against a baseline"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--output', help="Also write the results to this JSON file, e.g. to use as a baseline")
+    parser.add_argument('--baseline', help="Exit with status 1 if any result is worse than in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed relative slowdown (default: 0.5)")
+    parser.add_argument('--corpus-dir', help="Write the synthetic paystub corpus to this directory and exit")
+    args = parser.parse_args()
+
+    if args.corpus_dir:
+        os.makedirs(args.corpus_dir, exist_ok=True)
+        for document in paystub_corpus():
+            with open(os.path.join(args.corpus_dir, f"{document['name']}.pdf"), 'wb') as f:
+                f.write(document['pdf'])
+            with open(os.path.join(args.corpus_dir, f"{document['name']}.json"), 'w') as f:
+                json.dump(document['expected'], f, indent=2)
+        return
+
+    names = args.names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = {name: BENCHMARKS[name]() for name in names}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in sorted(regressions):
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,46 @@
+import atexit
 import os
 import re
 import json
 import uuid
+import bisect
+import contextlib
+import cProfile
+import csv
+import functools
+import gzip
 import logging
+import shutil
+import smtplib
+import sqlite3
+import tempfile
 import traceback
 import hashlib
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import hmac
+import io
+import marshal
+import multiprocessing
+import pstats
+import queue
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional
 
+import numpy as np
 import requests
 import PyPDF2
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context, url_for
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from fpdf import FPDF
+from fpdf import FPDF, FPDF_VERSION
 import email_validator
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
@@ -21,18 +48,174 @@ from werkzeug.utils import secure_filename
 # Google Cloud libraries
 from google.cloud import storage
 from google.cloud import firestore
-from flask_mail import Mail, Message
+from google.api_core import exceptions as gcs_exceptions
+from google.auth import credentials as auth_credentials
+from google.auth.transport.requests import Request as AuthRequest
+from flask_mail import Connection, Mail, Message
+
+# OCR fallback for scanned paystubs; also needs the tesseract and poppler binaries at runtime
+try:
+    import cv2
+    import pytesseract
+    from pdf2image import convert_from_bytes
+    OCR_IMPORTS_AVAILABLE = True
+except ImportError:
+    OCR_IMPORTS_AVAILABLE = False
 
 # Constants
+# Default wage rule, used wherever the wage rule table has no rule for a jurisdiction and date
 MINIMUM_WAGE = float(os.getenv('MINIMUM_WAGE', '16.5'))
 OVERTIME_RATE = float(os.getenv('OVERTIME_RATE', '1.5'))
 LONG_SHIFT_THRESHOLD = float(os.getenv('LONG_SHIFT_THRESHOLD', '10.0'))
 LONG_SHIFT_BONUS = float(os.getenv('LONG_SHIFT_BONUS', '1.0'))
+WAGE_RULE_NAME = os.getenv('WAGE_RULE_NAME', 'NY State Labor Law')
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', str(10 * 1024 * 1024)))
-ALLOWED_EXTENSIONS = {'pdf'}
+ALLOWED_EXTENSIONS = {'pdf', 'csv', 'jsonl', 'ndjson'}  # Kept on upload names (optionally .gz); others are stored as .pdf
 BUCKET_ID = os.getenv('BUCKET_ID', "cs-poc-zgdkpqzt6vx3fwnl4kk8dky_cloudbuild")
 CLOUD_BACKEND_URL = os.getenv('CLOUD_BACKEND_URL', '')
 
+# Content-addressed uploads and the compliance result cache
+UPLOAD_PREFIX = 'paystub_uploads/sha256/'
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_COLLECTION = os.getenv('RESULT_CACHE_COLLECTION', 'result_cache')
+RESULT_CACHE_VERSION = 3  # Bump when parsing or check semantics change
+
+# Text extraction stops at this many pages or seconds (0 disables the limit)
+EXTRACT_MAX_PAGES = int(os.getenv('EXTRACT_MAX_PAGES', '50'))
+EXTRACT_TIME_BUDGET = float(os.getenv('EXTRACT_TIME_BUDGET', '30'))
+
+# OCR fallback for PDFs without a text layer
+OCR_ENABLED = os.getenv('OCR_ENABLED', 'True').lower() in ['true', '1', 't']
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+OCR_MAX_PAGES = int(os.getenv('OCR_MAX_PAGES', '10'))
+OCR_TARGET_PIXELS = int(os.getenv('OCR_TARGET_PIXELS', '3300'))  # Long side of a rendered page (letter at 300 DPI)
+OCR_MIN_DPI = int(os.getenv('OCR_MIN_DPI', '150'))
+OCR_MAX_DPI = int(os.getenv('OCR_MAX_DPI', '400'))
+OCR_EXECUTION_MODE = os.getenv('OCR_EXECUTION_MODE', 'process').lower()
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '0'))  # 0 = one per available core
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '512'))
+OCR_CACHE_COLLECTION = os.getenv('OCR_CACHE_COLLECTION', 'ocr_cache')
+OCR_PREPROCESS_VERSION = 1  # Bump when preprocessing changes so cached OCR text is not reused
+
+# Per-user compliance totals by year and month, updated as each paystub finishes
+ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', 'True').lower() in ['true', '1', 't']
+ROLLUP_COLLECTION = os.getenv('ROLLUP_COLLECTION', 'compliance_rollups')
+
+# Wage rules by jurisdiction and effective date, reloaded when the file changes
+WAGE_RULES_PATH = os.getenv('WAGE_RULES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wage_rules.json'))
+WAGE_RULES_RELOAD_INTERVAL = float(os.getenv('WAGE_RULES_RELOAD_INTERVAL', '30'))  # 0 disables reloading
+
+# Largest batch accepted by /compliance-batch
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', '100000'))
+
+# Payroll register mode: one PDF with many employees, split into per-employee segments
+REGISTER_WORKERS = int(os.getenv('REGISTER_WORKERS', '4'))
+REGISTER_PAGES_PER_TASK = int(os.getenv('REGISTER_PAGES_PER_TASK', '10'))
+REGISTER_MAX_PAGES = int(os.getenv('REGISTER_MAX_PAGES', '5000'))
+REGISTER_BOUNDARY_PATTERN = os.getenv('REGISTER_BOUNDARY_PATTERN', r'employee\s*(?:name)?\s*:')
+REGISTER_PROGRESS_EVERY = int(os.getenv('REGISTER_PROGRESS_EVERY', '25'))
+REGISTER_REPORT_MAX_EMPLOYEES = int(os.getenv('REGISTER_REPORT_MAX_EMPLOYEES', '200'))  # 0 disables the combined report
+
+# Timesheet ingestion: punch exports (CSV/JSONL, optionally .gz) streamed from Cloud Storage
+TIMESHEET_WEEK_START = int(os.getenv('TIMESHEET_WEEK_START', '0'))  # 0 = Monday
+TIMESHEET_MAX_SHIFT_HOURS = float(os.getenv('TIMESHEET_MAX_SHIFT_HOURS', '24'))
+TIMESHEET_READ_CHUNK = int(os.getenv('TIMESHEET_READ_CHUNK', str(8 * 1024 * 1024)))
+
+# Keep PDFs and reports in memory; anything that must touch disk goes to a self-cleaning spool dir
+IN_MEMORY_PROCESSING = os.getenv('IN_MEMORY_PROCESSING', 'True').lower() in ['true', '1', 't']
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'checkmychecks_spool'))
+
+# Background job settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '50'))
+JOB_RETRY_AFTER = int(os.getenv('JOB_RETRY_AFTER', '30'))
+
+# Synchronous mode: parse and check while the request waits, falling back to the background path
+SYNC_LATENCY_BUDGET = float(os.getenv('SYNC_LATENCY_BUDGET', '2.0'))  # Seconds
+SYNC_MAX_LATENCY_BUDGET = float(os.getenv('SYNC_MAX_LATENCY_BUDGET', '10'))
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '8'))
+
+# Reports rendered on first request to /report (in-process LRU + Firestore collection)
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '128'))
+REPORT_CACHE_COLLECTION = os.getenv('REPORT_CACHE_COLLECTION', 'report_cache')
+
+# Report delivery: 'attachment' mails the PDF, 'link' stores it in the bucket and mails a signed download link
+REPORT_DELIVERY = os.getenv('REPORT_DELIVERY', 'attachment').lower()
+REPORT_COMPRESSION_LEVEL = int(os.getenv('REPORT_COMPRESSION_LEVEL', '9'))  # zlib level of report PDFs
+REPORT_PREFIX = 'compliance_reports/'
+REPORT_LINK_EXPIRY = int(os.getenv('REPORT_LINK_EXPIRY', str(24 * 3600)))  # Seconds; V4 signed URLs allow at most 7 days
+REPORT_LINK_CACHE_SIZE = int(os.getenv('REPORT_LINK_CACHE_SIZE', '1024'))
+
+# Pooled SMTP connections and the background outbox that sends job emails
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '4'))  # Most connections open at once
+SMTP_MAX_IDLE = float(os.getenv('SMTP_MAX_IDLE', '60'))  # Seconds before an idle connection is replaced
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+MAIL_OUTBOX_ENABLED = os.getenv('MAIL_OUTBOX_ENABLED', 'True').lower() in ['true', '1', 't']
+MAIL_OUTBOX_WORKERS = int(os.getenv('MAIL_OUTBOX_WORKERS', '2'))
+MAIL_OUTBOX_BATCH_SIZE = int(os.getenv('MAIL_OUTBOX_BATCH_SIZE', '10'))
+MAIL_OUTBOX_SIZE = int(os.getenv('MAIL_OUTBOX_SIZE', '500'))
+MAIL_OUTBOX_DRAIN_TIMEOUT = float(os.getenv('MAIL_OUTBOX_DRAIN_TIMEOUT', '30'))  # Seconds to wait at shutdown
+
+# Write-behind processing status updates (0 writes every update through)
+STATUS_FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', '0.5'))  # Seconds
+STATUS_BATCH_SIZE = int(os.getenv('STATUS_BATCH_SIZE', '500'))  # Firestore commits at most 500 writes per batch
+
+# Pushed status updates (/status-events and /check-status?wait=) instead of polling
+STATUS_STREAM_MAX_CLIENTS = int(os.getenv('STATUS_STREAM_MAX_CLIENTS', '48'))  # Keep below the gunicorn thread count
+STATUS_STREAM_TIMEOUT = float(os.getenv('STATUS_STREAM_TIMEOUT', '300'))  # Seconds; EventSource reconnects after
+STATUS_STREAM_HEARTBEAT = float(os.getenv('STATUS_STREAM_HEARTBEAT', '15'))
+STATUS_LONG_POLL_MAX_WAIT = float(os.getenv('STATUS_LONG_POLL_MAX_WAIT', '30'))
+STATUS_LISTENER_ENABLED = os.getenv('STATUS_LISTENER_ENABLED', 'True').lower() in ['true', '1', 't']
+STATUS_BROKER_CACHE_SIZE = int(os.getenv('STATUS_BROKER_CACHE_SIZE', '4096'))
+
+# Bulk status lookups (/check-status-batch) and the short-lived cache behind them
+STATUS_BATCH_MAX_FILES = int(os.getenv('STATUS_BATCH_MAX_FILES', '500'))
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', '2.0'))  # Seconds
+STATUS_CACHE_SIZE = int(os.getenv('STATUS_CACHE_SIZE', '10000'))
+
+# CPU-bound stage execution: 'thread' runs inline, 'process' uses a process pool
+CPU_EXECUTION_MODE = os.getenv('CPU_EXECUTION_MODE', 'thread').lower()
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', '0'))  # 0 = one per available core
+CPU_POOL_START_METHOD = os.getenv('CPU_POOL_START_METHOD', 'spawn')
+
+# In-process execution: 'pool' runs whole jobs on JobExecutor, 'pipeline' gives each stage its own pool
+PROCESSING_MODE = os.getenv('PROCESSING_MODE', 'pool').lower()
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv('PIPELINE_MAX_IN_FLIGHT', '64'))
+STAGE_DOWNLOAD_CONCURRENCY = int(os.getenv('STAGE_DOWNLOAD_CONCURRENCY', '16'))
+STAGE_EXTRACT_CONCURRENCY = int(os.getenv('STAGE_EXTRACT_CONCURRENCY', '0'))  # 0 = one per available core
+STAGE_CHECK_CONCURRENCY = int(os.getenv('STAGE_CHECK_CONCURRENCY', '0'))
+STAGE_RENDER_CONCURRENCY = int(os.getenv('STAGE_RENDER_CONCURRENCY', '0'))
+STAGE_EMAIL_CONCURRENCY = int(os.getenv('STAGE_EMAIL_CONCURRENCY', '16'))
+STAGE_ROLLUP_CONCURRENCY = int(os.getenv('STAGE_ROLLUP_CONCURRENCY', '8'))
+
+# Durable job queue: 'memory' keeps jobs in-process, 'sqlite' hands them to worker.py
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'memory').lower()
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', '/tmp/checkmychecks_jobs.sqlite3')
+JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '300'))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '60'))  # Lease extension period of running jobs
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '5'))
+
+# Opt-in profiling: the /admin/profile stack sampler and per-job cProfile capture ("profile": true)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() in ['true', '1', 't']
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # Bearer token for /admin endpoints; empty disables them
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))  # Seconds between stack samples
+PROFILE_MAX_OVERHEAD = float(os.getenv('PROFILE_MAX_OVERHEAD', '0.02'))  # Largest share of time spent sampling
+PROFILE_COLLECTION = os.getenv('PROFILE_COLLECTION', 'job_profiles')
+PROFILE_SUMMARY_LINES = int(os.getenv('PROFILE_SUMMARY_LINES', '40'))
+PROFILE_MAX_BYTES = int(os.getenv('PROFILE_MAX_BYTES', '900000'))  # Larger profiles keep only the summary
+
+# Memory accounting: tracemalloc for sampled jobs or "trace_memory": true, and temp directory usage over time
+MEMORY_TRACE_SAMPLE_RATE = float(os.getenv('MEMORY_TRACE_SAMPLE_RATE', '0'))  # Share of jobs traced; 0 disables
+MEMORY_TRACE_FRAMES = int(os.getenv('MEMORY_TRACE_FRAMES', '1'))  # More frames cost more; group=traceback needs >1
+MEMORY_TRACE_HISTORY = int(os.getenv('MEMORY_TRACE_HISTORY', '100'))  # Traced jobs kept for /admin/memory
+MEMORY_TOP_SITES = int(os.getenv('MEMORY_TOP_SITES', '25'))
+TMP_USAGE_INTERVAL = float(os.getenv('TMP_USAGE_INTERVAL', '60'))  # Seconds between samples; 0 disables
+TMP_USAGE_HISTORY = int(os.getenv('TMP_USAGE_HISTORY', '1440'))
+TMP_STALE_AGE = float(os.getenv('TMP_STALE_AGE', '3600'))  # Files older than this count as stale
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -78,11 +261,239 @@ mail = Mail(app)
 # Initialize Firestore client
 db = firestore.Client()
 
+
+def format_metric_value(value) -> str:
+    """Format a sample value or bucket bound for the exposition format without losing precision"""
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        """Initialize the counter"""
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        """Add to the counter for the given label values"""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for the exposition"""
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield '', label_values, '', value
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds, optionally split by label values.
+
+    observe() is one bisect and a few additions under a lock; buckets are
+    only made cumulative when the metrics are rendered.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: tuple, labels: tuple = ()):
+        """Initialize the histogram"""
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = labels
+        # Label values: per-bucket counts, the +Inf bucket last, then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        """Record one value for the given label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def timer(self, *label_values):
+        """Observe the seconds spent in the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for the exposition"""
+        with self._lock:
+            series = [(label_values, list(counts)) for label_values, counts in self._series.items()]
+        for label_values, counts in series:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = format_metric_value(bound)
+                yield '_bucket', label_values, f'le="{le}"', total
+            yield '_sum', label_values, '', counts[-1]
+            yield '_count', label_values, '', total
+
+
+class Gauge:
+    """Value read when the metrics are rendered, e.g. a queue depth"""
+
+    def __init__(self, name: str, help_text: str, read, labels: tuple = ()):
+        """
+        Initialize the gauge.
+
+        :param read: Returns the value, or a dict of value by label values tuple
+        """
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.labels = labels
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for the exposition"""
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.warning(f"Failed to read gauge {self.name}: {e}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield '', label_values, '', value
+
+
+class MetricsRegistry:
+    """Process-wide metrics, served at /metrics in the Prometheus text format"""
+
+    TYPES = {Counter: 'counter', Histogram: 'histogram', Gauge: 'gauge'}
+
+    def __init__(self, prefix: str):
+        """Initialize the registry"""
+        self.prefix = prefix
+        self._metrics = []
+
+    def _register(self, metric):
+        """Add a metric under the registry prefix"""
+        metric.name = f"{self.prefix}_{metric.name}"
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        """Create and register a counter"""
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple, labels: tuple = ()) -> Histogram:
+        """Create and register a histogram"""
+        return self._register(Histogram(name, help_text, buckets, labels))
+
+    def gauge(self, name: str, help_text: str, read, labels: tuple = ()) -> Gauge:
+        """Create and register a gauge read at render time"""
+        return self._register(Gauge(name, help_text, read, labels))
+
+    @staticmethod
+    def escape(label_value) -> str:
+        """Escape a label value for the exposition format"""
+        return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {self.TYPES[type(metric)]}")
+            for suffix, label_values, extra, value in metric.samples():
+                labels = [
+                    f'{label}="{self.escape(label_value)}"'
+                    for label, label_value in zip(metric.labels, label_values)
+                ]
+                if extra:
+                    labels.append(extra)
+                label_text = "{" + ",".join(labels) + "}" if labels else ""
+                lines.append(f"{metric.name}{suffix}{label_text} {format_metric_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Processing metrics; queue depths and other gauges are registered with the objects they read
+metrics = MetricsRegistry('checkmychecks')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB to 256 MiB
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500, 1000, 5000)
+stage_seconds = metrics.histogram(
+    'stage_seconds', 'Time spent in each processing stage (extract includes parse)', LATENCY_BUCKETS, ('stage',)
+)
+stage_failures = metrics.counter('stage_failures_total', 'Processing stages that raised an error', ('stage',))
+queue_wait_seconds = metrics.histogram(
+    'queue_wait_seconds', 'Time work waited in a queue before a worker took it', LATENCY_BUCKETS, ('queue',)
+)
+jobs_finished = metrics.counter('jobs_total', 'Jobs that reached a final status', ('status',))
+pdf_size_bytes = metrics.histogram('pdf_size_bytes', 'Size of downloaded paystub PDFs', BYTES_BUCKETS)
+pdf_pages = metrics.histogram('pdf_pages', 'Pages in paystub PDFs', PAGE_BUCKETS)
+report_size_bytes = metrics.histogram('report_size_bytes', 'Size of rendered compliance reports', BYTES_BUCKETS)
+upload_seconds = metrics.histogram(
+    'upload_seconds', 'Time to handle /upload-paystub (request) and to store the file (storage)', LATENCY_BUCKETS, ('step',)
+)
+upload_size_bytes = metrics.histogram('upload_size_bytes', 'Size of uploaded files', BYTES_BUCKETS)
+upload_failures = metrics.counter('upload_failures_total', 'Uploads that failed')
+email_send_seconds = metrics.histogram('email_send_seconds', 'Time to send a batch of emails over SMTP', LATENCY_BUCKETS)
+emails_sent = metrics.counter('emails_total', 'Emails by result', ('result',))
+stage_memory_peak_bytes = metrics.histogram(
+    'stage_memory_peak_bytes', 'Peak traced allocations during a stage of a memory-traced job', BYTES_BUCKETS, ('stage',)
+)
+job_memory_retained_bytes = metrics.histogram(
+    'job_memory_retained_bytes', 'Traced allocations still held when a memory-traced job finished', BYTES_BUCKETS
+)
+
+
+def timed_stage(name: str):
+    """Record the duration and failures of a processing stage under name.
+
+    Jobs created with profile=True also run the stage under their cProfile
+    profiler, whichever thread the stage runs on, and memory-traced jobs
+    record the stage's peak and retained allocations.
+    """
+    def decorator(stage):
+        @functools.wraps(stage)
+        def timed(job: Dict[str, Any]) -> bool:
+            profiler = job.get('profiler')
+            tracing = allocation_tracer.stage(job, name) if 'memory' in job else contextlib.nullcontext()
+            start = time.perf_counter()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                with tracing:
+                    return stage(job)
+            except Exception:
+                stage_failures.inc(name)
+                raise
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                stage_seconds.observe(time.perf_counter() - start, name)
+        return timed
+    return decorator
+
 class StorageService:
     """Service for handling Google Cloud Storage operations with uniform bucket access"""
 
     def __init__(self, bucket_id: str):
         """Initialize the storage service"""
+        # Signed URLs by (blob name, lifetime): (URL, expiry time)
+        self._signed_urls = OrderedDict()
+        self._lock = threading.Lock()
+        self._credentials_lock = threading.Lock()
         try:
             self.client = storage.Client()
             self.bucket_id = bucket_id
@@ -93,28 +504,55 @@ class StorageService:
 
     def upload_file(self, file, content_type=None):
         """
-        Upload a file to Google Cloud Storage with uniform bucket access.
+        Upload a file to Google Cloud Storage under its content address.
+
+        The object name is the SHA-256 of the file contents, so re-uploading
+        identical bytes reuses the existing object instead of storing a copy.
+        Each upload still gets its own handle, which names the object and
+        keys the upload's processing status, so users who upload the same
+        file do not share a job. Both keep the file's extension when it is
+        one of ALLOWED_EXTENSIONS.
         
         :param file: File object to upload
         :param content_type: Optional MIME type of the file
-        :return: Tuple of (blob name, signed URL)
+        :return: Tuple of (upload handle, signed URL)
         """
+        start = time.perf_counter()
         try:
-            # Generate a secure unique filename
-            filename = f"paystub_uploads/{uuid.uuid4()}_{secure_filename(file.filename)}"
+            # Hash the contents in chunks without loading the whole file
+            file.seek(0)
+            digest = hashlib.sha256()
+            size = 0
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+            upload_size_bytes.observe(size)
+            # Keep the extension so punch exports are still recognized as timesheets
+            extension = upload_extension(file.filename)
+            filename = f"{UPLOAD_PREFIX}{digest.hexdigest()}{extension}"
+            handle = f"{UPLOAD_PREFIX}{digest.hexdigest()}/{uuid.uuid4().hex}{extension}"
             
             # Create blob
             blob = self.bucket.blob(filename)
             
-            # Set content type if provided
-            if content_type:
-                blob.content_type = content_type or 'application/octet-stream'
-            
-            # Reset file pointer to beginning
-            file.seek(0)
-            
-            # Upload the file
-            blob.upload_from_file(file)
+            if blob.exists():
+                logger.info(f"Identical file already stored, skipping upload: {filename}")
+            else:
+                # Set content type if provided
+                if content_type:
+                    blob.content_type = content_type or 'application/octet-stream'
+                blob.metadata = {'original_filename': secure_filename(file.filename or '')}
+                
+                # Reset file pointer to beginning
+                file.seek(0)
+                
+                # Upload the file; the precondition makes concurrent identical uploads safe
+                try:
+                    blob.upload_from_file(file, if_generation_match=0)
+                except gcs_exceptions.PreconditionFailed:
+                    logger.info(f"Identical file uploaded concurrently: {filename}")
+                else:
+                    logger.info(f"File uploaded successfully: {filename}")
             
             # Generate a signed URL for accessing the file - FIXED DATETIME USAGE
             signed_url = blob.generate_signed_url(
@@ -122,19 +560,59 @@ class StorageService:
                 # URL expires in 1 hour using timedelta
                 expiration=timedelta(hours=1),  # USE timedelta, NOT datetime.timedelta
                 # HTTP method
-                method='GET'
+                method='GET',
+                **self._signing_credentials()
             )
-            
-            logger.info(f"File uploaded successfully: {filename}")
-            return filename, signed_url
+
+            upload_seconds.observe(time.perf_counter() - start, 'storage')
+            return handle, signed_url
         
         except Exception as e:
             logger.error(f"File upload to GCS failed: {e}")
             logger.error(traceback.format_exc())
             raise
 
-    def download_file(self, file_url: str, destination: str) -> str:
-        # Rest of the existing method remains the same
+    def download_bytes(self, file_url: str, max_size: int = MAX_FILE_SIZE) -> bytes:
+        """
+        Download a file from Google Cloud Storage into memory.
+
+        The request asks for at most ``max_size + 1`` bytes, so an oversized
+        object is rejected without being buffered in full.
+
+        :param file_url: Path of the file in the bucket
+        :param max_size: Largest accepted object size in bytes
+        :return: File contents
+        """
+        try:
+            blob = self.bucket.blob(upload_object_name(file_url))
+            data = blob.download_as_bytes(start=0, end=max_size)
+
+            if len(data) > max_size:
+                raise ValueError(f"File exceeds maximum size of {max_size} bytes: {file_url}")
+
+            logger.info(f"Downloaded {len(data)} bytes from GCS: {file_url}")
+            return data
+
+        except Exception as e:
+            logger.error(f"File download failed: {e}")
+            logger.error(traceback.format_exc())
+            raise
+
+    def open_text(self, file_url: str, chunk_size: int = 8 * 1024 * 1024):
+        """
+        Open a UTF-8 text file in Google Cloud Storage for streaming reads.
+
+        Only one chunk is buffered at a time; ``.gz`` objects are decompressed
+        on the fly.
+
+        :param file_url: Path of the file in the bucket
+        :param chunk_size: Bytes fetched per request
+        :return: Text file object, to be closed by the caller
+        """
+        raw = self.bucket.blob(upload_object_name(file_url)).open('rb', chunk_size=chunk_size)
+        if file_url.endswith('.gz'):
+            raw = gzip.GzipFile(fileobj=raw, mode='rb')
+        return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
 
     def download_file(self, file_url: str, destination: str) -> str:
         """
@@ -146,7 +624,7 @@ class StorageService:
         """
         try:
             # Ensure the full blob path is used
-            blob = self.bucket.blob(file_url)
+            blob = self.bucket.blob(upload_object_name(file_url))
             
             # Get just the filename part
             filename = os.path.basename(file_url)
@@ -166,654 +644,5408 @@ class StorageService:
             logger.error(traceback.format_exc())
             raise
 
-class PaystubProcessor:
-    """Process paystubs for compliance checking"""
-
-    # Define regex patterns as class constants
-    PATTERNS = {
-        'employee_name': [
-            r"EMPLOYEE\s*NAME:\s*([\w\s]+)",
-            r"NAME:\s*([\w\s]+)",
-            r"EMPLOYEE:\s*([\w\s]+)"
-        ],
-        'net_pay': [
-            r"NET\s*PAY:\s*\$?([\d,]+\.\d{2})",
-            r"NET\s*PAY\s*\$?([\d,]+\.\d{2})",
-            r"TOTAL\s*NET\s*PAY:\s*\$?([\d,]+\.\d{2})"
-        ],
-        'total_hours': [
-            r"TOTAL\s*HOURS:\s*([\d.]+)",
-            r"HOURS\s*WORKED:\s*([\d.]+)",
-            r"HOURS:\s*([\d.]+)"
-        ],
-        'gross_pay': [
-            r"GROSS\s*PAY:\s*\$?([\d,]+\.\d{2})",
-            r"GROSS\s*EARNINGS:\s*\$?([\d,]+\.\d{2})",
-            r"TOTAL\s*GROSS:\s*\$?([\d,]+\.\d{2})"
-        ]
-    }
+    def upload_report(self, report_bytes: bytes, name: str = None, filename: str = 'compliance_report.pdf') -> str:
+        """
+        Store a rendered report PDF in Google Cloud Storage.
 
-    def __init__(self, temp_dir: str = '/tmp'):
-        """Initialize the Paystub Processor"""
-        self.temp_dir = temp_dir
-        os.makedirs(self.temp_dir, exist_ok=True)
-        self.storage_service = StorageService(BUCKET_ID)
+        A report already stored under the same name is kept, so a retried job
+        does not upload its report again.
 
-    def validate_email(self, email: str) -> str:
-        """Validate the email using email_validator library"""
+        :param report_bytes: PDF contents
+        :param name: Name identifying the report, e.g. its compliance cache key; defaults to the SHA-256 of the contents
+        :param filename: File name offered when the report is downloaded
+        :return: Blob name of the report
+        """
+        blob_name = f"{REPORT_PREFIX}{name or hashlib.sha256(report_bytes).hexdigest()}.pdf"
         try:
-            email_validator.validate_email(email)
-            return ""
-        except email_validator.EmailNotValidError as e:
-            return str(e)
+            blob = self.bucket.blob(blob_name)
+            blob.content_disposition = f'attachment; filename="{filename}"'
+            try:
+                blob.upload_from_string(report_bytes, content_type='application/pdf', if_generation_match=0)
+            except gcs_exceptions.PreconditionFailed:
+                logger.info(f"Report already stored, skipping upload: {blob_name}")
+            else:
+                logger.info(f"Report stored: {blob_name} ({len(report_bytes)} bytes)")
+            return blob_name
 
-    def download_pdf(self, file_url: str) -> Optional[str]:
-        """Download PDF from Google Cloud Storage"""
-        try:
-            return self.storage_service.download_file(file_url, self.temp_dir)
         except Exception as e:
-            logger.error(f"PDF download from GCS failed: {e}")
-            return None
-    
-    def extract_pdf_text(self, pdf_path: str) -> str:
-        """Extract text from PDF with robust error handling"""
-        try:
-            # Verify file exists and is valid
-            self._validate_pdf_file(pdf_path)
+            logger.error(f"Report upload to GCS failed: {e}")
+            logger.error(traceback.format_exc())
+            raise
 
-            # Process the PDF
-            with open(pdf_path, 'rb') as file:
-                try:
-                    reader = PyPDF2.PdfReader(file)
-                    if len(reader.pages) == 0:
-                        logger.warning("PDF has no pages")
-                        return ""
+    def _signing_credentials(self) -> Dict[str, Any]:
+        """
+        Extra generate_signed_url arguments for the client's credentials.
 
-                    text = ""
-                    for page in reader.pages:
-                        try:
-                            page_text = page.extract_text()
-                            text += page_text if page_text else ""
-                        except Exception as e:
-                            logger.warning(f"Error extracting text from page: {e}")
-                            # Continue with next page
+        A service account key signs locally. Cloud Run and other metadata
+        server credentials have no private key, so their URLs are signed by
+        the IAM signBlob API as the service account, with its access token.
+        """
+        credentials = self.client._credentials
+        if isinstance(credentials, auth_credentials.Signing):
+            return {}
+        with self._credentials_lock:
+            if not credentials.valid:
+                # Also resolves the 'default' service account to its email
+                credentials.refresh(AuthRequest())
+            return {'service_account_email': credentials.service_account_email, 'access_token': credentials.token}
 
-                    if not text.strip():
-                        logger.warning("No text extracted from PDF")
+    def signed_url(self, blob_name: str, lifetime: int) -> tuple:
+        """
+        Return a V4 signed download URL for a blob.
 
-                    return text
+        Without a service account key signing is a call to the IAM API (see
+        _signing_credentials), so URLs are cached and handed out again while
+        at least half of their lifetime is left.
 
-                except PyPDF2.errors.PdfReadError as e:
-                    logger.error(f"PDF read error: {e}")
-                    return ""
+        :param blob_name: Path of the file in the bucket
+        :param lifetime: Seconds a new URL stays valid
+        :return: Tuple of (signed URL, expiry as a Unix timestamp)
+        """
+        key = (blob_name, lifetime)
+        now = time.time()
+        with self._lock:
+            cached = self._signed_urls.get(key)
+            if cached is not None and cached[1] - now >= lifetime / 2:
+                self._signed_urls.move_to_end(key)
+                return cached
 
-        except Exception as e:
-            logger.error(f"Text extraction failed: {e}")
-            logger.error(traceback.format_exc())
-            return ""
+        url = self.bucket.blob(blob_name).generate_signed_url(
+            version='v4',
+            expiration=timedelta(seconds=lifetime),
+            method='GET',
+            **self._signing_credentials()
+        )
+        signed = (url, now + lifetime)
+        with self._lock:
+            self._signed_urls[key] = signed
+            self._signed_urls.move_to_end(key)
+            while len(self._signed_urls) > REPORT_LINK_CACHE_SIZE:
+                self._signed_urls.popitem(last=False)
+        return signed
 
-    def _validate_pdf_file(self, pdf_path: str) -> bool:
-        """Validate that the file exists, is not empty, and is actually a PDF"""
-        # Verify file exists
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+class FieldExtractor:
+    """Precompiled single-pass extractor for labelled paystub fields.
 
-        # Check file size
-        file_size = os.path.getsize(pdf_path)
-        if file_size == 0:
-            raise ValueError(f"PDF file is empty: {pdf_path}")
+    All patterns are combined into one alternation (grouped by their leading
+    word) that is run over the lower-cased text, so the document is scanned
+    once instead of once per pattern. Wherever the alternation matches, each pattern is tried anchored
+    at that spot to record its first match. The result per field is the same
+    as calling ``re.search(pattern, text, re.IGNORECASE)`` for each of the
+    field's patterns in priority order.
 
-        # Check file is actually a PDF
-        with open(pdf_path, 'rb') as file:
-            header = file.read(5)
-            if header != b'%PDF-':
-                raise ValueError(f"File is not a valid PDF: {pdf_path}")
+    Patterns containing anything but literal text, groups, classes and the
+    ``\\s \\d \\w \\b`` escapes (e.g. backreferences or inline flags)
+    cannot be lower-cased safely and are searched separately.
+    """
 
-        return True
+    def __init__(self, patterns: Dict[str, List[str]], text_fields=('employee_name',)):
+        """
+        Build the extractor.
 
-    def parse_paystub_data(self, text: str) -> Dict[str, Any]:
-        """Parse paystub data with robust error handling"""
-        if not text:
-            logger.error("No text provided for parsing")
-            return {}
+        :param patterns: Field name to regex patterns, highest priority first;
+            group 1 of each pattern captures the value
+        :param text_fields: Fields kept as stripped strings instead of floats
+        """
+        self.text_fields = set(text_fields)
+        self._patterns = OrderedDict()  # field -> [priority] sorted ascending
+        self._combined = []             # (field, priority, pattern compiled for lower-cased text)
+        self._separate = []             # (field, priority, case-insensitive pattern)
+        self._compiled = None           # (scanner, combined, separate, fields), rebuilt after register()
+        self._lock = threading.Lock()
+        for field, pattern_list in patterns.items():
+            for pattern in pattern_list:
+                self.register(field, pattern)
 
-        results = {}  # Initialize results
-        try:
-            for key, pattern_list in self.PATTERNS.items():
-                for pattern in pattern_list:
-                    match = re.search(pattern, text, re.IGNORECASE)
-                    if match:
-                        value = match.group(1).replace(',', '')
-                        try:
-                            results[key] = float(value) if key != 'employee_name' else value.strip()
-                            break  # Found a match, stop trying patterns
-                        except ValueError:
-                            logger.warning(f"Failed to convert {key} value: {value}")
-                            continue
+    def register(self, field: str, pattern: str, priority: int = None):
+        """
+        Add a pattern for a field.
 
-                if key not in results:
-                    results[key] = None
-                    logger.warning(f"Could not extract {key}")
+        :param field: Field name
+        :param pattern: Regex whose group 1 captures the value
+        :param priority: Lower wins; defaults to after the field's existing patterns
+        """
+        compiled = re.compile(pattern, re.IGNORECASE)
+        if compiled.groups < 1:
+            raise ValueError(f"Pattern for {field} has no capturing group: {pattern}")
 
-        except Exception as e:
-            logger.error(f"Paystub data parsing failed: {e}")
-            logger.error(traceback.format_exc())
+        with self._lock:
+            priorities = self._patterns.setdefault(field, [])
+            if priority is None:
+                priority = priorities[-1] + 1 if priorities else 0
+            priorities.append(priority)
+            priorities.sort()
 
-        return results
+            if self._can_lowercase(pattern):
+                self._combined.append((field, priority, re.compile(pattern.lower())))
+            else:
+                self._separate.append((field, priority, compiled))
 
-    def perform_compliance_checks(self, data: Dict[str, Any], user_input: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Perform compliance checks on paystub data."""
-        if user_input is None:
-            user_input = {}
-            
-        checks = {
-            'minimum_wage': False,
-            'overtime_compliant': False,
-            'total_compensation_valid': False,
-            'long_shift_additional_pay_violation': False
-        }
+            # Rebuilt lazily on the next extract()
+            self._compiled = None
 
-        # Safely extract values with defaults
-        net_pay = float(data.get('net_pay', 0) or 0)
-        total_hours = float(data.get('total_hours', 0) or 0)
-        gross_pay = float(data.get('gross_pay', 0) or 0)
+    @staticmethod
+    def _can_lowercase(pattern: str) -> bool:
+        """Check that lower-casing the pattern keeps its meaning on lower-cased text"""
+        if re.search(r'\(\?(?!:)', pattern):
+            return False
+        return all(
+            not escaped.isalnum() or escaped in 'sdwb'
+            for escaped in re.findall(r'\\(.)', pattern)
+        )
 
-        # Check total compensation validity
-        checks['total_compensation_valid'] = net_pay > 0 and gross_pay > 0
+    @staticmethod
+    def _build_scanner(combined):
+        """
+        Combine the patterns into one alternation, factoring out shared leading words.
 
-        # Only perform calculations if we have valid values
-        if net_pay > 0 and total_hours > 0:
-            # Calculate the regular hourly rate
-            regular_hourly_rate = net_pay / total_hours if total_hours <= 40 else gross_pay / total_hours
+        :return: The scanner and a list of (leading word, [(field, priority, pattern)])
+            so a hit only needs to try the patterns whose leading word is there
+        """
+        branches = OrderedDict()
+        for field, priority, compiled in combined:
+            pattern = compiled.pattern
+            label = re.match(r'[a-z]*', pattern).group(0)
+            # A quantifier after the last letter makes that letter optional
+            if label and pattern[len(label):len(label) + 1] in ('?', '*', '+', '{'):
+                label = label[:-1]
+            if '|' in pattern:
+                label = ''
+            branches.setdefault(label, []).append((field, priority, compiled))
 
-            # Check minimum wage compliance
-            checks['minimum_wage'] = regular_hourly_rate >= MINIMUM_WAGE
+        scanner = re.compile('|'.join(
+            f"{label}(?:{'|'.join(c.pattern[len(label):] for _, _, c in group)})" if label
+            else '|'.join(f'(?:{c.pattern})' for _, _, c in group)
+            for label, group in branches.items()
+        ))
+        return scanner, list(branches.items())
 
-            # Check overtime compliance (if applicable)
-            checks['overtime_compliant'] = self._check_overtime_compliance(
-                total_hours, regular_hourly_rate, gross_pay
+    def _compile(self):
+        """Snapshot the registered patterns and build the combined scanner"""
+        with self._lock:
+            if self._compiled is None:
+                scanner, groups = self._build_scanner(self._combined) if self._combined else (None, [])
+                fields = tuple((field, tuple(priorities)) for field, priorities in self._patterns.items())
+                top_keys = frozenset((field, priorities[0]) for field, priorities in fields)
+                self._compiled = (scanner, groups, tuple(self._separate), fields, top_keys)
+            return self._compiled
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        """Extract every registered field from the text; missing fields are None"""
+        compiled_state = self._compiled
+        if compiled_state is None:
+            compiled_state = self._compile()
+        scanner, groups, separate, fields, top_keys = compiled_state
+
+        found = {}  # (field, priority) -> captured value of the pattern's first match
+        lowered = text.lower()
+        if scanner is not None and len(lowered) == len(text):
+            # Once every field's top pattern has a usable match nothing can beat it
+            top = top_keys
+            match = scanner.search(lowered)
+            while match:
+                position = match.start()
+                for label, group in groups:
+                    if not lowered.startswith(label, position):
+                        continue
+                    for field, priority, compiled in group:
+                        key = (field, priority)
+                        if key in found:
+                            continue
+                        anchored = compiled.match(lowered, position)
+                        if anchored:
+                            # Slice the original text so captured names keep their case
+                            start, end = anchored.span(1)
+                            found[key] = text[start:end] if start >= 0 else None
+                            if top is not None and key in top and self._convert(field, found[key]) is None:
+                                top = None
+                if top is not None and top.issubset(found):
+                    break
+                # Resume one character on so overlapping matches are not skipped
+                match = scanner.search(lowered, position + 1)
+        else:
+            # Lower-casing changed offsets (rare non-ASCII text); search every pattern instead
+            separate = separate + tuple(
+                (field, priority, re.compile(c.pattern, re.IGNORECASE))
+                for _, group in groups for field, priority, c in group
             )
 
-        # Check for long shift violations
-        shifts_exceeded_10_hours = user_input.get('shifts_exceeded_10_hours', False)
-        exceeded_shifts_count = int(user_input.get('exceeded_shifts_count', 0))
+        for field, priority, compiled in separate:
+            match = compiled.search(text)
+            if match:
+                found[(field, priority)] = match.group(1)
 
-        # If user confirms shifts over LONG_SHIFT_THRESHOLD hours
-        if shifts_exceeded_10_hours and exceeded_shifts_count > 0:
-            # Calculate additional pay owed (LONG_SHIFT_BONUS hours at minimum wage per qualifying shift)
-            additional_pay_owed = exceeded_shifts_count * MINIMUM_WAGE * LONG_SHIFT_BONUS
+        results = {}
+        for field, priorities in fields:
+            results[field] = None
+            for priority in priorities:
+                if (field, priority) not in found:
+                    continue
+                raw = found[(field, priority)]
+                value = self._convert(field, raw)
+                if value is not None:
+                    results[field] = value
+                    break  # Found a match, stop trying patterns
+                logger.warning(f"Failed to convert {field} value: {raw}")
 
-            # Add this calculation to the compliance check
-            checks['long_shift_additional_pay_violation'] = True
-            checks['additional_pay_owed'] = additional_pay_owed
+        return results
 
-        return checks
+    def _convert(self, field: str, raw: Optional[str]):
+        """Convert a captured value, returning None if it is not a valid number"""
+        if raw is None:
+            return None
+        value = raw.replace(',', '')
+        if field in self.text_fields:
+            return value.strip()
+        try:
+            return float(value)
+        except ValueError:
+            return None
 
-    def _check_overtime_compliance(self, hours: float, hourly_rate: float, gross_pay: float) -> bool:
-        """Check if overtime pay complies with regulations"""
-        if hours <= 40:
-            return True
 
-        overtime_hours = hours - 40
-        overtime_pay = gross_pay - (40 * hourly_rate)
-        return overtime_pay >= (overtime_hours * hourly_rate * OVERTIME_RATE)
+WageRule = namedtuple('WageRule', [
+    'jurisdiction', 'effective_date', 'name',
+    'minimum_wage', 'overtime_rate', 'long_shift_threshold', 'long_shift_bonus'
+])
 
-    def generate_compliance_report(
-        self, 
-        employee_data: Dict[str, Any], 
-        compliance_results: Dict[str, Any],
-        user_input: Dict[str, Any] = None
-    ) -> str:
-        """Generate PDF compliance report with color-coded status"""
-        if user_input is None:
-            user_input = {}
-            
-        pdf = FPDF()
+
+class WageRuleIndex:
+    """Immutable index of effective-dated wage rules per jurisdiction.
+
+    Jurisdictions are ``''`` (default), a state code such as ``'NY'`` or a
+    city such as ``'NY/NEW YORK CITY'``. Each has its rules sorted by
+    effective date, so finding the rule in force on a date is a binary
+    search. A rule may leave rates unset (None); they are taken from the
+    next broader jurisdiction in force on the same date.
+    """
+
+    RATE_FIELDS = ('minimum_wage', 'overtime_rate', 'long_shift_threshold', 'long_shift_bonus')
+
+    def __init__(self, rules: List[WageRule], default: WageRule):
+        """
+        Build the index.
+
+        :param rules: Rules in any order
+        :param default: Fallback rule with every rate set
+        """
+        by_jurisdiction = {}
+        for rule in [default] + sorted(rules, key=lambda r: (r.jurisdiction, r.effective_date)):
+            by_jurisdiction.setdefault(rule.jurisdiction, []).append(rule)
+
+        self._rules = by_jurisdiction
+        self._dates = {
+            jurisdiction: [rule.effective_date for rule in jurisdiction_rules]
+            for jurisdiction, jurisdiction_rules in by_jurisdiction.items()
+        }
+        self.rule_count = len(rules)
+        # Resolved rules by (state, city, date); the index never changes, so entries never go stale
+        self._resolved = {}
+
+    @staticmethod
+    def jurisdiction_key(state: Optional[str], city: Optional[str] = None) -> str:
+        """Normalize a state and optional city into an index key"""
+        state = (state or '').strip().upper()
+        city = (city or '').strip().upper()
+        if state and city:
+            return f"{state}/{city}"
+        return state
+
+    def _find(self, jurisdiction: str, on: date) -> Optional[WageRule]:
+        """Return the jurisdiction's rule in force on a date, if any"""
+        dates = self._dates.get(jurisdiction)
+        if not dates:
+            return None
+        position = bisect.bisect_right(dates, on) - 1
+        return self._rules[jurisdiction][position] if position >= 0 else None
+
+    def resolve(self, state: Optional[str], city: Optional[str], on: date) -> Dict[str, Any]:
+        """
+        Resolve the rates in force for a city/state on a date.
+
+        :return: Dict with every rate plus the name, jurisdiction and
+            effective date of the most specific rule that applied; shared
+            between callers, so do not modify it
+        """
+        memo_key = (state, city, on)
+        resolved = self._resolved.get(memo_key)
+        if resolved is not None:
+            return resolved
+
+        city_key = self.jurisdiction_key(state, city)
+        state_key = self.jurisdiction_key(state)
+        chain = [city_key, state_key, ''] if city_key != state_key else [state_key, '']
+
+        resolved = {}
+        for jurisdiction in chain:
+            rule = self._find(jurisdiction, on)
+            if rule is None:
+                continue
+            if 'jurisdiction' not in resolved:
+                resolved['jurisdiction'] = rule.jurisdiction or 'default'
+                resolved['effective_date'] = rule.effective_date.isoformat()
+            if rule.name and 'name' not in resolved:
+                resolved['name'] = rule.name
+            for field in self.RATE_FIELDS:
+                if resolved.get(field) is None:
+                    resolved[field] = getattr(rule, field)
+
+        if len(self._resolved) >= 4096:
+            self._resolved.clear()
+        self._resolved[memo_key] = resolved
+        return resolved
+
+
+class WageRuleTable:
+    """Wage rules loaded from a JSON file into a WageRuleIndex and hot-reloaded when the file changes.
+
+    The file holds ``{"rules": [{"state": "NY", "city": "New York City",
+    "effective_date": "2025-01-01", "name": "...", "minimum_wage": 16.5}, ...]}``;
+    ``city`` and any rate may be omitted. Lookups only touch the in-memory
+    index; a background thread polls the file and swaps in a new index.
+    """
+
+    def __init__(self, path: str, reload_interval: float, default: WageRule):
+        """Load the table; the reload thread starts on first lookup"""
+        self.path = path
+        self.reload_interval = reload_interval
+        self.default = default
+        self._mtime = None
+        self._watcher = None
+        self._lock = threading.Lock()
+        self.index = WageRuleIndex([], default)
+        self.reload()
+
+    def _parse(self, raw: Dict[str, Any]) -> List[WageRule]:
+        """Convert the file contents to rules, rejecting the whole file on any bad entry"""
+        rules = []
+        for entry in raw.get('rules', []):
+            rates = {}
+            for field in WageRuleIndex.RATE_FIELDS:
+                value = entry.get(field)
+                rates[field] = float(value) if value is not None else None
+            rules.append(WageRule(
+                jurisdiction=WageRuleIndex.jurisdiction_key(entry['state'], entry.get('city')),
+                effective_date=date.fromisoformat(entry['effective_date']),
+                name=entry.get('name'),
+                **rates
+            ))
+        return rules
+
+    def reload(self) -> bool:
+        """Reload the file if it changed; on errors the previous index stays in place"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            if self._mtime is None:
+                logger.warning(f"Wage rule file {self.path} not found, using the default rule only")
+                self._mtime = 0
+            return False
+
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path) as f:
+                rules = self._parse(json.load(f))
+        except Exception as e:
+            logger.error(f"Failed to load wage rules from {self.path}: {e}")
+            self._mtime = mtime  # Do not retry until the file changes again
+            return False
+
+        self.index = WageRuleIndex(rules, self.default)
+        self._mtime = mtime
+        logger.info(f"Loaded {len(rules)} wage rules from {self.path}")
+        return True
+
+    def _watch(self):
+        """Poll the rule file for changes"""
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload()
+
+    def _ensure_watching(self):
+        """Start the reload thread if it is enabled and not running"""
+        if self._watcher is not None or self.reload_interval <= 0:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='wage-rule-reload', daemon=True)
+                self._watcher.start()
+
+    def resolve(self, user_input: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Resolve the rates for a job's state, city and pay date.
+
+        :param user_input: May hold 'state', 'city' and 'pay_date' (ISO date, default today)
+        :return: Resolved rule, see WageRuleIndex.resolve
+        """
+        self._ensure_watching()
+        user_input = user_input or {}
+        pay_date = user_input.get('pay_date')
+        on = date.fromisoformat(pay_date) if pay_date else date.today()
+        return self.index.resolve(user_input.get('state'), user_input.get('city'), on)
+
+
+class ReportRenderer:
+    """Render compliance report PDFs with the static layout prepared once per process"""
+
+    # Every document registers the fonts in this order, so the font resource
+    # names (/F1, /F2) inside prerendered blocks are valid in all of them
+    FONTS = (('Arial', ''), ('Arial', 'B'))
+
+    CHECKS = (
+        'minimum_wage', 'overtime_compliant', 'total_compensation_valid',
+        'long_shift_additional_pay_violation'
+    )
+
+    PRO_TIP = (
+        "Pro Tip automatically tracks and calculates these "
+        "complex wage requirements, ensuring you never miss out on "
+        "your rightful compensation. Upgrade to simplify your "
+        "wage compliance monitoring!"
+    )
+
+    def __init__(self):
+        """Lay out the title, section headers, check rows and Pro Tip once"""
+        self._blocks = {
+            'title': self._capture(self._draw_title),
+            'details': self._capture(lambda pdf: self._draw_heading(pdf, "Paystub Details:")),
+            'checks': self._capture(lambda pdf: self._draw_heading(pdf, "Compliance Check Results:")),
+            'alert': self._capture(self._draw_alert_heading),
+            'pro_tip': self._capture(self._draw_pro_tip),
+        }
+        for check in self.CHECKS:
+            for result in (True, False):
+                self._check_block(check, result)
+        self._rules = {}
+
+        # Everything in a report besides the page contents is the same for
+        # every report, so write it once and only fill in object numbers
+        pdf = self._new_document()
+        self._add_page(pdf)
+        fonts = sorted(pdf.fonts.values(), key=lambda font: font['i'])
+        self._font_objects = [
+            f"<</Type /Font /BaseFont /{font['name']} /Subtype /Type1 /Encoding /WinAnsiEncoding>>".encode('latin-1')
+            for font in fonts
+        ]
+        self._resources = (
+            "<</ProcSet [/PDF /Text] /Font <<"
+            + "".join(f"/F{font['i']} %d 0 R " for font in fonts)
+            + ">>>>"
+        ).encode('latin-1')
+        self._media_box = f"/MediaBox [0 0 {pdf.fw_pt:.2f} {pdf.fh_pt:.2f}]".encode('latin-1')
+        self._producer = f"/Producer (PyFPDF {FPDF_VERSION} http://pyfpdf.googlecode.com/)".encode('latin-1')
+
+    def _new_document(self) -> FPDF:
+        """Create an empty document"""
+        return FPDF()
+
+    def _add_page(self, pdf: FPDF):
+        """Start a page with the fonts registered in a fixed order"""
         pdf.add_page()
-        pdf.set_font("Arial", size=12)
+        start = len(pdf.pages[pdf.page])
+        for family, style in self.FONTS:
+            pdf.set_font(family, style, 12)
+        pdf.set_text_color(0, 0, 0)
+        # Registering the fonts selected each of them on the page; drop those
+        # operators and forget the current font so the next set_font() selects it
+        pdf.pages[pdf.page] = pdf.pages[pdf.page][:start]
+        pdf.font_family = ''
 
-        # Report Title
-        pdf.set_text_color(0, 0, 0)  # Black
-        pdf.set_font("Arial", 'B', 14)  # Larger, bold font for title
+    def _capture(self, draw) -> tuple:
+        """
+        Draw a static block on a scratch page and keep its content stream.
+
+        :param draw: Function drawing the block onto an FPDF at the current position
+        :return: (content stream, top of the block, height of the block)
+        """
+        pdf = self._new_document()
+        self._add_page(pdf)
+        top = pdf.y
+        start = len(pdf.pages[pdf.page])
+        draw(pdf)
+        return pdf.pages[pdf.page][start:], top, pdf.y - top
+
+    def _place(self, pdf: FPDF, block: tuple):
+        """Copy a prerendered block to the current position, starting a new page if it does not fit"""
+        stream, top, height = block
+        if pdf.y + height > pdf.page_break_trigger:
+            pdf.add_page()
+        # q/Q keep the block's font and colors from leaking into the rest of the page
+        pdf._out(f"q 1 0 0 1 0 {(top - pdf.y) * pdf.k:.4f} cm")
+        pdf.pages[pdf.page] += stream
+        pdf._out("Q")
+        pdf.set_y(pdf.y + height)
+
+    def _check_block(self, check: str, result: bool) -> tuple:
+        """Return the result row for a check, capturing it on first use"""
+        key = ('check', check, result)
+        block = self._blocks.get(key)
+        if block is None:
+            block = self._blocks[key] = self._capture(lambda pdf: self._draw_check(pdf, check, result))
+        return block
+
+    def _rule_block(self, text: str) -> tuple:
+        """Return the 'Rules applied' paragraph; there are only a few distinct rules per process"""
+        block = self._rules.get(text)
+        if block is None:
+            if len(self._rules) >= 256:
+                self._rules.clear()
+            block = self._rules[text] = self._capture(lambda pdf: self._draw_rule(pdf, text))
+        return block
+
+    @staticmethod
+    def _draw_title(pdf: FPDF):
+        """Report title"""
+        pdf.set_font("Arial", 'B', 14)
         pdf.cell(0, 10, "Pay Stub Compliance Report", ln=True, align='C')
         pdf.ln(10)
 
-        # Employee Information
+    @staticmethod
+    def _draw_heading(pdf: FPDF, text: str):
+        """Bold section heading"""
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 10, text, ln=True)
+
+    @staticmethod
+    def _draw_check(pdf: FPDF, check: str, result: bool):
+        """One check result, label in black and status in color"""
+        label = f"{check.replace('_', ' ').title()}: "
+        pdf.set_font("Arial", '', 12)
+        pdf.cell(pdf.get_string_width(label), 10, label)
+
+        # Passing is shown in green and failing in red; for the long shift
+        # check True means a violation
+        if check == 'long_shift_additional_pay_violation':
+            status, ok = ("VIOLATION", False) if result else ("NO VIOLATION", True)
+        else:
+            status, ok = ("PASSED", True) if result else ("FAILED", False)
+        pdf.set_text_color(*((0, 128, 0) if ok else (220, 0, 0)))
+        pdf.cell(0, 10, status, ln=True)
+
+    @staticmethod
+    def _draw_rule(pdf: FPDF, text: str):
+        """The 'Rules applied' paragraph"""
+        pdf.ln(5)
+        pdf.set_font("Arial", '', 10)
+        pdf.multi_cell(0, 8, text)
+
+    @staticmethod
+    def _draw_alert_heading(pdf: FPDF):
+        """Heading of the long shift alert"""
+        pdf.ln(10)
+        pdf.set_text_color(255, 128, 0)  # Orange
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 10, "IMPORTANT: Long Shift Compensation Alert!", ln=True)
+
+    def _draw_pro_tip(self, pdf: FPDF):
+        """Pro Tip paragraph shown with the long shift alert"""
+        pdf.ln(5)
+        pdf.set_text_color(255, 128, 0)  # Orange
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(0, 10, "PRO TIP: Automate Your Wage Tracking!", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", '', 12)
+        pdf.multi_cell(0, 10, self.PRO_TIP)
+
+    @staticmethod
+    def _money(value) -> str:
+        """Format a pay amount with two decimal places"""
+        if isinstance(value, (int, float)):
+            return f"${value:.2f}"
+        return value if value == 'N/A' else f"${value}"
+
+    def _draw_report(
+        self,
+        pdf: FPDF,
+        employee_data: Dict[str, Any],
+        compliance_results: Dict[str, Any],
+        user_input: Dict[str, Any]
+    ):
+        """Draw one report starting on a new page"""
+        self._add_page(pdf)
+        self._place(pdf, self._blocks['title'])
+
         pdf.set_font("Arial", 'B', 12)
         pdf.cell(0, 10, f"Employee: {employee_data.get('employee_name', 'Unknown')}", ln=True)
         pdf.ln(5)
 
-        # Paystub Details
-        pdf.set_font("Arial", 'B', 12)  # Bold for section title
-        pdf.cell(0, 10, "Paystub Details:", ln=True)
-        pdf.set_font("Arial", '', 12)  # Back to normal
-        
+        self._place(pdf, self._blocks['details'])
+        pdf.set_font("Arial", '', 12)
         pdf.cell(0, 10, f"Total Hours: {employee_data.get('total_hours', 'N/A')}", ln=True)
-        
-        # Format currency with two decimal places
-        gross_pay = employee_data.get('gross_pay', 'N/A')
-        if isinstance(gross_pay, (int, float)):
-            gross_pay = f"${gross_pay:.2f}"
-        elif gross_pay != 'N/A':
-            gross_pay = f"${gross_pay}"
-            
-        net_pay = employee_data.get('net_pay', 'N/A')
-        if isinstance(net_pay, (int, float)):
-            net_pay = f"${net_pay:.2f}"
-        elif net_pay != 'N/A':
-            net_pay = f"${net_pay}"
-        
-        pdf.cell(0, 10, f"Gross Pay: {gross_pay}", ln=True)
-        pdf.cell(0, 10, f"Net Pay: {net_pay}", ln=True)
+        pdf.cell(0, 10, f"Gross Pay: {self._money(employee_data.get('gross_pay', 'N/A'))}", ln=True)
+        pdf.cell(0, 10, f"Net Pay: {self._money(employee_data.get('net_pay', 'N/A'))}", ln=True)
         pdf.ln(5)
 
-        # Compliance Checks
-        pdf.set_font("Arial", 'B', 12)  # Bold for section title
-        pdf.cell(0, 10, "Compliance Check Results:", ln=True)
-        pdf.set_font("Arial", '', 12)  # Back to normal
-        
+        self._place(pdf, self._blocks['checks'])
         for check, result in compliance_results.items():
-            if check in ['additional_pay_owed']:  # Skip non-boolean values
-                continue
-                
-            check_name = check.replace('_', ' ').title()
-            
-            # First part of text - always black
-            pdf.set_text_color(0, 0, 0)  # Black
-            pdf.cell(pdf.get_string_width(f"{check_name}: "), 10, f"{check_name}: ")
-            
-            # Status text with color
-            if result:
-                if check == 'long_shift_additional_pay_violation':
-                    pdf.set_text_color(220, 0, 0)  # Red for VIOLATION
-                    status = "VIOLATION"
-                else:
-                    pdf.set_text_color(0, 128, 0)  # Green for PASSED
-                    status = "PASSED"
-            else:
-                if check == 'long_shift_additional_pay_violation':
-                    pdf.set_text_color(0, 128, 0)  # Green for NO VIOLATION
-                    status = "NO VIOLATION"
-                else:
-                    pdf.set_text_color(220, 0, 0)  # Red for FAILED
-                    status = "FAILED"
-                
-            pdf.cell(0, 10, status, ln=True)
-        
-        # Add Long Shift alert if applicable
+            if isinstance(result, bool):  # Skip amounts and the wage rule
+                self._place(pdf, self._check_block(check, result))
+
+        rule = compliance_results.get('wage_rule') or wage_rules.resolve(user_input)
+        rule_text = (
+            f"Rules applied: {rule.get('name') or 'Default wage rule'} "
+            f"({rule['jurisdiction']}, effective {rule['effective_date']}); "
+            f"minimum wage ${rule['minimum_wage']:.2f}/hour, overtime at {rule['overtime_rate']}x"
+        )
+        self._place(pdf, self._rule_block(rule_text))
+
         if compliance_results.get('long_shift_additional_pay_violation'):
             additional_pay = compliance_results.get('additional_pay_owed', 0)
             exceeded_shifts_count = user_input.get('exceeded_shifts_count', 0)
-            
-            pdf.ln(10)
-            pdf.set_text_color(255, 128, 0)  # Orange for Pro Tip
-            pdf.set_font("Arial", 'B', 12)
-            pdf.cell(0, 10, "IMPORTANT: Long Shift Compensation Alert!", ln=True)
-            pdf.set_text_color(0, 0, 0)
+
+            self._place(pdf, self._blocks['alert'])
             pdf.set_font("Arial", '', 12)
-            pdf.multi_cell(0, 10, 
-                f"Under NY State Labor Law, for each shift exceeding {LONG_SHIFT_THRESHOLD} hours, "
-                f"you are owed an additional {LONG_SHIFT_BONUS} hour at minimum wage (${MINIMUM_WAGE}/hour). "
-                f"With {exceeded_shifts_count} shifts exceeding {LONG_SHIFT_THRESHOLD} hours, "
+            pdf.multi_cell(0, 10,
+                f"Under {rule.get('name') or 'your local labor law'}, for each shift exceeding "
+                f"{rule['long_shift_threshold']} hours, you are owed an additional {rule['long_shift_bonus']} "
+                f"hour at minimum wage (${rule['minimum_wage']}/hour). "
+                f"With {exceeded_shifts_count} shifts exceeding {rule['long_shift_threshold']} hours, "
                 f"total additional compensation: ${additional_pay:.2f}"
             )
+            self._place(pdf, self._blocks['pro_tip'])
 
-            pdf.ln(5)
-            pdf.set_text_color(255, 128, 0)  # Orange for Pro Tip
-            pdf.set_font("Arial", 'B', 12)
-            pdf.cell(0, 10, "PRO TIP: Automate Your Wage Tracking!", ln=True)
-            pdf.set_text_color(0, 0, 0)
-            pdf.set_font("Arial", '', 12)
-            pdf.multi_cell(0, 10, 
-                "Pro Tip automatically tracks and calculates these "
-                "complex wage requirements, ensuring you never miss out on "
-                "your rightful compensation. Upgrade to simplify your "
-                "wage compliance monitoring!"
-            )
-        
-        # Reset text color to black for any following content
-        pdf.set_text_color(0, 0, 0)
-        
-        # Add timestamp at the bottom
         pdf.ln(10)
         pdf.set_font("Arial", '', 10)
         pdf.set_text_color(128, 128, 128)  # Gray
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         pdf.cell(0, 10, f"Report generated: {timestamp}", ln=True, align='C')
 
-        # Output the PDF
-        request_id = uuid.uuid4().hex[:8]
-        report_path = os.path.join(
-            self.temp_dir, 
-            f"compliance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{request_id}.pdf"
+    def _output(self, pdf: FPDF) -> bytes:
+        """
+        Write the document as a compact PDF 1.5 file, using the objects prepared in __init__.
+
+        Page contents are compressed streams as in FPDF.output(); every other
+        object goes into one compressed object stream indexed by a
+        cross-reference stream instead of being written out in plain text.
+        Only what reports use is supported: the core fonts in FONTS (which
+        readers provide, so nothing is embedded), portrait pages, and no
+        links, images or footer.
+        """
+        pages = pdf.page
+        # Objects are numbered as FPDF.output() numbers them, followed by the
+        # object stream and the cross-reference stream
+        font_numbers = tuple(range(2 * pages + 3, 2 * pages + 3 + len(self._font_objects)))
+        info = 2 * pages + 3 + len(self._font_objects)
+        catalog = info + 1
+        object_stream = catalog + 1
+        xref = object_stream + 1
+
+        parts = [b"%PDF-1.5\n"]
+        offsets = {}
+        size = len(parts[0])
+
+        def put(number: int, dictionary: bytes, data: bytes):
+            nonlocal size
+            offsets[number] = size
+            obj = b"%d 0 obj\n<<%s /Length %d>>\nstream\n%s\nendstream\nendobj\n" % (number, dictionary, len(data), data)
+            parts.append(obj)
+            size += len(obj)
+
+        for page in range(1, pages + 1):
+            content = zlib.compress(pdf.pages[page].encode('latin-1'), REPORT_COMPRESSION_LEVEL)
+            put(2 + 2 * page, b"/Filter /FlateDecode", content)
+
+        kids = b" ".join(b"%d 0 R" % (1 + 2 * page) for page in range(1, pages + 1))
+        created = datetime.now().strftime('%Y%m%d%H%M%S').encode('latin-1')
+        objects = [
+            (1, b"<</Type /Pages /Kids [%s] /Count %d %s>>" % (kids, pages, self._media_box)),
+            (2, self._resources % font_numbers),
+        ]
+        objects.extend(
+            (1 + 2 * page, b"<</Type /Page /Parent 1 0 R /Resources 2 0 R /Contents %d 0 R>>" % (2 + 2 * page))
+            for page in range(1, pages + 1)
         )
-        pdf.output(report_path)
-        logger.info(f"Compliance report generated: {report_path}")
-        return report_path
+        objects.extend(zip(font_numbers, self._font_objects))
+        objects.append((info, b"<<%s /CreationDate (D:%s)>>" % (self._producer, created)))
+        objects.append((catalog, b"<</Type /Catalog /Pages 1 0 R /OpenAction [3 0 R /FitH null] /PageLayout /OneColumn>>"))
 
-    def send_email_report(self, email: str, report_path: str) -> bool:
-        """Send email with compliance report"""
+        # Object stream: pairs of object number and offset, then the objects
+        header, position = [], 0
+        for number, obj in objects:
+            header.append(b"%d %d" % (number, position))
+            position += len(obj) + 1
+        header = b" ".join(header) + b"\n"
+        data = zlib.compress(header + b"\n".join(obj for _, obj in objects), REPORT_COMPRESSION_LEVEL)
+        put(object_stream, b"/Type /ObjStm /N %d /First %d /Filter /FlateDecode" % (len(objects), len(header)), data)
+
+        # Cross-reference stream: type, offset or object stream, generation or index
+        index = {number: i for i, (number, _) in enumerate(objects)}
+        offsets[xref] = size
+        rows = [b"\x00\x00\x00\x00\x00\xff\xff"]
+        for number in range(1, xref + 1):
+            if number in offsets:
+                rows.append(b"\x01" + offsets[number].to_bytes(4, 'big') + b"\x00\x00")
+            else:
+                rows.append(b"\x02" + object_stream.to_bytes(4, 'big') + index[number].to_bytes(2, 'big'))
+        put(xref, b"/Type /XRef /Size %d /W [1 4 2] /Root %d 0 R /Info %d 0 R /Filter /FlateDecode"
+            % (xref + 1, catalog, info), zlib.compress(b"".join(rows), REPORT_COMPRESSION_LEVEL))
+        parts.append(b"startxref\n%d\n%%%%EOF\n" % offsets[xref])
+        return b"".join(parts)
+
+    def render(
+        self,
+        employee_data: Dict[str, Any],
+        compliance_results: Dict[str, Any],
+        user_input: Dict[str, Any] = None
+    ) -> bytes:
+        """Render one compliance report and return the PDF as bytes"""
+        pdf = self._new_document()
+        self._draw_report(pdf, employee_data, compliance_results, user_input or {})
+        return self._output(pdf)
+
+    def render_batch(self, reports: List[tuple], combined: bool = False):
+        """
+        Render many compliance reports in one call.
+
+        :param reports: (employee_data, compliance_results, user_input) per report
+        :param combined: Return a single PDF with one report per page instead of one PDF each
+        :return: List of PDF bytes, or the combined PDF bytes (empty if there are no reports)
+        """
+        if not combined:
+            return [self.render(*report) for report in reports]
+
+        pdf = self._new_document()
+        for employee_data, compliance_results, user_input in reports:
+            self._draw_report(pdf, employee_data, compliance_results, user_input or {})
+        if not pdf.page:
+            return b""
+        return self._output(pdf)
+
+
+class PaystubProcessor:
+    """Process paystubs for compliance checking"""
+
+    # Define regex patterns as class constants
+    PATTERNS = {
+        'employee_name': [
+            r"EMPLOYEE\s*NAME:\s*([\w\s]+)",
+            r"NAME:\s*([\w\s]+)",
+            r"EMPLOYEE:\s*([\w\s]+)"
+        ],
+        'net_pay': [
+            r"NET\s*PAY:\s*\$?([\d,]+\.\d{2})",
+            r"NET\s*PAY\s*\$?([\d,]+\.\d{2})",
+            r"TOTAL\s*NET\s*PAY:\s*\$?([\d,]+\.\d{2})"
+        ],
+        'total_hours': [
+            r"TOTAL\s*HOURS:\s*([\d.]+)",
+            r"HOURS\s*WORKED:\s*([\d.]+)",
+            r"HOURS:\s*([\d.]+)"
+        ],
+        'gross_pay': [
+            r"GROSS\s*PAY:\s*\$?([\d,]+\.\d{2})",
+            r"GROSS\s*EARNINGS:\s*\$?([\d,]+\.\d{2})",
+            r"TOTAL\s*GROSS:\s*\$?([\d,]+\.\d{2})"
+        ]
+    }
+
+    # Extraction stops early once all of these have been found
+    REQUIRED_FIELDS = ('employee_name', 'net_pay', 'total_hours', 'gross_pay')
+
+    def __init__(self, temp_dir: str = '/tmp'):
+        """Initialize the Paystub Processor"""
+        self.temp_dir = temp_dir
+        self.field_extractor = FieldExtractor(self.PATTERNS)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.storage_service = StorageService(BUCKET_ID)
+
+    def validate_email(self, email: str) -> str:
+        """Validate the email using email_validator library"""
         try:
-            msg = Message(
-                "Your Compliance Report",
-                sender=app.config['MAIL_DEFAULT_SENDER'],
-                recipients=[email],
-                body="Please find your compliance report attached.",
-            )
+            email_validator.validate_email(email)
+            return ""
+        except email_validator.EmailNotValidError as e:
+            return str(e)
 
-            # Attach the report as a PDF file
-            with open(report_path, "rb") as f:
-                msg.attach("compliance_report.pdf", "application/pdf", f.read())
+    def download_pdf(self, file_url: str, destination: str = None) -> Optional[str]:
+        """Download PDF from Google Cloud Storage"""
+        try:
+            return self.storage_service.download_file(file_url, destination or self.temp_dir)
+        except Exception as e:
+            logger.error(f"PDF download from GCS failed: {e}")
+            return None
 
-            # Send the email
-            mail.send(msg)
-            logger.info(f"Email sent to {email} with report {report_path}")
-            return True
+    def download_pdf_bytes(self, file_url: str) -> Optional[bytes]:
+        """Download PDF from Google Cloud Storage into memory"""
+        try:
+            return self.storage_service.download_bytes(file_url, MAX_FILE_SIZE)
         except Exception as e:
-            logger.error(f"Email sending failed: {e}")
-            logger.error(traceback.format_exc())
-            return False
+            logger.error(f"PDF download from GCS failed: {e}")
+            return None
+    
+    def extract_pdf_text(self, pdf_path: str) -> str:
+        """Extract text from PDF with robust error handling"""
+        try:
+            # Verify file exists and is valid
+            self._validate_pdf_file(pdf_path)
 
-    def generate_document_id(self, file_url: str) -> str:
-        """Generate a secure document ID for Firestore"""
-        logger.info(f"Generating document ID for file_url: {file_url}")
-        
-        # Normalize the file_url to ensure consistency
-        if '/' in file_url:
-            parts = file_url.split('/')
-            normalized_url = '/'.join(parts[-2:]) if len(parts) >= 2 else file_url
-        else:
-            normalized_url = file_url
+            # Process the PDF
+            with open(pdf_path, 'rb') as file:
+                return self._extract_text_from_stream(file)
 
-        logger.info(f"Normalized URL for ID generation: {normalized_url}")
-        
-        # Create a hash of the normalized file_url
-        doc_id = hashlib.md5(normalized_url.encode()).hexdigest()
-        logger.info(f"Generated document ID: {doc_id}")
-        return doc_id
+        except Exception as e:
+            logger.error(f"Text extraction failed: {e}")
+            logger.error(traceback.format_exc())
+            return ""
 
-    def update_processing_status(self, file_url: str, email: str, status: str, message: str = "") -> bool:
-        """Update processing status in Firestore"""
+    def extract_pdf_text_from_bytes(self, pdf_bytes: bytes) -> str:
+        """Extract text from an in-memory PDF with robust error handling"""
         try:
-            doc_id = self.generate_document_id(file_url)
-            doc_ref = db.collection('processing_status').document(doc_id)
-            
-            doc_ref.set({
-                'file_url': file_url,
-                'email': email,
-                'status': status,
-                'message': message,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            
-            logger.info(f"Updated processing status for {file_url} to {status}")
-            return True
+            self._validate_pdf_bytes(pdf_bytes)
+            return self._extract_text_from_stream(io.BytesIO(pdf_bytes))
+
         except Exception as e:
-            logger.error(f"Failed to update processing status: {e}")
-            return False
+            logger.error(f"Text extraction failed: {e}")
+            logger.error(traceback.format_exc())
+            return ""
+
+    def _extract_text_from_stream(self, stream) -> str:
+        """Extract text from every page of an open PDF stream"""
+        try:
+            reader = PyPDF2.PdfReader(stream)
+            if len(reader.pages) == 0:
+                logger.warning("PDF has no pages")
+                return ""
+
+            text = "".join(self.iter_page_text(reader))
+
+            if not text.strip():
+                logger.warning("No text extracted from PDF")
+
+            return text
+
+        except PyPDF2.errors.PdfReadError as e:
+            logger.error(f"PDF read error: {e}")
+            return ""
+
+    def iter_page_text(
+        self,
+        reader: PyPDF2.PdfReader,
+        max_pages: int = 0,
+        time_budget: float = 0,
+        first_page: int = 0
+    ):
+        """
+        Lazily yield the text of each page.
+
+        :param reader: Open PdfReader
+        :param max_pages: Stop after this many pages (0 for no limit)
+        :param time_budget: Stop starting new pages after this many seconds (0 for no limit)
+        :param first_page: Index of the first page to read
+        """
+        deadline = time.monotonic() + time_budget if time_budget > 0 else None
+        for index in range(first_page, len(reader.pages)):
+            read = index - first_page
+            if max_pages and read >= max_pages:
+                logger.info(f"Stopping text extraction at the {max_pages} page cap")
+                return
+            if deadline is not None and read > 0 and time.monotonic() > deadline:
+                logger.warning(f"Text extraction time budget exhausted after {read} pages")
+                return
+
+            try:
+                yield reader.pages[index].extract_text() or ""
+            except Exception as e:
+                logger.warning(f"Error extracting text from page: {e}")
+                # Continue with next page
+                yield ""
+
+    def extract_and_parse_pdf_bytes(
+        self,
+        pdf_bytes: bytes,
+        max_pages: int = EXTRACT_MAX_PAGES,
+        time_budget: float = EXTRACT_TIME_BUDGET
+    ) -> Dict[str, Any]:
+        """
+        Extract text page by page, parsing as it goes, until every required field is found.
+
+        Trailing pages (YTD tables, legal boilerplate) are never extracted once
+        the fields are resolved from the pages before them.
+
+        :param pdf_bytes: Raw PDF content
+        :param max_pages: Page cap (0 for no limit)
+        :param time_budget: Time budget in seconds (0 for no limit)
+        :return: Dict with text_length, data, pages_read, page_count and parse_seconds
+        """
+        result = {'text_length': 0, 'data': {}, 'pages_read': 0, 'page_count': 0, 'parse_seconds': 0.0}
+        try:
+            self._validate_pdf_bytes(pdf_bytes)
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            result['page_count'] = len(reader.pages)
+            if result['page_count'] == 0:
+                logger.warning("PDF has no pages")
+                return result
+
+            parts = []
+            data = {}
+            for page_text in self.iter_page_text(reader, max_pages, time_budget):
+                parts.append(page_text)
+                result['pages_read'] += 1
+                if not page_text:
+                    continue
+
+                parse_start = time.perf_counter()
+                data = self._match_fields("".join(parts))
+                result['parse_seconds'] += time.perf_counter() - parse_start
+                if all(data.get(field) is not None for field in self.REQUIRED_FIELDS):
+                    break
+
+            result['text_length'] = sum(len(part) for part in parts)
+            if not result['text_length']:
+                logger.warning("No text extracted from PDF")
+                return result
+
+            for key, value in data.items():
+                if value is None:
+                    logger.warning(f"Could not extract {key}")
+            result['data'] = data
+
+            if result['pages_read'] < result['page_count']:
+                logger.info(f"Extracted {result['pages_read']} of {result['page_count']} pages")
+            return result
+
+        except PyPDF2.errors.PdfReadError as e:
+            logger.error(f"PDF read error: {e}")
+            return result
+        except Exception as e:
+            logger.error(f"Text extraction failed: {e}")
+            logger.error(traceback.format_exc())
+            return result
+
+    def _validate_pdf_file(self, pdf_path: str) -> bool:
+        """Validate that the file exists, is not empty, and is actually a PDF"""
+        # Verify file exists
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
+        # Check file size
+        file_size = os.path.getsize(pdf_path)
+        if file_size == 0:
+            raise ValueError(f"PDF file is empty: {pdf_path}")
+
+        # Check file is actually a PDF
+        with open(pdf_path, 'rb') as file:
+            header = file.read(5)
+            if header != b'%PDF-':
+                raise ValueError(f"File is not a valid PDF: {pdf_path}")
+
+        return True
+
+    def _validate_pdf_bytes(self, pdf_bytes: bytes) -> bool:
+        """Validate that an in-memory PDF is not empty, within size limits, and is actually a PDF"""
+        if not pdf_bytes:
+            raise ValueError("PDF data is empty")
+
+        if len(pdf_bytes) > MAX_FILE_SIZE:
+            raise ValueError(f"PDF exceeds maximum size of {MAX_FILE_SIZE} bytes")
+
+        if bytes(pdf_bytes[:5]) != b'%PDF-':
+            raise ValueError("Data is not a valid PDF")
+
+        return True
+
+    def parse_paystub_data(self, text: str) -> Dict[str, Any]:
+        """Parse paystub data with robust error handling"""
+        if not text:
+            logger.error("No text provided for parsing")
+            return {}
+
+        results = {}  # Initialize results
+        try:
+            results = self._match_fields(text)
+            for key, value in results.items():
+                if value is None:
+                    logger.warning(f"Could not extract {key}")
+
+        except Exception as e:
+            logger.error(f"Paystub data parsing failed: {e}")
+            logger.error(traceback.format_exc())
+
+        return results
+
+    def _match_fields(self, text: str) -> Dict[str, Any]:
+        """Match the field patterns against the text; missing fields are None"""
+        return self.field_extractor.extract(text)
+
+    def perform_compliance_checks(self, data: Dict[str, Any], user_input: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Perform compliance checks on paystub data, using the wage rule for the user's state, city and pay date."""
+        if user_input is None:
+            user_input = {}
+        rule = wage_rules.resolve(user_input)
+            
+        checks = {
+            'minimum_wage': False,
+            'overtime_compliant': False,
+            'total_compensation_valid': False,
+            'long_shift_additional_pay_violation': False
+        }
+
+        # Safely extract values with defaults
+        net_pay = float(data.get('net_pay', 0) or 0)
+        total_hours = float(data.get('total_hours', 0) or 0)
+        gross_pay = float(data.get('gross_pay', 0) or 0)
+
+        # Check total compensation validity
+        checks['total_compensation_valid'] = net_pay > 0 and gross_pay > 0
+
+        # Only perform calculations if we have valid values
+        if net_pay > 0 and total_hours > 0:
+            # Calculate the regular hourly rate
+            regular_hourly_rate = net_pay / total_hours if total_hours <= 40 else gross_pay / total_hours
+
+            # Check minimum wage compliance
+            checks['minimum_wage'] = regular_hourly_rate >= rule['minimum_wage']
+
+            # Check overtime compliance (if applicable)
+            checks['overtime_compliant'] = self._check_overtime_compliance(
+                total_hours, regular_hourly_rate, gross_pay, rule['overtime_rate']
+            )
+
+        # Check for long shift violations
+        self._check_long_shifts(checks, user_input, rule)
+
+        # Rates the checks used, for the report
+        checks['wage_rule'] = rule
+
+        return checks
+
+    def perform_hours_checks(self, user_input: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Perform the checks that need hours worked only, for timesheets without pay data.
+
+        Only the spread of hours check applies: the pay checks of
+        perform_compliance_checks would fail for lack of pay amounts.
+        """
+        if user_input is None:
+            user_input = {}
+        rule = wage_rules.resolve(user_input)
+
+        checks = {'long_shift_additional_pay_violation': False, 'additional_pay_owed': 0.0}
+        self._check_long_shifts(checks, user_input, rule)
+        checks['wage_rule'] = rule
+        return checks
+
+    def _check_long_shifts(self, checks: Dict[str, Any], user_input: Dict[str, Any], rule: Dict[str, Any]):
+        """Flag shifts over the rule's long shift threshold and the additional pay owed for them"""
+        shifts_exceeded_10_hours = user_input.get('shifts_exceeded_10_hours', False)
+        exceeded_shifts_count = int(user_input.get('exceeded_shifts_count', 0))
+
+        # If user confirms shifts over the rule's long shift threshold, where the
+        # rule owes anything for them (only NY has a spread of hours rule)
+        if shifts_exceeded_10_hours and exceeded_shifts_count > 0 and rule['long_shift_bonus'] > 0:
+            # Calculate additional pay owed (long shift bonus hours at minimum wage per qualifying shift)
+            additional_pay_owed = exceeded_shifts_count * rule['minimum_wage'] * rule['long_shift_bonus']
+
+            # Add this calculation to the compliance check
+            checks['long_shift_additional_pay_violation'] = True
+            checks['additional_pay_owed'] = additional_pay_owed
+
+    def _check_overtime_compliance(
+        self, hours: float, hourly_rate: float, gross_pay: float, overtime_rate: float = OVERTIME_RATE
+    ) -> bool:
+        """Check if overtime pay complies with regulations"""
+        if hours <= 40:
+            return True
+
+        overtime_hours = hours - 40
+        overtime_pay = gross_pay - (40 * hourly_rate)
+        return overtime_pay >= (overtime_hours * hourly_rate * overtime_rate)
+
+    def perform_compliance_checks_batch(
+        self,
+        net_pay,
+        gross_pay,
+        total_hours,
+        exceeded_shifts_count=None,
+        shifts_exceeded_10_hours=None,
+        rule: Dict[str, Any] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Vectorized perform_compliance_checks over columns of pay periods.
+
+        Row i of every result matches perform_compliance_checks for row i of
+        the inputs, including the floating point rounding. Pass missing values
+        as 0, which is what the scalar path uses for None.
+
+        :param net_pay: Net pay per row
+        :param gross_pay: Gross pay per row
+        :param total_hours: Hours worked per row
+        :param exceeded_shifts_count: Shifts over the long shift threshold per row (default 0)
+        :param shifts_exceeded_10_hours: Whether the employee reported long shifts
+            (default False, as in the scalar path)
+        :param rule: Resolved wage rule for every row (default: wage_rules.resolve())
+        :return: Dict of result arrays; additional_pay_owed is 0 where there is no violation
+        """
+        if rule is None:
+            rule = wage_rules.resolve()
+        minimum_wage_rate = rule['minimum_wage']
+
+        net = np.asarray(net_pay, dtype=np.float64)
+        gross = np.asarray(gross_pay, dtype=np.float64)
+        hours = np.asarray(total_hours, dtype=np.float64)
+        rows = net.shape[0]
+        if gross.shape != (rows,) or hours.shape != (rows,):
+            raise ValueError("net_pay, gross_pay and total_hours must be 1-D and the same length")
+
+        if exceeded_shifts_count is None:
+            shift_counts = np.zeros(rows, dtype=np.int64)
+        else:
+            counts = np.nan_to_num(np.asarray(exceeded_shifts_count, dtype=np.float64), nan=0.0)
+            shift_counts = np.trunc(counts).astype(np.int64)  # int() in the scalar path
+        if shifts_exceeded_10_hours is None:
+            long_shifts = np.zeros(rows, dtype=bool)
+        else:
+            long_shifts = np.asarray(shifts_exceeded_10_hours, dtype=bool)
+        if shift_counts.shape != (rows,) or long_shifts.shape != (rows,):
+            raise ValueError("Shift columns must be the same length as the pay columns")
+
+        total_compensation_valid = (net > 0) & (gross > 0)
+        rated = (net > 0) & (hours > 0)
+
+        # Regular hourly rate, only where the scalar path computes one
+        safe_hours = np.where(rated, hours, 1.0)
+        rate = np.where(hours <= 40, net / safe_hours, gross / safe_hours)
+
+        minimum_wage = rated & (rate >= minimum_wage_rate)
+
+        overtime_hours = hours - 40
+        overtime_pay = gross - (40 * rate)
+        overtime_compliant = rated & ((hours <= 40) | (overtime_pay >= (overtime_hours * rate * rule['overtime_rate'])))
+
+        long_shift_violation = long_shifts & (shift_counts > 0) & (rule['long_shift_bonus'] > 0)
+        additional_pay_owed = np.where(long_shift_violation, shift_counts * minimum_wage_rate * rule['long_shift_bonus'], 0.0)
+
+        return {
+            'minimum_wage': minimum_wage,
+            'overtime_compliant': overtime_compliant,
+            'total_compensation_valid': total_compensation_valid,
+            'long_shift_additional_pay_violation': long_shift_violation,
+            'additional_pay_owed': additional_pay_owed
+        }
+
+    def generate_compliance_report(
+        self, 
+        employee_data: Dict[str, Any], 
+        compliance_results: Dict[str, Any],
+        user_input: Dict[str, Any] = None
+    ) -> str:
+        """Generate PDF compliance report with color-coded status"""
+        report_bytes = self.render_compliance_report(employee_data, compliance_results, user_input)
+        return self.save_report(report_bytes)
+
+    def render_compliance_report(
+        self,
+        employee_data: Dict[str, Any],
+        compliance_results: Dict[str, Any],
+        user_input: Dict[str, Any] = None
+    ) -> bytes:
+        """Render the PDF compliance report and return it as bytes"""
+        return report_renderer.render(employee_data, compliance_results, user_input)
+
+    def save_report(self, report_bytes: bytes, directory: str = None) -> str:
+        """Write a rendered report to the temp directory and return its path"""
+        request_id = uuid.uuid4().hex[:8]
+        report_path = os.path.join(
+            directory or self.temp_dir, 
+            f"compliance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{request_id}.pdf"
+        )
+        with open(report_path, 'wb') as f:
+            f.write(report_bytes)
+        logger.info(f"Compliance report generated: {report_path}")
+        return report_path
+
+    def send_email_report(self, email: str, report_path: str, report_key: str = None) -> bool:
+        """Send email with compliance report"""
+        try:
+            with open(report_path, "rb") as f:
+                report_bytes = f.read()
+        except OSError as e:
+            logger.error(f"Failed to read report {report_path}: {e}")
+            return False
+
+        return self.send_email_report_bytes(email, report_bytes, report_key)
+
+    def send_email_report_bytes(self, email: str, report_bytes: bytes, report_key: str = None) -> bool:
+        """Send email with an in-memory compliance report"""
+        return self.send_message(self.report_message(email, report_bytes, report_key))
+
+    def report_link(self, report_bytes: bytes, name: str = None, filename: str = 'compliance_report.pdf') -> Optional[str]:
+        """
+        Store a report in the bucket and describe where to download it.
+
+        :param report_bytes: PDF contents
+        :param name: Name identifying the report in the bucket
+        :param filename: File name offered when the report is downloaded
+        :return: Signed download link and its expiry for an email body, or None if the report could not be stored
+        """
+        try:
+            blob_name = self.storage_service.upload_report(report_bytes, name, filename)
+            url, expires_at = self.storage_service.signed_url(blob_name, REPORT_LINK_EXPIRY)
+        except Exception as e:
+            logger.warning(f"Could not create a download link, attaching the report instead: {e}")
+            return None
+        expires = time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(expires_at))
+        return f"{url}\n\nThe link expires on {expires}."
+
+    def report_message(self, email: str, report_bytes: bytes, report_key: str = None) -> Message:
+        """
+        Build the email carrying a compliance report.
+
+        With REPORT_DELIVERY=link the report is stored in the bucket and the
+        email only carries a signed download link; otherwise, or if the report
+        could not be stored, the PDF is attached.
+
+        :param email: Recipient
+        :param report_bytes: PDF contents
+        :param report_key: Compliance cache key of the report, so a job that is retried stores it only once
+        """
+        link = self.report_link(report_bytes, report_key) if REPORT_DELIVERY == 'link' else None
+        msg = Message(
+            "Your Compliance Report",
+            sender=app.config['MAIL_DEFAULT_SENDER'],
+            recipients=[email],
+            body=(
+                f"Your compliance report is ready. Download it here:\n\n{link}"
+                if link else "Please find your compliance report attached."
+            ),
+        )
+
+        if not link:
+            # Attach the report as a PDF file
+            msg.attach("compliance_report.pdf", "application/pdf", report_bytes)
+        return msg
+
+    def send_register_summary(
+        self,
+        email: str,
+        summary: Dict[str, int],
+        summary_csv: bytes,
+        flagged_report: bytes = None
+    ) -> bool:
+        """Send email with the per-employee results of a payroll register attached as CSV"""
+        return self.send_message(self.register_summary_message(email, summary, summary_csv, flagged_report))
+
+    def register_summary_message(
+        self,
+        email: str,
+        summary: Dict[str, int],
+        summary_csv: bytes,
+        flagged_report: bytes = None
+    ) -> Message:
+        """Build the email carrying a payroll register summary"""
+        body = (
+            f"We checked {summary['employees']} employees in your payroll register; "
+            f"{summary['flagged']} have possible compliance issues and "
+            f"{summary['incomplete']} could not be fully read.\n\n"
+            "Please find the per-employee results attached."
+        )
+        attachments = []
+        link = None
+        if flagged_report and REPORT_DELIVERY == 'link':
+            link = self.report_link(flagged_report, filename="flagged_employees.pdf")
+        if link:
+            body += f"\n\nThe compliance reports of the flagged employees can be downloaded as one PDF:\n\n{link}"
+        elif flagged_report:
+            body += " The compliance reports of the flagged employees are attached as one PDF."
+            attachments.append(("flagged_employees.pdf", "application/pdf", flagged_report))
+        return self.csv_summary_message(
+            email,
+            "Your Payroll Register Compliance Summary",
+            body,
+            "register_summary.csv",
+            summary_csv,
+            attachments
+        )
+
+    def send_csv_summary(
+        self,
+        email: str,
+        subject: str,
+        body: str,
+        filename: str,
+        summary_csv: bytes,
+        attachments: List[tuple] = ()
+    ) -> bool:
+        """Send email with a CSV summary and any (filename, content type, data) attachments"""
+        return self.send_message(self.csv_summary_message(email, subject, body, filename, summary_csv, attachments))
+
+    def csv_summary_message(
+        self,
+        email: str,
+        subject: str,
+        body: str,
+        filename: str,
+        summary_csv: bytes,
+        attachments: List[tuple] = ()
+    ) -> Message:
+        """Build an email with a CSV summary and any (filename, content type, data) attachments"""
+        msg = Message(
+            subject,
+            sender=app.config['MAIL_DEFAULT_SENDER'],
+            recipients=[email],
+            body=body,
+        )
+        msg.attach(filename, "text/csv", summary_csv)
+        for attachment in attachments:
+            msg.attach(*attachment)
+        return msg
+
+    def send_message(self, msg: Message) -> bool:
+        """Send an email over a pooled SMTP connection and wait for the result"""
+        try:
+            smtp_pool.send(msg)
+            logger.info(f"Email sent to {', '.join(msg.recipients)}: {describe_message(msg)}")
+            return True
+        except Exception as e:
+            logger.error(f"Email sending failed: {e}")
+            logger.error(traceback.format_exc())
+            return False
+
+    def generate_document_id(self, file_url: str) -> str:
+        """Generate a secure document ID for Firestore"""
+        logger.debug(f"Generating document ID for file_url: {file_url}")
+        
+        # Normalize the file_url to ensure consistency
+        if '/' in file_url:
+            parts = file_url.split('/')
+            normalized_url = '/'.join(parts[-2:]) if len(parts) >= 2 else file_url
+        else:
+            normalized_url = file_url
+
+        logger.debug(f"Normalized URL for ID generation: {normalized_url}")
+        
+        # Create a hash of the normalized file_url
+        doc_id = hashlib.md5(normalized_url.encode()).hexdigest()
+        logger.debug(f"Generated document ID: {doc_id}")
+        return doc_id
+
+    def update_processing_status(
+        self,
+        file_url: str,
+        email: str,
+        status: str,
+        message: str = "",
+        write_through: bool = False,
+        **fields
+    ) -> bool:
+        """
+        Update processing status in Firestore; extra fields are stored with it.
+
+        Intermediate statuses are buffered by the status writer and replaced by
+        a later update of the same file; terminal statuses are written before
+        this returns.
+
+        :param write_through: Also write an intermediate status right away, e.g.
+            when the client or another process acts on it next
+        """
+        try:
+            doc_id = self.generate_document_id(file_url)
+            document = {
+                'file_url': file_url,
+                'email': email,
+                'status': status,
+                'message': message,
+                'updated_at': firestore.SERVER_TIMESTAMP,
+                **fields
+            }
+            written = status_writer.update(doc_id, document, write_through)
+
+            if written:
+                status_cache.invalidate(doc_id)
+                status_broker.publish(doc_id, document)
+                if status in StatusWriter.TERMINAL_STATUSES:
+                    jobs_finished.inc(status)
+                logger.info(f"Updated processing status for {file_url} to {status}")
+            return written
+        except Exception as e:
+            logger.error(f"Failed to update processing status: {e}")
+            return False
+
+
+def describe_message(msg: Message) -> str:
+    """Subject and attachment sizes of an email, for logging"""
+    size = sum(len(attachment.data) for attachment in msg.attachments)
+    return f"{msg.subject} ({len(msg.attachments)} attachments, {size} bytes)"
+
+
+class SMTPConnectionPool:
+    """Process-wide pool of authenticated SMTP connections.
+
+    mail.send() connects, starts TLS and logs in for every message. Connections
+    here are kept open and reused until they have been idle for max_idle
+    seconds or have sent max_messages messages; a connection that drops
+    mid-send is replaced and the message retried once.
+    """
+
+    def __init__(self, mail_state, max_connections: int, max_idle: float, max_messages: int):
+        """
+        Initialize the pool; connections are opened on demand.
+
+        :param mail_state: Flask-Mail settings (mail.state)
+        :param max_connections: Most connections open at once; further senders wait
+        :param max_idle: Seconds an idle connection may be reused after
+        :param max_messages: Messages sent before a connection is replaced
+        """
+        self.mail_state = mail_state
+        self.max_connections = max(1, max_connections)
+        self.max_idle = max_idle
+        self.max_messages = max(1, max_messages)
+        self._idle = []  # (connection, messages sent, last used)
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'reconnects': 0, 'sent': 0, 'failed': 0}
+
+    @staticmethod
+    def _connection_failed(error: Exception) -> bool:
+        """True if the connection is unusable after error, False if only the message was refused"""
+        if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421  # Service closing the channel
+        # SMTPException subclasses OSError; anything else here is a socket error
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    def _connect(self) -> Connection:
+        """Open and authenticate a new connection"""
+        connection = Connection(self.mail_state)
+        connection.host = None if self.mail_state.suppress else connection.configure_host()
+        with self._lock:
+            self._stats['opened'] += 1
+        return connection
+
+    @staticmethod
+    def _close(connection: Connection):
+        """Close a connection, ignoring errors from one that is already gone"""
+        if connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except Exception:
+            connection.host.close()
+
+    def _acquire(self) -> tuple:
+        """Take an idle connection that is still fresh, or open one; returns (connection, messages sent)"""
+        self._slots.acquire()
+        stale = []
+        try:
+            with self._lock:
+                while self._idle:
+                    connection, sent, last_used = self._idle.pop()
+                    if time.monotonic() - last_used <= self.max_idle:
+                        return connection, sent
+                    stale.append(connection)
+            return self._connect(), 0
+        except Exception:
+            self._slots.release()
+            raise
+        finally:
+            for connection in stale:
+                self._close(connection)
+
+    def _release(self, connection: Optional[Connection], sent: int):
+        """Return a connection to the pool, or close it once it has sent max_messages; frees its slot"""
+        try:
+            if connection is None:
+                return
+            if sent >= self.max_messages:
+                self._close(connection)
+                return
+            with self._lock:
+                self._idle.append((connection, sent, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def send_many(self, messages: List[Message]) -> List[Optional[Exception]]:
+        """
+        Send messages one after another over a single pooled connection.
+
+        :param messages: Flask-Mail messages
+        :return: None for each message that was sent, or the error that stopped it
+        """
+        start = time.perf_counter()
+        results = []
+        connection, sent = None, 0
+        acquired = False
+        try:
+            connection, sent = self._acquire()
+            acquired = True
+            # Flask-Mail signals email_dispatched on the current app
+            with app.app_context():
+                for message in messages:
+                    error = None
+                    for _ in range(2):
+                        if connection is None:
+                            connection, sent = self._connect(), 0
+                            with self._lock:
+                                self._stats['reconnects'] += 1
+                        try:
+                            connection.send(message)
+                        except Exception as e:
+                            error = e
+                            if self._connection_failed(e):
+                                # Idle timeout or dropped connection; retry once on a new one
+                                self._close(connection)
+                                connection = None
+                                continue
+                        else:
+                            error = None
+                            sent += 1
+                        break
+                    results.append(error)
+        except Exception as e:
+            # Could not connect or log in; nothing else in the batch can be sent
+            if connection is not None:
+                self._close(connection)
+                connection = None
+            results.extend([e] * (len(messages) - len(results)))
+        finally:
+            if acquired:
+                self._release(connection, sent)
+
+        failed = sum(error is not None for error in results)
+        with self._lock:
+            self._stats['sent'] += len(results) - failed
+            self._stats['failed'] += failed
+        email_send_seconds.observe(time.perf_counter() - start)
+        emails_sent.inc('sent', amount=len(results) - failed)
+        if failed:
+            emails_sent.inc('failed', amount=failed)
+        return results
+
+    def send(self, message: Message):
+        """Send one message, raising the error if it could not be sent"""
+        error = self.send_many([message])[0]
+        if error is not None:
+            raise error
+
+    def stats(self) -> Dict[str, Any]:
+        """Return connection and message counts"""
+        with self._lock:
+            return {'idle': len(self._idle), 'max_connections': self.max_connections, **self._stats}
+
+
+class MailOutbox:
+    """Send emails on background threads so job workers never wait for SMTP.
+
+    Each sender thread takes whatever is queued, up to batch_size messages,
+    and sends it over one pooled connection.
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, workers: int, batch_size: int, queue_size: int):
+        """Initialize the outbox; sender threads start on first submit"""
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'submitted': 0, 'rejected': 0, 'sent': 0, 'failed': 0, 'batches': 0}
+
+    def _ensure_started(self):
+        """Start the sender threads if they are not running yet"""
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._loop, name=f"mail-outbox-{i}", daemon=True).start()
+            self._started = True
+
+    def submit(self, message: Message, callback=None):
+        """
+        Queue a message for sending.
+
+        :param message: Flask-Mail message
+        :param callback: Called on a sender thread with True once the message was sent, False if it failed
+        :raises QueueFullError: If the outbox is full
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((message, callback, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise QueueFullError(f"Mail outbox is full ({self._queue.maxsize} messages)") from None
+        with self._lock:
+            self._stats['submitted'] += 1
+
+    def _loop(self):
+        """Send queued messages in batches"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            now = time.monotonic()
+            for _, _, enqueued_at in batch:
+                queue_wait_seconds.observe(now - enqueued_at, 'mail_outbox')
+
+            errors = self.pool.send_many([message for message, _, _ in batch])
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['failed'] += sum(error is not None for error in errors)
+                self._stats['sent'] += sum(error is None for error in errors)
+
+            for (message, callback, _), error in zip(batch, errors):
+                if error is None:
+                    logger.info(f"Email sent to {', '.join(message.recipients)}: {describe_message(message)}")
+                else:
+                    logger.error(f"Email sending failed for {', '.join(message.recipients)}: {error}")
+                try:
+                    if callback is not None:
+                        callback(error is None)
+                except Exception as e:
+                    logger.error(f"Email callback failed: {e}")
+                    logger.error(traceback.format_exc())
+                finally:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for queued messages to be sent; True if the outbox is empty"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Mail outbox still has {self._queue.unfinished_tasks} messages after {timeout}s")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and message counts"""
+        with self._lock:
+            return {'queue_depth': self._queue.qsize(), 'workers': self.workers, **self._stats}
+
+
+class StatusWriter:
+    """Write-behind buffer for processing status documents.
+
+    Intermediate statuses are kept per document and a later update replaces
+    the pending one, so a job that moves on quickly costs one write instead
+    of several. A background thread commits whatever is pending in
+    WriteBatches every interval seconds. Terminal statuses are written
+    through at once, in the same batch as anything else pending.
+    """
+
+    TERMINAL_STATUSES = ('completed', 'completed_with_errors', 'failed')
+
+    def __init__(self, collection: str, interval: float, batch_size: int):
+        """Initialize the writer; the flush thread starts on the first buffered update"""
+        self.collection = collection
+        self.interval = interval
+        self.batch_size = min(max(1, batch_size), 500)
+        self._pending = OrderedDict()
+        # Documents being committed; a newer write of one waits so it never lands first
+        self._committing = set()
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._started = False
+        self._stats = {'updates': 0, 'coalesced': 0, 'writes': 0, 'batches': 0, 'failed': 0}
+
+    def update(self, doc_id: str, document: Dict[str, Any], write_through: bool = False) -> bool:
+        """
+        Record a status document.
+
+        :param doc_id: Processing status document ID
+        :param document: Full document; it replaces the stored one
+        :param write_through: Write now even if the status is not terminal
+        :return: False if a write-through failed; buffered updates return True
+        """
+        write_through = write_through or self.interval <= 0 or document.get('status') in self.TERMINAL_STATUSES
+        with self._lock:
+            self._stats['updates'] += 1
+            if doc_id in self._pending:
+                self._stats['coalesced'] += 1
+            if not write_through:
+                self._pending[doc_id] = document
+                start, self._started = not self._started, True
+
+        if write_through:
+            return doc_id not in self._commit({doc_id: document})
+        if start:
+            threading.Thread(target=self._loop, name="status-writer", daemon=True).start()
+        return True
+
+    def pending(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return a buffered status that has not been written yet"""
+        with self._lock:
+            return self._pending.get(doc_id)
+
+    def flush(self) -> bool:
+        """Write everything pending now; True if nothing failed"""
+        return not self._commit()
+
+    def _loop(self):
+        """Write pending statuses every interval seconds"""
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def _commit(self, updates: Dict[str, Dict[str, Any]] = None) -> set:
+        """
+        Write pending statuses and any write-through updates.
+
+        Pending statuses of documents that are still being committed by
+        another thread are left for the next flush. Pending statuses that
+        fail are buffered again unless a newer update of the same document
+        has arrived in the meantime.
+
+        :return: IDs of the documents that could not be written
+        """
+        updates = updates or {}
+        with self._committed:
+            while self._committing.intersection(updates):
+                self._committed.wait()
+            writes = OrderedDict(
+                (doc_id, self._pending.pop(doc_id))
+                for doc_id in list(self._pending)
+                if doc_id not in self._committing
+            )
+            for doc_id, document in updates.items():
+                self._pending.pop(doc_id, None)
+                writes.pop(doc_id, None)
+                writes[doc_id] = document
+            self._committing.update(writes)
+
+        failed = set()
+        try:
+            items = list(writes.items())
+            collection = db.collection(self.collection)
+            for start in range(0, len(items), self.batch_size):
+                chunk = items[start:start + self.batch_size]
+                commit_start = time.perf_counter()
+                try:
+                    batch = db.batch()
+                    for doc_id, document in chunk:
+                        batch.set(collection.document(doc_id), document)
+                    batch.commit()
+                except Exception as e:
+                    stage_failures.inc('status_write')
+                    logger.error(f"Failed to write {len(chunk)} processing statuses: {e}")
+                    failed.update(doc_id for doc_id, _ in chunk)
+                    with self._lock:
+                        self._stats['failed'] += len(chunk)
+                    continue
+                finally:
+                    stage_seconds.observe(time.perf_counter() - commit_start, 'status_write')
+                with self._lock:
+                    self._stats['writes'] += len(chunk)
+                    self._stats['batches'] += 1
+        finally:
+            with self._committed:
+                self._committing.difference_update(writes)
+                for doc_id in failed:
+                    if doc_id not in updates and doc_id not in self._pending:
+                        self._pending[doc_id] = writes[doc_id]
+                self._committed.notify_all()
+        return failed
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of pending documents and update counts"""
+        with self._lock:
+            return {'pending': len(self._pending), 'interval': self.interval, **self._stats}
+
+
+def status_event(document: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a status document sent to clients, with an ID naming the state"""
+    status = document.get('status', 'unknown')
+    message = document.get('message', '')
+    return {
+        'status': status,
+        'message': message,
+        'file_url': document.get('file_url'),
+        'event_id': hashlib.md5(f"{status}\n{message}".encode()).hexdigest()[:16]
+    }
+
+
+class StatusSubscription:
+    """Status changes of one document for one client, each delivered once"""
+
+    def __init__(self, doc_id: str, seen=()):
+        """
+        Initialize the subscription.
+
+        :param doc_id: Processing status document ID
+        :param seen: Event IDs the client already has, e.g. from Last-Event-ID
+        """
+        self.doc_id = doc_id
+        self.latest = None
+        self._seen = set(seen)
+        self._events = deque()
+        self._ready = threading.Condition()
+
+    def put(self, document: Dict[str, Any]):
+        """Queue a status unless the client has already had it"""
+        event = status_event(document)
+        with self._ready:
+            self.latest = event
+            if event['event_id'] in self._seen:
+                return
+            self._seen.add(event['event_id'])
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the next status event, or None if there was none within timeout seconds"""
+        with self._ready:
+            self._ready.wait_for(lambda: self._events, timeout)
+            return self._events.popleft() if self._events else None
+
+
+class StatusBroker:
+    """In-process publish/subscribe of processing status changes.
+
+    update_processing_status publishes every change here, so clients waiting
+    on a job that runs in this process are told without reading Firestore.
+    Jobs that run elsewhere (another instance, or worker.py) are followed
+    with one Firestore listener per document, shared by all of its
+    subscribers and stopped when the last one leaves. A document counts as
+    running here only once create_job() has started its job in this process;
+    an upload or "server busy" status written here may be picked up by a job
+    on any instance.
+    """
+
+    def __init__(self, max_subscribers: int, cache_size: int, listen: bool, local_jobs: bool):
+        """
+        Initialize the broker.
+
+        :param max_subscribers: Most subscriptions open at once
+        :param cache_size: Documents whose latest status is remembered
+        :param listen: Use Firestore listeners for documents updated elsewhere
+        :param local_jobs: Jobs run in this process, so a document whose job started here needs no listener
+        """
+        self.max_subscribers = max(1, max_subscribers)
+        self.cache_size = max(1, cache_size)
+        self.listen = listen
+        self.local_jobs = local_jobs
+        self._subscribers = {}
+        self._watches = {}
+        # Latest status by document: (document, published in this process)
+        self._latest = OrderedDict()
+        # Documents whose job runs in this process, least recently started first
+        self._running = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'subscribed': 0, 'rejected': 0, 'published': 0, 'listener_updates': 0, 'reads': 0}
+
+    def _remember(self, doc_id: str, document: Dict[str, Any], local: bool):
+        """Keep the latest status of a document, evicting the least recently updated one"""
+        self._latest[doc_id] = (document, local)
+        self._latest.move_to_end(doc_id)
+        while len(self._latest) > self.cache_size:
+            self._latest.popitem(last=False)
+
+    def publish(self, doc_id: str, document: Dict[str, Any], local: bool = True):
+        """Pass a status change to the document's subscribers"""
+        with self._lock:
+            self._remember(doc_id, document, local)
+            subscribers = list(self._subscribers.get(doc_id, ()))
+            self._stats['published' if local else 'listener_updates'] += 1
+        for subscription in subscribers:
+            subscription.put(document)
+
+    def job_started(self, doc_id: str):
+        """Record that a document's job runs in this process, so its statuses are published here"""
+        if not self.local_jobs:
+            return
+        with self._lock:
+            self._running[doc_id] = True
+            self._running.move_to_end(doc_id)
+            while len(self._running) > self.cache_size:
+                self._running.popitem(last=False)
+
+    def job_rejected(self, doc_id: str):
+        """Forget a job that was turned away before it ran; it may be resubmitted to another instance"""
+        with self._lock:
+            self._running.pop(doc_id, None)
+
+    def subscribe(self, doc_id: str, seen=()) -> StatusSubscription:
+        """
+        Subscribe to a document's status; its current status is queued first.
+
+        :param doc_id: Processing status document ID
+        :param seen: Event IDs the client already has
+        :raises QueueFullError: If max_subscribers subscriptions are open
+        """
+        subscription = StatusSubscription(doc_id, seen)
+        with self._lock:
+            if sum(len(subscribers) for subscribers in self._subscribers.values()) >= self.max_subscribers:
+                self._stats['rejected'] += 1
+                raise QueueFullError(f"Too many status subscribers ({self.max_subscribers})")
+            self._subscribers.setdefault(doc_id, set()).add(subscription)
+            self._stats['subscribed'] += 1
+            latest = self._latest.get(doc_id)
+            watched = doc_id in self._watches
+            watch = self.listen and not watched and not (latest is not None and doc_id in self._running)
+            if watch:
+                self._watches[doc_id] = None
+
+        if latest is not None:
+            subscription.put(latest[0])
+        if watch:
+            # The listener's first snapshot is the current status
+            self._start_listener(doc_id)
+        elif latest is None and not watched:
+            document = self._read(doc_id)
+            if document is not None:
+                subscription.put(document)
+        return subscription
+
+    def unsubscribe(self, subscription: StatusSubscription):
+        """End a subscription, stopping the document's listener with the last one"""
+        doc_id = subscription.doc_id
+        with self._lock:
+            subscribers = self._subscribers.get(doc_id, set())
+            subscribers.discard(subscription)
+            if subscribers:
+                return
+            self._subscribers.pop(doc_id, None)
+            watch = self._watches.pop(doc_id, None)
+            if doc_id in self._latest and not self._latest[doc_id][1]:
+                # Without the listener a status from another process goes stale
+                del self._latest[doc_id]
+        if watch is not None:
+            watch.unsubscribe()
+
+    def _read(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Read a document's current status from the status writer or Firestore"""
+        document = status_writer.pending(doc_id)
+        if document is not None:
+            return document
+        try:
+            doc = db.collection('processing_status').document(doc_id).get()
+        except Exception as e:
+            logger.warning(f"Status read failed for {doc_id}: {e}")
+            return None
+        with self._lock:
+            self._stats['reads'] += 1
+        return doc.to_dict() if doc.exists else None
+
+    def _start_listener(self, doc_id: str):
+        """Follow a document with a Firestore listener"""
+        def on_snapshot(snapshots, changes, read_time):
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    self.publish(doc_id, snapshot.to_dict(), local=False)
+
+        try:
+            watch = db.collection('processing_status').document(doc_id).on_snapshot(on_snapshot)
+        except Exception as e:
+            logger.warning(f"Status listener failed for {doc_id}, reading once instead: {e}")
+            with self._lock:
+                self._watches.pop(doc_id, None)
+            document = self._read(doc_id)
+            if document is not None:
+                self.publish(doc_id, document, local=False)
+            return
+
+        with self._lock:
+            # The last subscriber may have left while the listener was starting
+            if doc_id in self._subscribers and doc_id in self._watches:
+                self._watches[doc_id] = watch
+                return
+        watch.unsubscribe()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return subscriber and listener counts"""
+        with self._lock:
+            return {
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'listeners': len(self._watches),
+                **self._stats
+            }
+
+
+class StatusCache:
+    """Short-lived in-process cache of status documents read from Firestore.
+
+    Updates made in this process invalidate their entry; updates made by
+    other instances show up once the entry is ttl seconds old. Documents
+    that do not exist are cached too.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        """Initialize the cache"""
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        # Document ID: (time read, document or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id: str) -> tuple:
+        """Return (True, document or None) for a fresh entry, (False, None) otherwise"""
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def set(self, doc_id: str, document: Optional[Dict[str, Any]]):
+        """Remember a document as read now; None records that it does not exist"""
+        with self._lock:
+            self._entries[doc_id] = (time.monotonic(), document)
+            self._entries.move_to_end(doc_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, doc_id: str):
+        """Forget a document after it was updated"""
+        with self._lock:
+            self._entries.pop(doc_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit and miss counts"""
+        with self._lock:
+            return {'entries': len(self._entries), 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+class ResultCache:
+    """Two-tier cache: an in-process LRU in front of a Firestore collection shared by all instances"""
+
+    def __init__(self, collection: str, max_entries: int):
+        """Initialize the cache"""
+        self.collection = collection
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        """Store a value in the LRU tier, evicting the least recently used entry"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a value in the LRU tier, then in Firestore"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        try:
+            doc = db.collection(self.collection).document(key).get()
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed: {e}")
+            doc = None
+
+        if doc is None or not doc.exists:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        value = doc.to_dict().get('value')
+        self._remember(key, value)
+        with self._lock:
+            self.shared_hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a value in both tiers; a failed Firestore write only loses the shared copy"""
+        self._remember(key, value)
+        try:
+            db.collection(self.collection).document(key).set({
+                'value': value,
+                'created_at': firestore.SERVER_TIMESTAMP
+            })
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit and miss counts"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses
+            }
+
+
+class ComplianceRollups:
+    """Running per-user compliance totals by year and month, updated once per distinct paystub.
+
+    ``{collection}/{user}`` holds all-time totals, ``.../periods/{YYYY}`` and
+    ``.../periods/{YYYY-MM}`` hold period totals and ``.../stubs/{content hash}``
+    records what each paystub contributed. Recording a paystub again replaces
+    its previous contribution inside a transaction, so reprocessing never
+    counts a stub twice and history reads a fixed number of documents.
+    """
+
+    TOTAL_FIELDS = (
+        'stubs', 'total_hours', 'gross_pay', 'net_pay', 'minimum_wage_violations',
+        'overtime_violations', 'long_shift_violations', 'additional_pay_owed'
+    )
+
+    def __init__(self, collection: str):
+        """Initialize the rollup store"""
+        self.collection = collection
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        """Key a user's rollups by a hash of their normalized email"""
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+    @staticmethod
+    def contribution(data: Dict[str, Any], checks: Dict[str, Any]) -> Dict[str, float]:
+        """Compute what one paystub adds to the totals"""
+        net_pay = float(data.get('net_pay', 0) or 0)
+        gross_pay = float(data.get('gross_pay', 0) or 0)
+        total_hours = float(data.get('total_hours', 0) or 0)
+        # Wage and overtime checks only ran when there were hours and pay
+        rated = net_pay > 0 and total_hours > 0
+        return {
+            'stubs': 1,
+            'total_hours': total_hours,
+            'gross_pay': gross_pay,
+            'net_pay': net_pay,
+            'minimum_wage_violations': int(rated and not checks.get('minimum_wage')),
+            'overtime_violations': int(rated and not checks.get('overtime_compliant')),
+            'long_shift_violations': int(bool(checks.get('long_shift_additional_pay_violation'))),
+            'additional_pay_owed': float(checks.get('additional_pay_owed', 0.0))
+        }
+
+    def _period_refs(self, user_ref, period: str) -> list:
+        """Documents a paystub dated ``period`` (ISO date) counts toward"""
+        periods = user_ref.collection('periods')
+        return [user_ref, periods.document(period[:4]), periods.document(period[:7])]
+
+    def record(
+        self,
+        email: str,
+        content_hash: str,
+        data: Dict[str, Any],
+        checks: Dict[str, Any],
+        pay_date: Optional[str] = None
+    ) -> bool:
+        """
+        Add a paystub to the user's totals, replacing any earlier contribution from the same stub.
+
+        :param email: User the paystub belongs to
+        :param content_hash: SHA-256 of the PDF, the idempotency key
+        :param data: Parsed paystub data
+        :param checks: Compliance results
+        :param pay_date: ISO pay date; defaults to the stub's earlier period, or today
+        :return: True if the totals changed
+        """
+        user_ref = db.collection(self.collection).document(self.user_key(email))
+        stub_ref = user_ref.collection('stubs').document(content_hash)
+        totals = self.contribution(data, checks)
+
+        @firestore.transactional
+        def apply(transaction) -> bool:
+            snapshot = stub_ref.get(transaction=transaction)
+            previous = snapshot.to_dict() if snapshot.exists else None
+            period = pay_date or (previous or {}).get('period') or date.today().isoformat()
+            if previous and previous['period'] == period and previous['totals'] == totals:
+                return False
+
+            # Net change per document: minus the old contribution, plus the new one
+            deltas = OrderedDict()
+            changes = [(period, totals, 1)]
+            if previous:
+                changes.append((previous['period'], previous['totals'], -1))
+            for change_period, values, sign in changes:
+                for ref in self._period_refs(user_ref, change_period):
+                    ref_deltas = deltas.setdefault(ref.path, (ref, {}))[1]
+                    for field in self.TOTAL_FIELDS:
+                        ref_deltas[field] = ref_deltas.get(field, 0) + sign * values.get(field, 0)
+
+            for ref, ref_deltas in deltas.values():
+                update = {
+                    field: firestore.Increment(delta) for field, delta in ref_deltas.items() if delta
+                }
+                update['updated_at'] = firestore.SERVER_TIMESTAMP
+                transaction.set(ref, update, merge=True)
+
+            transaction.set(stub_ref, {
+                'period': period,
+                'totals': totals,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+            return True
+
+        changed = apply(db.transaction())
+        if changed:
+            logger.info(f"Updated compliance rollup for stub {content_hash[:12]}")
+        return changed
+
+    def _totals(self, snapshot) -> Dict[str, Any]:
+        """Read the totals from a rollup document, zero if it does not exist"""
+        values = snapshot.to_dict() if snapshot is not None and snapshot.exists else {}
+        return {
+            field: int(values.get(field, 0)) if field == 'stubs' or field.endswith('_violations')
+            else round(float(values.get(field, 0)), 2)
+            for field in self.TOTAL_FIELDS
+        }
+
+    def history(self, email: str, year: int) -> Dict[str, Any]:
+        """
+        Return all-time, yearly and monthly totals for a user with one batched read of 14 documents.
+
+        :param email: User email
+        :param year: Year for the yearly and monthly totals
+        """
+        user_ref = db.collection(self.collection).document(self.user_key(email))
+        periods = user_ref.collection('periods')
+        months = [f"{year:04d}-{month:02d}" for month in range(1, 13)]
+        refs = [user_ref, periods.document(f"{year:04d}")] + [periods.document(month) for month in months]
+
+        snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(refs)}
+        return {
+            'all_time': self._totals(snapshots.get(user_ref.path)),
+            'year': {'period': f"{year:04d}", **self._totals(snapshots.get(refs[1].path))},
+            'months': [
+                {'period': month, **self._totals(snapshots.get(ref.path))}
+                for month, ref in zip(months, refs[2:])
+            ]
+        }
+
+
+# Upload handle: the content address of the stored object plus a per-upload ID
+UPLOAD_HANDLE_PATTERN = re.compile(re.escape(UPLOAD_PREFIX) + r'([0-9a-f]{64})/[0-9a-f]{32}((?:\.\w+)+)')
+
+
+def upload_extension(filename: str) -> str:
+    """Return the extension an upload is stored under: one of ALLOWED_EXTENSIONS, optionally .gz, else .pdf"""
+    name = (filename or '').lower()
+    suffix = ''
+    if name.endswith('.gz'):
+        name, suffix = name[:-len('.gz')], '.gz'
+    extension = name.rsplit('.', 1)[-1] if '.' in name else ''
+    if extension in ALLOWED_EXTENSIONS:
+        return f".{extension}{suffix}"
+    return '.pdf'
+
+
+def upload_object_name(file_url: str) -> str:
+    """Return the bucket object an upload handle refers to; any other file_url is an object name already"""
+    match = UPLOAD_HANDLE_PATTERN.fullmatch(file_url)
+    if match:
+        return f"{UPLOAD_PREFIX}{match.group(1)}{match.group(2)}"
+    return file_url
+
+
+def content_hash_from_url(file_url: str) -> Optional[str]:
+    """Return the SHA-256 encoded in an upload handle or content-addressed upload name, if there is one"""
+    match = UPLOAD_HANDLE_PATTERN.fullmatch(file_url)
+    if match:
+        return match.group(1)
+    if file_url.startswith(UPLOAD_PREFIX) and file_url.endswith('.pdf'):
+        digest = file_url[len(UPLOAD_PREFIX):-len('.pdf')]
+        if re.fullmatch(r'[0-9a-f]{64}', digest):
+            return digest
+    return None
+
+
+def compliance_cache_key(content_hash: str, user_input: Dict[str, Any]) -> str:
+    """Build the result cache key from the PDF contents and every input that affects the checks"""
+    params = {
+        'version': RESULT_CACHE_VERSION,
+        'content': content_hash,
+        'rules': wage_rules.resolve(user_input),
+        'user_input': user_input
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class QueueFullError(Exception):
+    """Raised when the background job queue cannot accept more work"""
+
+
+class JobExecutor:
+    """Bounded worker pool for background paystub processing jobs"""
+
+    def __init__(self, workers: int, queue_size: int):
+        """Initialize the executor; worker threads start on first submit"""
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._active = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        """Start the worker threads if they are not running yet"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"paystub-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} paystub worker threads (queue size {self.queue_size})")
+
+    def submit(self, fn, *args) -> None:
+        """
+        Queue a job for background execution.
+
+        :param fn: Callable to run on a worker thread
+        :param args: Positional arguments for the callable
+        :raises QueueFullError: If the queue is at capacity
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.queue_size} pending jobs)") from None
+
+        with self._lock:
+            self._submitted += 1
+
+    def _worker_loop(self):
+        """Pull jobs off the queue and run them until the process exits"""
+        while True:
+            fn, args, enqueued_at = self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            queue_wait_seconds.observe(wait, 'jobs')
+            with self._lock:
+                self._active += 1
+                self._started += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                logger.error(f"Background job failed: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, utilization and wait time statistics"""
+        # Age of the job at the head of the queue is the most direct scaling signal
+        with self._queue.mutex:
+            oldest = self._queue.queue[0][2] if self._queue.queue else None
+            depth = len(self._queue.queue)
+
+        with self._lock:
+            started = self._started
+            return {
+                'workers': self.workers,
+                'active': self._active,
+                'queue_depth': depth,
+                'queue_capacity': self.queue_size,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'completed': self._completed,
+                'failed': self._failed,
+                'wait_seconds_avg': round(self._wait_total / started, 4) if started > 0 else 0.0,
+                'wait_seconds_max': round(self._wait_max, 4),
+                'oldest_wait_seconds': round(time.monotonic() - oldest, 4) if oldest is not None else 0.0
+            }
+
+
+class RetryableJobError(Exception):
+    """Raised by a job handler when a failure should be retried by the job queue"""
+
+
+LeasedJob = namedtuple('LeasedJob', ['id', 'payload', 'attempts', 'lease_token'])
+
+
+class JobQueue:
+    """Interface for durable job queues shared by the web and worker tiers"""
+
+    max_attempts = JOB_MAX_ATTEMPTS
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        """Add a job and return its ID"""
+        raise NotImplementedError
+
+    def lease(self, visibility_timeout: int) -> Optional[LeasedJob]:
+        """Lease the next available job, hiding it from other workers until the timeout"""
+        raise NotImplementedError
+
+    def extend_lease(self, job: LeasedJob, visibility_timeout: int) -> bool:
+        """Keep a job hidden for another visibility_timeout seconds; False if the lease was lost"""
+        raise NotImplementedError
+
+    def ack(self, job: LeasedJob) -> bool:
+        """Mark a leased job as finished; False if the lease was lost"""
+        raise NotImplementedError
+
+    def fail(self, job: LeasedJob, error: str) -> bool:
+        """Return a leased job for retry with backoff, or dead-letter it after the last attempt; False if the lease was lost"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth statistics"""
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    """File-backed job queue for local development, tests and single-host deployments"""
+
+    def __init__(self, path: str, max_attempts: int = JOB_MAX_ATTEMPTS, retry_backoff: float = JOB_RETRY_BACKOFF):
+        """Initialize the queue and create its table if needed"""
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    leased_until REAL,
+                    lease_token TEXT,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open a connection in autocommit mode; transactions are managed explicitly"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        """Add a job and return its ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, payload, status, available_at, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, json.dumps(payload), 'pending', now, now)
+            )
+        logger.info(f"Enqueued job {job_id} ({payload.get('type')})")
+        return job_id
+
+    def lease(self, visibility_timeout: int) -> Optional[LeasedJob]:
+        """Lease the next available job, hiding it from other workers until the timeout"""
+        with self._connect() as conn:
+            try:
+                while True:
+                    now = time.time()
+                    conn.execute('BEGIN IMMEDIATE')
+                    # Jobs whose lease expired belonged to a worker that died mid-job
+                    row = conn.execute(
+                        """
+                        SELECT id, payload, attempts, status, available_at, leased_until FROM jobs
+                        WHERE (status = 'pending' AND available_at <= ?)
+                           OR (status = 'leased' AND leased_until <= ?)
+                        ORDER BY available_at LIMIT 1
+                        """,
+                        (now, now)
+                    ).fetchone()
+
+                    if row is None:
+                        conn.execute('COMMIT')
+                        return None
+
+                    job_id, payload, attempts, status, available_at, leased_until = row
+                    if attempts >= self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'dead', last_error = ? WHERE id = ?",
+                            ('Lease expired on final attempt', job_id)
+                        )
+                        conn.execute('COMMIT')
+                        logger.error(f"Job {job_id} dead-lettered after {attempts} attempts")
+                        continue
+
+                    token = uuid.uuid4().hex
+                    conn.execute(
+                        """
+                        UPDATE jobs SET status = 'leased', lease_token = ?, leased_until = ?, attempts = attempts + 1
+                        WHERE id = ?
+                        """,
+                        (token, now + visibility_timeout, job_id)
+                    )
+                    conn.execute('COMMIT')
+                    queue_wait_seconds.observe(
+                        now - (available_at if status == 'pending' else leased_until), 'durable'
+                    )
+                    return LeasedJob(job_id, json.loads(payload), attempts + 1, token)
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+
+    def extend_lease(self, job: LeasedJob, visibility_timeout: int) -> bool:
+        """Keep a job hidden for another visibility_timeout seconds; False if the lease was lost"""
+        with self._connect() as conn:
+            extended = conn.execute(
+                "UPDATE jobs SET leased_until = ? WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (time.time() + visibility_timeout, job.id, job.lease_token)
+            ).rowcount
+        if not extended:
+            logger.warning(f"Job {job.id} lost its lease; another worker may be running it")
+        return bool(extended)
+
+    def ack(self, job: LeasedJob) -> bool:
+        """Mark a leased job as finished; False if the lease was lost"""
+        with self._connect() as conn:
+            acked = conn.execute(
+                "DELETE FROM jobs WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (job.id, job.lease_token)
+            ).rowcount
+        if not acked:
+            logger.warning(f"Job {job.id} finished after losing its lease; it may run again")
+        return bool(acked)
+
+    def fail(self, job: LeasedJob, error: str) -> bool:
+        """Return a leased job for retry with backoff, or dead-letter it after the last attempt; False if the lease was lost"""
+        with self._connect() as conn:
+            if job.attempts >= self.max_attempts:
+                failed = conn.execute(
+                    "UPDATE jobs SET status = 'dead', last_error = ? WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                    (error, job.id, job.lease_token)
+                ).rowcount
+                if failed:
+                    logger.error(f"Job {job.id} dead-lettered after {job.attempts} attempts: {error}")
+            else:
+                delay = self.retry_backoff * (2 ** (job.attempts - 1))
+                failed = conn.execute(
+                    """
+                    UPDATE jobs SET status = 'pending', available_at = ?, lease_token = NULL,
+                        leased_until = NULL, last_error = ?
+                    WHERE id = ? AND lease_token = ? AND status = 'leased'
+                    """,
+                    (time.time() + delay, error, job.id, job.lease_token)
+                ).rowcount
+                if failed:
+                    logger.warning(f"Job {job.id} attempt {job.attempts} failed, retrying in {delay:.0f}s: {error}")
+
+        if not failed:
+            logger.warning(f"Job {job.id} failed after losing its lease: {error}")
+        return bool(failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth statistics"""
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = 'pending'"
+            ).fetchone()[0]
+
+        return {
+            'backend': 'sqlite',
+            'pending': counts.get('pending', 0),
+            'leased': counts.get('leased', 0),
+            'dead': counts.get('dead', 0),
+            'oldest_pending_seconds': round(time.time() - oldest, 4) if oldest else 0.0
+        }
+
+
+def create_job_queue() -> Optional[JobQueue]:
+    """Create the durable job queue configured by JOB_QUEUE_BACKEND, or None for in-process jobs"""
+    if JOB_QUEUE_BACKEND == 'sqlite':
+        return SQLiteJobQueue(JOB_QUEUE_PATH)
+    if JOB_QUEUE_BACKEND != 'memory':
+        logger.warning(f"Unknown job queue backend '{JOB_QUEUE_BACKEND}', using in-process jobs")
+    return None
+
+
+def available_cpus() -> int:
+    """Return the number of cores this process may use, honoring cgroup quotas"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+
+    # Cloud Run and other containers limit CPU through the cgroup quota
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            count = min(count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, count)
+
+
+class CPUStageRunner:
+    """Run CPU-bound pipeline stages inline or on a pool of worker processes"""
+
+    def __init__(self, mode: str, workers: int, start_method: str):
+        """Initialize the runner; the process pool is created on first use"""
+        if mode not in ('thread', 'process'):
+            logger.warning(f"Unknown CPU execution mode '{mode}', falling back to 'thread'")
+            mode = 'thread'
+        self.mode = mode
+        self.workers = workers if workers > 0 else available_cpus()
+        self.start_method = start_method
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Create the process pool if it does not exist yet"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+                logger.info(f"Started CPU process pool with {self.workers} workers ({self.start_method})")
+            return self._pool
+
+    def run(self, fn, *args):
+        """
+        Run a CPU-bound function and return its result.
+
+        In process mode the function and its arguments must be picklable, so
+        only module-level functions with small payloads should be passed here.
+
+        :param fn: Module-level function to run
+        :param args: Positional arguments for the function
+        :return: The function's return value
+        """
+        if self.mode != 'process':
+            return fn(*args)
+
+        pool = self._get_pool()
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def map(self, fn, *iterables) -> list:
+        """
+        Run a CPU-bound function over several inputs and return the results in order.
+
+        In process mode the calls run in parallel on the pool; in thread mode
+        they run one after another on the calling thread.
+
+        :param fn: Module-level function to run
+        :param iterables: Argument iterables, as for the builtin map()
+        :return: List of return values
+        """
+        if self.mode != 'process':
+            return list(map(fn, *iterables))
+
+        pool = self._get_pool()
+        try:
+            return list(pool.map(fn, *iterables))
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """Drop a broken pool so the next call starts a new one"""
+        # A worker died (e.g. OOM); replace the pool so later jobs can run
+        logger.error("CPU process pool is broken, recreating it")
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self):
+        """Stop the process pool if one was started"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def extract_and_parse_pdf(pdf_bytes: bytes) -> Dict[str, Any]:
+    """
+    CPU stage: extract text from PDF bytes and parse the paystub fields.
+
+    :param pdf_bytes: Raw PDF content
+    :return: Dict with the extracted text length, parsed data and page counts
+    """
+    return processor.extract_and_parse_pdf_bytes(pdf_bytes)
+
+
+def render_report(
+    employee_data: Dict[str, Any],
+    compliance_results: Dict[str, Any],
+    user_input: Dict[str, Any]
+) -> bytes:
+    """CPU stage: render the compliance report PDF to bytes"""
+    return report_renderer.render(employee_data, compliance_results, user_input)
+
+
+def render_reports(reports: List[tuple], combined: bool = False):
+    """CPU stage: render many compliance reports, see ReportRenderer.render_batch"""
+    return report_renderer.render_batch(reports, combined)
+
+
+def extract_page_range_text(pdf_path: str, first_page: int, max_pages: int) -> List[str]:
+    """
+    CPU stage: extract the text of a run of pages from a PDF on disk.
+
+    Takes a path rather than bytes so process workers never receive the whole register.
+
+    :param pdf_path: PDF in the job's spool directory
+    :param first_page: Index of the first page
+    :param max_pages: Number of pages to read
+    :return: Text of each page in order
+    """
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return list(processor.iter_page_text(reader, max_pages, first_page=first_page))
+
+
+def analyze_register_segment(text: str, user_input: Dict[str, Any]) -> Dict[str, Any]:
+    """CPU stage: parse one employee's part of a payroll register and run the compliance checks"""
+    data = processor._match_fields(text)
+    return {
+        'data': data,
+        'compliance_results': processor.perform_compliance_checks(data, user_input)
+    }
+
+
+def adaptive_ocr_dpi(width_points: float, height_points: float) -> int:
+    """Pick the DPI that renders the page's long side at OCR_TARGET_PIXELS, within the DPI limits"""
+    long_side_inches = max(width_points, height_points) / 72.0
+    if long_side_inches <= 0:
+        return OCR_MAX_DPI
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, OCR_TARGET_PIXELS / long_side_inches)))
+
+
+def estimate_skew_angle(binary: 'np.ndarray') -> float:
+    """
+    Estimate the skew of a binarized page from the rotated bounding box of its ink.
+
+    :param binary: Page with black (0) text on a white (255) background
+    :return: Angle in degrees to rotate by (counter-clockwise) to straighten the text
+    """
+    ink = cv2.findNonZero(255 - binary)
+    if ink is None or len(ink) < 2:
+        return 0.0
+    angle = cv2.minAreaRect(ink)[-1]
+    # OpenCV versions disagree on the angle range; fold it into (-45, 45]
+    return -(((angle + 45.0) % 90.0) - 45.0)
+
+
+def preprocess_page_image(image: 'np.ndarray') -> 'np.ndarray':
+    """Convert a rendered page to grayscale, binarize it with Otsu's threshold and deskew it"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    angle = estimate_skew_angle(binary)
+    if 0.5 <= abs(angle) < 45.0:
+        height, width = binary.shape
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), -angle, 1.0)
+        binary = cv2.warpAffine(
+            binary, matrix, (width, height),
+            flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=255
+        )
+    return binary
+
+
+def ocr_page_image(image: 'np.ndarray', lang: str) -> str:
+    """
+    CPU stage: clean up one rendered page and OCR it.
+
+    :param image: Rendered page as a NumPy array
+    :param lang: Tesseract language
+    :return: Recognized text
+    """
+    return pytesseract.image_to_string(preprocess_page_image(image), lang=lang)
+
+
+class OCRExtractor:
+    """Fallback text extraction for scanned PDFs: rasterize, clean up and OCR each page"""
+
+    def __init__(self, runner: CPUStageRunner, cache: 'ResultCache', lang: str, max_pages: int):
+        """Initialize the extractor"""
+        self.runner = runner
+        self.cache = cache
+        self.lang = lang
+        self.max_pages = max_pages
+        self._available = None
+
+    def available(self) -> bool:
+        """Check once that the OCR libraries and the tesseract binary are installed"""
+        if self._available is None:
+            self._available = OCR_IMPORTS_AVAILABLE
+            if self._available:
+                try:
+                    pytesseract.get_tesseract_version()
+                except Exception as e:
+                    logger.warning(f"OCR disabled, tesseract is not usable: {e}")
+                    self._available = False
+            else:
+                logger.warning("OCR disabled, OCR libraries are not installed")
+        return self._available
+
+    def render_pages(self, pdf_bytes: bytes, first_page: int, dpis: List[int]) -> List['np.ndarray']:
+        """
+        Rasterize consecutive pages to grayscale arrays.
+
+        Each run of pages with the same DPI is rendered by one page range
+        request, split over up to one pdftoppm process per OCR worker,
+        instead of writing out the PDF and starting pdftoppm for every page.
+
+        :param pdf_bytes: Raw PDF content
+        :param first_page: Number (1-based) of the first page
+        :param dpis: Rendering DPI of each page, in page order
+        :return: One array per page
+        """
+        images = []
+        start = 0
+        while start < len(dpis):
+            end = start
+            while end + 1 < len(dpis) and dpis[end + 1] == dpis[start]:
+                end += 1
+            rendered = convert_from_bytes(
+                pdf_bytes,
+                dpi=dpis[start],
+                first_page=first_page + start,
+                last_page=first_page + end,
+                grayscale=True,
+                thread_count=min(self.runner.workers, end - start + 1)
+            )
+            images.extend(np.asarray(image) for image in rendered)
+            start = end + 1
+        return images
+
+    def page_cache_key(self, image: 'np.ndarray') -> str:
+        """Key OCR output by the rendered page pixels and everything else that changes the text"""
+        digest = hashlib.sha256()
+        digest.update(f"{OCR_PREPROCESS_VERSION}:{self.lang}:{image.shape}:".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def extract_and_parse(self, pdf_bytes: bytes) -> Dict[str, Any]:
+        """
+        OCR the PDF a batch of pages at a time until every required field is found.
+
+        Each batch holds one page per OCR worker. Pages whose rendered image
+        was OCR'd before are served from the cache.
+
+        :param pdf_bytes: Raw PDF content
+        :return: Dict shaped like PaystubProcessor.extract_and_parse_pdf_bytes,
+            plus the number of pages OCR'd and cache hits
+        """
+        result = {
+            'text_length': 0, 'data': {}, 'pages_read': 0, 'page_count': 0,
+            'ocr_pages': 0, 'ocr_cache_hits': 0
+        }
+        if not self.available():
+            return result
+
+        try:
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            page_sizes = [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages]
+            result['page_count'] = len(page_sizes)
+            if self.max_pages:
+                page_sizes = page_sizes[:self.max_pages]
+
+            parts = []
+            data = {}
+            batch_size = self.runner.workers
+            for batch_start in range(0, len(page_sizes), batch_size):
+                batch = page_sizes[batch_start:batch_start + batch_size]
+                texts = [None] * len(batch)
+                keys = [None] * len(batch)
+                pending = []
+
+                images = self.render_pages(
+                    pdf_bytes, batch_start + 1, [adaptive_ocr_dpi(width, height) for width, height in batch]
+                )
+                for offset, image in enumerate(images):
+                    keys[offset] = self.page_cache_key(image)
+                    cached = self.cache.get(keys[offset])
+                    if cached is not None:
+                        texts[offset] = cached['text']
+                        result['ocr_cache_hits'] += 1
+                    else:
+                        pending.append((offset, image))
+
+                if pending:
+                    ocr_texts = self.runner.map(
+                        ocr_page_image, [image for _, image in pending], [self.lang] * len(pending)
+                    )
+                    for (offset, _), text in zip(pending, ocr_texts):
+                        texts[offset] = text
+                        self.cache.set(keys[offset], {'text': text})
+                    result['ocr_pages'] += len(pending)
+
+                parts.extend(texts)
+                result['pages_read'] += len(batch)
+                if any(texts):
+                    data = processor._match_fields("".join(parts))
+                    if all(data.get(field) is not None for field in processor.REQUIRED_FIELDS):
+                        break
+
+            result['text_length'] = sum(len(part) for part in parts)
+            if not result['text_length']:
+                logger.warning("OCR found no text in PDF")
+                return result
+
+            for key, value in data.items():
+                if value is None:
+                    logger.warning(f"Could not extract {key}")
+            result['data'] = data
+
+            logger.info(
+                f"OCR read {result['pages_read']} of {result['page_count']} pages "
+                f"({result['ocr_cache_hits']} from cache)"
+            )
+            return result
+
+        except Exception as e:
+            logger.error(f"OCR failed: {e}")
+            logger.error(traceback.format_exc())
+            return result
+
+
+class StackSampler:
+    """Sample the Python stacks of every thread and count them as collapsed stacks.
+
+    The result is the "frame;frame;frame count" format that flamegraph.pl,
+    speedscope and inferno read. Only one session runs at a time. After each
+    sample the sampler sleeps for the interval, or longer when walking the
+    stacks took more than max_overhead of the elapsed time, so the time it
+    holds the GIL stays bounded however many threads there are.
+    """
+
+    # Leaf frames of threads that are blocked waiting for work
+    IDLE_FRAMES = {('threading.py', 'wait'), ('selectors.py', 'select'), ('socket.py', 'accept')}
+
+    def __init__(self, max_seconds: float, max_overhead: float, max_depth: int = 128):
+        """Initialize the sampler"""
+        self.max_seconds = max_seconds
+        self.max_overhead = min(max(max_overhead, 0.001), 1.0)
+        self.max_depth = max_depth
+        self._session = threading.Lock()
+
+    @staticmethod
+    def frame_label(code) -> str:
+        """Name a stack frame by function, file and first line"""
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+    def sample(self, seconds: float, interval: float, thread_prefix: str = '', include_idle: bool = False) -> Dict[str, Any]:
+        """
+        Sample thread stacks on the calling thread for a while.
+
+        :param seconds: How long to sample, capped at max_seconds
+        :param interval: Seconds between samples
+        :param thread_prefix: Only sample threads whose name starts with this
+        :param include_idle: Also count threads blocked waiting for work
+        :return: Dict with stacks (collapsed stack -> samples), samples, seconds and overhead
+        :raises QueueFullError: If another session is running
+        """
+        if not self._session.acquire(blocking=False):
+            raise QueueFullError("A profiling session is already running")
+        try:
+            seconds = min(max(seconds, 0.0), self.max_seconds)
+            interval = max(interval, 0.001)
+            own = threading.get_ident()
+            stacks = {}
+            samples = 0
+            sampling = 0.0
+            start = time.perf_counter()
+            deadline = start + seconds
+            while True:
+                sample_start = time.perf_counter()
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    name = names.get(ident, f"thread-{ident}")
+                    if ident == own or not name.startswith(thread_prefix):
+                        continue
+                    code = frame.f_code
+                    if not include_idle and (os.path.basename(code.co_filename), code.co_name) in self.IDLE_FRAMES:
+                        continue
+                    labels = []
+                    while frame is not None and len(labels) < self.max_depth:
+                        labels.append(self.frame_label(frame.f_code))
+                        frame = frame.f_back
+                    # Numbered pool threads share one root in the flamegraph
+                    labels.append(re.sub(r'[-_]?\d+$', '', name) or name)
+                    stack = ';'.join(reversed(labels))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                samples += 1
+                now = time.perf_counter()
+                sampling += now - sample_start
+                if now >= deadline:
+                    break
+                # Stay under max_overhead even when walking the stacks is slow
+                pause = max(interval, sampling / self.max_overhead - (now - start))
+                time.sleep(min(pause, deadline - now))
+
+            elapsed = time.perf_counter() - start
+            return {
+                'stacks': stacks,
+                'samples': samples,
+                'seconds': round(elapsed, 3),
+                'overhead': round(sampling / elapsed, 4) if elapsed else 0.0
+            }
+        finally:
+            self._session.release()
+
+
+def resident_memory_bytes() -> int:
+    """Resident set size of this process in bytes (0 where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def allocation_sites(statistics, limit: int) -> List[Dict[str, Any]]:
+    """Describe tracemalloc statistics or differences, largest first, for JSON"""
+    sites = []
+    for stat in statistics[:limit]:
+        site = {
+            'site': f"{stat.traceback[-1].filename}:{stat.traceback[-1].lineno}",
+            'size_bytes': stat.size,
+            'count': stat.count
+        }
+        if isinstance(stat, tracemalloc.StatisticDiff):
+            site['size_diff_bytes'] = stat.size_diff
+            site['count_diff'] = stat.count_diff
+        if len(stat.traceback) > 1:
+            # Outermost call first, ending at the allocation
+            site['traceback'] = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+        sites.append(site)
+    return sites
+
+
+class AllocationTracer:
+    """tracemalloc-based memory accounting for traced jobs and admin snapshots.
+
+    tracemalloc only runs while a traced job or an admin snapshot needs it,
+    since it slows down every allocation in the process. Its peak counter is
+    process-wide, so traced stages run one at a time; allocations made by
+    untraced jobs running alongside are still counted, so per-stage numbers
+    are most precise on a quiet instance or with a low sample rate.
+    """
+
+    def __init__(self, frames: int, sample_rate: float, history: int, top_sites: int):
+        """Initialize the tracer"""
+        self.frames = max(1, frames)
+        self.sample_rate = sample_rate
+        self.top_sites = top_sites
+        self.recent = deque(maxlen=max(1, history))
+        self._lock = threading.Lock()
+        self._stage_lock = threading.Lock()
+        self._users = 0
+        self._started = False
+
+    def should_trace(self, requested: bool = False) -> bool:
+        """Whether a new job should be traced: on request or by sampling"""
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def acquire(self):
+        """Start tracing unless another user already has"""
+        with self._lock:
+            if self._users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._started = True
+            self._users += 1
+
+    def release(self):
+        """Stop tracing once the last user is done, if this tracer started it"""
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if self._users == 0 and self._started:
+                tracemalloc.stop()
+                self._started = False
+
+    def mark_job(self, job: Dict[str, Any]):
+        """Mark a job for tracing; tracing starts with its first stage and cleanup_job calls finish_job"""
+        job['memory'] = {'stages': {}}
+
+    @contextlib.contextmanager
+    def stage(self, job: Dict[str, Any], name: str):
+        """Record the peak and retained allocations of one stage of a traced job"""
+        memory = job['memory']
+        if 'snapshot' not in memory:
+            # A job turned away before its first stage never starts tracing
+            self.acquire()
+            memory['start_bytes'] = tracemalloc.get_traced_memory()[0]
+            memory['snapshot'] = tracemalloc.take_snapshot()
+        with self._stage_lock:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                memory['stages'][name] = {
+                    'peak_bytes': peak - before,
+                    'retained_bytes': current - before
+                }
+                stage_memory_peak_bytes.observe(peak - before, name)
+
+    def finish_job(self, job: Dict[str, Any]):
+        """Record what a traced job retained and where, then stop tracing it"""
+        memory = job.pop('memory')
+        if 'snapshot' not in memory:
+            return
+        try:
+            current = tracemalloc.get_traced_memory()[0]
+            retained = current - memory['start_bytes']
+            growth = tracemalloc.take_snapshot().compare_to(memory['snapshot'], 'lineno')
+            report = {
+                'file_url': job['file_url'],
+                'finished_at': time.time(),
+                'retained_bytes': retained,
+                'stages': memory['stages'],
+                'top_retained': allocation_sites([stat for stat in growth if stat.size_diff > 0], 10)
+            }
+            self.recent.append(report)
+            job_memory_retained_bytes.observe(max(retained, 0))
+            logger.info(
+                f"Memory for {job['file_url']}: retained {retained} bytes; stage peaks " + ", ".join(
+                    f"{name}={stage['peak_bytes']}" for name, stage in memory['stages'].items()
+                )
+            )
+        except Exception as e:
+            logger.error(f"Failed to record memory for {job['file_url']}: {e}")
+        finally:
+            self.release()
+
+    def snapshot(self, seconds: float, group: str = 'lineno') -> Dict[str, Any]:
+        """
+        Trace allocations for a while and report the largest allocation sites.
+
+        :param seconds: How long to trace; growth compares the start and the end
+        :param group: 'lineno', 'filename' or 'traceback'
+        :return: Dict with traced bytes, top sites and the sites that grew the most
+        """
+        self.acquire()
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                'seconds': seconds,
+                'traced_bytes': current,
+                'traced_peak_bytes': peak,
+                'top_sites': allocation_sites(after.statistics(group), self.top_sites),
+                'growth': allocation_sites(after.compare_to(before, group), self.top_sites)
+            }
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return tracing state and the most recent traced jobs"""
+        with self._lock:
+            return {
+                'tracing': tracemalloc.is_tracing(),
+                'users': self._users,
+                'sample_rate': self.sample_rate,
+                'recent_jobs': list(self.recent)
+            }
+
+
+class TempDirMonitor:
+    """Sample the size of the temp and spool directories over time.
+
+    /tmp on Cloud Run is an in-memory filesystem, so files left behind by
+    download_file or save_report count against the instance's memory.
+    """
+
+    def __init__(self, directories: List[str], interval: float, history: int, stale_age: float, max_files: int = 100000):
+        """Initialize the monitor; the sampling thread starts on first use"""
+        self.directories = list(dict.fromkeys(directories))
+        self.interval = interval
+        self.stale_age = stale_age
+        self.max_files = max_files
+        self.history = deque(maxlen=max(1, history))
+        self._lock = threading.Lock()
+        self._started = False
+
+    def ensure_started(self):
+        """Start the sampling thread if it is enabled and not running yet"""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._started:
+                return
+            threading.Thread(target=self._loop, name="tmp-monitor", daemon=True).start()
+            self._started = True
+
+    def measure_directory(self, directory: str) -> Dict[str, Any]:
+        """Total size, file count and stale file count under a directory"""
+        usage = {'bytes': 0, 'files': 0, 'stale_files': 0, 'truncated': False}
+        stale_before = time.time() - self.stale_age
+        pending = [directory]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                usage['bytes'] += stat.st_size
+                usage['files'] += 1
+                if stat.st_mtime < stale_before:
+                    usage['stale_files'] += 1
+                if usage['files'] >= self.max_files:
+                    usage['truncated'] = True
+                    return usage
+        return usage
+
+    def measure(self) -> Dict[str, Any]:
+        """Measure every directory and the process RSS now"""
+        return {
+            'time': time.time(),
+            'rss_bytes': resident_memory_bytes(),
+            'directories': {directory: self.measure_directory(directory) for directory in self.directories}
+        }
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """The most recent sample, or None before the first one"""
+        with self._lock:
+            return self.history[-1] if self.history else None
+
+    def _loop(self):
+        """Take a sample every interval seconds"""
+        while True:
+            try:
+                sample = self.measure()
+                with self._lock:
+                    self.history.append(sample)
+            except Exception as e:
+                logger.error(f"Temp directory sampling failed: {e}")
+            time.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the sampled history, oldest first"""
+        with self._lock:
+            return {'interval': self.interval, 'samples': list(self.history)}
+
+
+# Wage rules by jurisdiction and date; the env constants are the default rule
+wage_rules = WageRuleTable(
+    WAGE_RULES_PATH,
+    WAGE_RULES_RELOAD_INTERVAL,
+    WageRule('', date.min, WAGE_RULE_NAME, MINIMUM_WAGE, OVERTIME_RATE, LONG_SHIFT_THRESHOLD, LONG_SHIFT_BONUS)
+)
+
+# Static report layout, prepared once per process
+report_renderer = ReportRenderer()
+
+# Create a global instance of the processor
+processor = PaystubProcessor()
+
+# Runs text extraction, parsing and report rendering
+cpu_runner = CPUStageRunner(CPU_EXECUTION_MODE, CPU_POOL_WORKERS, CPU_POOL_START_METHOD)
+
+# Parsed data and compliance results keyed by content hash and rule parameters
+result_cache = ResultCache(RESULT_CACHE_COLLECTION, RESULT_CACHE_SIZE)
+
+# Report PDFs by result key, rendered when first requested from /report
+report_cache = ResultCache(REPORT_CACHE_COLLECTION, REPORT_CACHE_SIZE)
+
+# Processing status updates, buffered per file and written in batches
+status_writer = StatusWriter('processing_status', STATUS_FLUSH_INTERVAL, STATUS_BATCH_SIZE)
+
+# Pooled SMTP connections for all email, and the outbox that sends job emails in the background
+smtp_pool = SMTPConnectionPool(mail.state, SMTP_POOL_SIZE, SMTP_MAX_IDLE, SMTP_MAX_MESSAGES_PER_CONNECTION)
+mail_outbox = MailOutbox(smtp_pool, MAIL_OUTBOX_WORKERS, MAIL_OUTBOX_BATCH_SIZE, MAIL_OUTBOX_SIZE)
+
+# Give queued emails a chance to go out when the process exits, then write the
+# statuses still buffered (atexit runs handlers in reverse order)
+atexit.register(status_writer.flush)
+atexit.register(mail_outbox.flush, MAIL_OUTBOX_DRAIN_TIMEOUT)
+
+# OCR fallback for scanned PDFs; page text is cached by rendered image hash
+ocr_extractor = OCRExtractor(
+    CPUStageRunner(OCR_EXECUTION_MODE, OCR_WORKERS, CPU_POOL_START_METHOD),
+    ResultCache(OCR_CACHE_COLLECTION, OCR_CACHE_SIZE),
+    OCR_LANG,
+    OCR_MAX_PAGES
+)
+
+# Per-user running compliance totals
+compliance_rollups = ComplianceRollups(ROLLUP_COLLECTION)
+
+# Durable queue consumed by worker.py (None when jobs run in-process)
+job_queue = create_job_queue()
+
+# Recently read statuses for /check-status-batch
+status_cache = StatusCache(STATUS_CACHE_TTL, STATUS_CACHE_SIZE)
+
+# Pushes status changes to waiting clients; jobs handled by worker.py are followed with Firestore listeners
+status_broker = StatusBroker(
+    STATUS_STREAM_MAX_CLIENTS,
+    STATUS_BROKER_CACHE_SIZE,
+    STATUS_LISTENER_ENABLED,
+    local_jobs=job_queue is None
+)
+
+# Bounded pool that runs background processing jobs
+job_executor = JobExecutor(JOB_WORKERS, JOB_QUEUE_SIZE)
+
+# Stack sampler behind /admin/profile
+stack_sampler = StackSampler(PROFILE_MAX_SECONDS, PROFILE_MAX_OVERHEAD)
+
+# Memory accounting behind /admin/memory
+allocation_tracer = AllocationTracer(
+    MEMORY_TRACE_FRAMES, MEMORY_TRACE_SAMPLE_RATE, MEMORY_TRACE_HISTORY, MEMORY_TOP_SITES
+)
+tmp_monitor = TempDirMonitor(
+    [tempfile.gettempdir(), SPOOL_DIR, processor.temp_dir], TMP_USAGE_INTERVAL, TMP_USAGE_HISTORY, TMP_STALE_AGE
+)
+
+
+def check_admin_request():
+    """Return an error response unless profiling is enabled and the request carries ADMIN_TOKEN, else None"""
+    if not PROFILING_ENABLED or not ADMIN_TOKEN:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({'error': 'Admin token required'}), 401
+    return None
+
+
+def require_admin(view):
+    """Decorate a route so only admin requests reach it"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_error = check_admin_request()
+        if admin_error:
+            return admin_error
+        return view(*args, **kwargs)
+    return wrapper
+
+# Define routes
+@app.route('/', defaults={'path': ''})
+@app.route('/<path:path>')
+def serve(path):
+    """Serve the static React app files"""
+    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
+        return send_from_directory(app.static_folder, path)
+    else:
+        return send_from_directory(app.static_folder, 'index.html')
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint."""
+    return jsonify({'status': 'healthy'})
+
+@app.route('/api', methods=['GET'])
+def api_info():
+    return jsonify({
+        'message': 'API is running',
+        'version': '1.0.0'
+    })
+
+@app.route('/upload-paystub', methods=['POST'])
+def upload_paystub():
+    """Handle paystub file upload.
+    Uploads the file to Google Cloud Storage and forwards the URL to the backend.
+    """
+    # Log all incoming request details for debugging
+    logger.info(f"Request headers: {request.headers}")
+    logger.info(f"Request content type: {request.content_type}")
+
+    if 'file' not in request.files:
+        logger.error("No file part in the request")
+        return jsonify({"error": "No file part"}), 400
+    
+    file = request.files['file']
+    
+    if file.filename == '':
+        logger.error("No selected file")
+        return jsonify({"error": "No selected file"}), 400
+    
+    if file:
+        # Log file details
+        logger.info(f"Received file: {file.filename}")
+
+        start = time.perf_counter()
+        try:
+            # Upload to Google Cloud Storage
+            storage_service = StorageService(BUCKET_ID)
+            file_url, signed_url = storage_service.upload_file(file)
+            
+            # Store this upload's handle in Firestore with initial status
+            processor.update_processing_status(
+                file_url=file_url,
+                email=request.form.get('email', ''),
+                status='uploaded',
+                message='File uploaded, pending processing',
+                write_through=True
+            )
+            upload_seconds.observe(time.perf_counter() - start, 'request')
+            
+            return jsonify({
+                "file_url": file_url,
+                "signed_url": signed_url,
+                "status": "uploaded",
+                "message": "File uploaded successfully"
+            })
+            
+        except Exception as e:
+            upload_failures.inc()
+            logger.error(f"Error in upload: {e}")
+            logger.error(traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+@app.route('/process-paystub', methods=['POST'])
+def process_paystub():
+    """Process a paystub PDF and generate a compliance report."""
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
+    
+    data = request.get_json()
+    
+    file_url = data.get('file_url')
+    email = data.get('email')
+    
+    # 'register' treats the PDF as a payroll register with many employees
+    mode = data.get('mode', 'paystub')
+    if mode not in ('paystub', 'register'):
+        return jsonify({'error': "mode must be 'paystub' or 'register'"}), 400
+    register = mode == 'register'
+    
+    # Sync mode answers with the compliance result itself when it is ready within the budget
+    sync = bool(data.get('sync', False))
+    if sync and register:
+        return jsonify({'error': 'sync is only available in paystub mode'}), 400
+    try:
+        budget = float(data.get('latency_budget', SYNC_LATENCY_BUDGET))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'latency_budget must be a number of seconds'}), 400
+    if budget <= 0:
+        return jsonify({'error': 'latency_budget must be positive'}), 400
+    budget = min(budget, SYNC_MAX_LATENCY_BUDGET)
+    
+    # Profiling a job and tracing its memory are admin tools; see PROFILING_ENABLED
+    profile = bool(data.get('profile', False))
+    trace_memory = bool(data.get('trace_memory', False))
+    if profile or trace_memory:
+        if register:
+            return jsonify({'error': 'profile and trace_memory are only available in paystub mode'}), 400
+        admin_error = check_admin_request()
+        if admin_error:
+            return admin_error
+    
+    # Get shift information if available
+    user_input = {
+        'shifts_exceeded_10_hours': data.get('shifts_exceeded_10_hours', False),
+        'exceeded_shifts_count': int(data.get('exceeded_shifts_count', 0))
+    }
+    
+    # State, city and pay date select the wage rule
+    jurisdiction, jurisdiction_error = parse_jurisdiction(data)
+    if jurisdiction_error:
+        return jsonify({'error': jurisdiction_error}), 400
+    user_input.update(jurisdiction)
+    
+    if not file_url:
+        return jsonify({'error': 'file_url is required'}), 400
+    
+    if not email:
+        return jsonify({'error': 'email is required'}), 400
+    
+    # Validate email
+    email_validation_error = processor.validate_email(email)
+    if email_validation_error:
+        return jsonify({'error': f'Invalid email: {email_validation_error}'}), 400
+    
+    # Update status to processing
+    processor.update_processing_status(
+        file_url=file_url,
+        email=email,
+        status='processing',
+        message='Starting payroll register processing' if register else 'Starting paystub processing',
+        # A worker process picks durable jobs up and writes the next status
+        write_through=job_queue is not None
+    )
+    
+    try:
+        if sync:
+            response = process_paystub_sync(file_url, email, user_input, budget, profile, trace_memory)
+            if response is not None:
+                return response
+        
+        # Queue the file for asynchronous processing
+        if job_queue is not None:
+            payload = {
+                'type': 'process_register' if register else 'process_paystub',
+                'file_url': file_url,
+                'email': email,
+                'user_input': user_input
+            }
+            if profile:
+                payload['profile'] = True
+            if trace_memory:
+                payload['trace_memory'] = True
+            job_queue.enqueue(payload)
+        elif register:
+            job_executor.submit(process_register_async, file_url, email, user_input)
+        elif stage_pipeline is not None:
+            stage_pipeline.submit(
+                create_job(file_url, email, user_input, profile=profile, trace_memory=trace_memory)
+            )
+        else:
+            job_executor.submit(
+                run_stages, create_job(file_url, email, user_input, profile=profile, trace_memory=trace_memory)
+            )
+        
+        return jsonify({
+            'status': 'processing',
+            'message': 'Payroll register processing started' if register else 'Paystub processing started',
+            'file_url': file_url,
+            'mode': mode
+        })
+    
+    except QueueFullError as e:
+        logger.warning(f"Rejecting {file_url}: {e}")
+        
+        # Leave the upload ready to be resubmitted
+        status_broker.job_rejected(processor.generate_document_id(file_url))
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='uploaded',
+            message='Server busy, please retry shortly',
+            write_through=True
+        )
+        
+        response = jsonify({
+            'error': 'Server busy',
+            'details': str(e),
+            'retry_after': JOB_RETRY_AFTER
+        })
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response, 503
+    
+    except Exception as e:
+        logger.error(f"Error starting processing: {e}")
+        logger.error(traceback.format_exc())
+        
+        # Update status to failed
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='failed',
+            message=f'Error starting processing: {str(e)}'
+        )
+        
+        return jsonify({
+            'error': 'Failed to start processing',
+            'details': str(e)
+        }), 500
+
+
+def process_paystub_sync(
+    file_url: str,
+    email: str,
+    user_input: Dict[str, Any],
+    budget: float,
+    profile: bool = False,
+    trace_memory: bool = False
+):
+    """
+    Check a paystub while the request waits, falling back to the background path past the budget.
+
+    No report is rendered or emailed for a sync result; /report renders it on request.
+
+    :return: Flask response, or None if the sync workers are busy and the caller should queue the job
+    """
+    job = create_job(file_url, email, user_input, profile=profile, trace_memory=trace_memory)
+    try:
+        checked = sync_processor.run(job, budget)
+    except QueueFullError as e:
+        logger.info(f"{e}; processing {file_url} in the background")
+        return None
+    except Exception as e:
+        handle_job_error(job, e)
+        return jsonify({
+            'error': 'Failed to process paystub',
+            'details': str(e)
+        }), 500
+
+    if checked is None:
+        logger.info(f"{file_url} did not finish within {budget}s, continuing in the background")
+        return jsonify({
+            'status': 'processing',
+            'sync': False,
+            'message': 'Paystub processing continues in the background; the report will be emailed',
+            'file_url': file_url,
+            'mode': 'paystub'
+        })
+
+    if not checked:
+        return jsonify({
+            'status': 'failed',
+            'sync': True,
+            'error': job.get('error'),
+            'file_url': file_url
+        }), 422
+
+    processor.update_processing_status(
+        file_url=file_url,
+        email=email,
+        status='completed',
+        message='Compliance check completed; report available on request',
+        result=job_result(job)
+    )
+    return jsonify({
+        'status': 'completed',
+        'sync': True,
+        'file_url': file_url,
+        'mode': 'paystub',
+        'cached': bool(job.get('cached')),
+        'data': job['data'],
+        'compliance_results': job['compliance_results'],
+        'report_url': url_for('compliance_report', file_url=file_url, email=email)
+    })
+
+
+@app.route('/process-timesheet', methods=['POST'])
+def process_timesheet():
+    """Check spread of hours and weekly overtime from a punch export in Cloud Storage."""
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
+
+    data = request.get_json()
+    file_url = data.get('file_url')
+    email = data.get('email')
+
+    if not file_url:
+        return jsonify({'error': 'file_url is required'}), 400
+    if timesheet_format(file_url) is None:
+        return jsonify({'error': 'file_url must be a .csv or .jsonl file (optionally .gz)'}), 400
+    if not email:
+        return jsonify({'error': 'email is required'}), 400
+
+    email_validation_error = processor.validate_email(email)
+    if email_validation_error:
+        return jsonify({'error': f'Invalid email: {email_validation_error}'}), 400
+
+    # State and city select the spread of hours rule; each workweek uses its own date
+    user_input, jurisdiction_error = parse_jurisdiction(data)
+    if jurisdiction_error:
+        return jsonify({'error': jurisdiction_error}), 400
+    user_input.pop('pay_date', None)
+
+    processor.update_processing_status(
+        file_url=file_url,
+        email=email,
+        status='processing',
+        message='Starting timesheet processing',
+        write_through=job_queue is not None
+    )
+
+    try:
+        if job_queue is not None:
+            job_queue.enqueue({
+                'type': 'process_timesheet',
+                'file_url': file_url,
+                'email': email,
+                'user_input': user_input
+            })
+        else:
+            job_executor.submit(process_timesheet_async, file_url, email, user_input)
+
+        return jsonify({
+            'status': 'processing',
+            'message': 'Timesheet processing started',
+            'file_url': file_url
+        })
+
+    except QueueFullError as e:
+        logger.warning(f"Rejecting {file_url}: {e}")
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='uploaded',
+            message='Server busy, please retry shortly',
+            write_through=True
+        )
+        response = jsonify({
+            'error': 'Server busy',
+            'details': str(e),
+            'retry_after': JOB_RETRY_AFTER
+        })
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response, 503
+
+    except Exception as e:
+        logger.error(f"Error starting timesheet processing: {e}")
+        logger.error(traceback.format_exc())
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='failed',
+            message=f'Error starting processing: {str(e)}'
+        )
+        return jsonify({
+            'error': 'Failed to start processing',
+            'details': str(e)
+        }), 500
+
+
+def parse_jurisdiction(data: Dict[str, Any]):
+    """
+    Read the optional state, city and pay_date request fields.
+
+    :return: (dict with the fields that were given, error message or None)
+    """
+    jurisdiction = {}
+    for field in ('state', 'city'):
+        value = data.get(field)
+        if value is not None:
+            if not isinstance(value, str):
+                return {}, f'{field} must be a string'
+            jurisdiction[field] = value.strip().upper()
+
+    if jurisdiction.get('city') and not jurisdiction.get('state'):
+        return {}, 'city requires state'
+
+    pay_date = data.get('pay_date')
+    if pay_date is not None:
+        try:
+            jurisdiction['pay_date'] = date.fromisoformat(str(pay_date)).isoformat()
+        except ValueError:
+            return {}, 'pay_date must be an ISO date (YYYY-MM-DD)'
+
+    return jurisdiction, None
+
+
+def create_job(
+    file_url: str,
+    email: str,
+    user_input: Dict[str, Any] = None,
+    final_attempt: bool = True,
+    profile: bool = False,
+    trace_memory: bool = False
+) -> Dict[str, Any]:
+    """
+    Create the context dict that carries a job through the processing stages.
+
+    :param profile: Run the job's stages under cProfile and store the profile
+        in PROFILE_COLLECTION when the job is cleaned up
+    :param trace_memory: Record the job's allocations per stage with tracemalloc;
+        MEMORY_TRACE_SAMPLE_RATE also traces a share of all jobs
+    """
+    job = {
+        'file_url': file_url,
+        'email': email,
+        'user_input': user_input or {},
+        'final_attempt': final_attempt
+    }
+    status_broker.job_started(processor.generate_document_id(file_url))
+    if profile and PROFILING_ENABLED:
+        job['profiler'] = cProfile.Profile()
+    tmp_monitor.ensure_started()
+    if allocation_tracer.should_trace(trace_memory and PROFILING_ENABLED):
+        allocation_tracer.mark_job(job)
+    return job
+
+
+def fail_job(job: Dict[str, Any], message: str) -> bool:
+    """Mark a job as failed; returns False so stages can ``return fail_job(...)``"""
+    job['error'] = message
+    processor.update_processing_status(
+        file_url=job['file_url'],
+        email=job['email'],
+        status='failed',
+        message=message
+    )
+    return False
+
+
+def spool_directory(job: Dict[str, Any]) -> str:
+    """Return the job's private spool directory, creating it on first use"""
+    if 'spool_dir' not in job:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        job['spool_dir'] = tempfile.mkdtemp(prefix='job_', dir=SPOOL_DIR)
+    return job['spool_dir']
+
+
+def cleanup_job(job: Dict[str, Any]):
+    """Release a finished job's buffers, delete its spool directory and store its profile and memory record"""
+    job.pop('pdf_bytes', None)
+    job.pop('report_bytes', None)
+    spool_dir = job.pop('spool_dir', None)
+    if spool_dir:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    profiler = job.pop('profiler', None)
+    if profiler is not None:
+        save_job_profile(job, profiler)
+    if 'memory' in job:
+        allocation_tracer.finish_job(job)
+
+
+def save_job_profile(job: Dict[str, Any], profiler: cProfile.Profile):
+    """
+    Store a job's cProfile stats in PROFILE_COLLECTION under the ID of its status document.
+
+    The document holds a text summary sorted by cumulative time and, when it
+    fits, the zlib-compressed stats that /admin/job-profile?format=pstats
+    returns for pstats, snakeviz and similar tools.
+    """
+    try:
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+        document = {
+            'file_url': job['file_url'],
+            'status': 'failed' if job.get('error') else 'completed',
+            'total_seconds': round(stats.total_tt, 6),
+            'summary': summary.getvalue(),
+            'created_at': firestore.SERVER_TIMESTAMP
+        }
+        packed = zlib.compress(marshal.dumps(stats.stats))
+        if len(packed) <= PROFILE_MAX_BYTES:
+            document['pstats'] = packed
+        else:
+            logger.warning(f"Profile of {job['file_url']} is {len(packed)} bytes; storing the summary only")
+
+        doc_id = processor.generate_document_id(job['file_url'])
+        db.collection(PROFILE_COLLECTION).document(doc_id).set(document)
+        logger.info(f"Stored profile of {job['file_url']} ({stats.total_tt:.3f}s profiled)")
+    except Exception as e:
+        logger.error(f"Failed to store profile of {job['file_url']}: {e}")
+        logger.error(traceback.format_exc())
+
+
+def run_cpu(job: Dict[str, Any], fn, *args):
+    """Run a CPU-bound step on cpu_runner; profiled and memory-traced jobs run it on the calling thread"""
+    if 'profiler' in job or 'memory' in job:
+        return fn(*args)
+    return cpu_runner.run(fn, *args)
+
+
+def load_cached_result(job: Dict[str, Any], content_hash: str) -> bool:
+    """Fill in the job's data and compliance results from the result cache; True on a hit"""
+    job['content_hash'] = content_hash
+    if not RESULT_CACHE_ENABLED:
+        return False
+
+    cached = result_cache.get(compliance_cache_key(content_hash, job['user_input']))
+    if cached is None:
+        return False
+
+    logger.info(f"Reusing cached compliance result for {job['file_url']}")
+    job['data'] = cached['data']
+    job['compliance_results'] = cached['compliance_results']
+    job['cached'] = True
+    return True
+
+
+@timed_stage('download')
+def stage_download(job: Dict[str, Any]) -> bool:
+    """Stage: download the PDF from Cloud Storage"""
+    file_url = job['file_url']
+
+    # Content-addressed uploads can hit the cache without downloading anything
+    content_hash = content_hash_from_url(file_url)
+    if content_hash and load_cached_result(job, content_hash):
+        return True
+
+    logger.info(f"Downloading PDF from {file_url}")
+    if IN_MEMORY_PROCESSING:
+        job['pdf_bytes'] = processor.download_pdf_bytes(file_url)
+    else:
+        pdf_path = processor.download_pdf(file_url, spool_directory(job))
+        if pdf_path:
+            with open(pdf_path, 'rb') as f:
+                job['pdf_bytes'] = f.read()
+
+    if not job.get('pdf_bytes'):
+        if not job['final_attempt']:
+            raise RetryableJobError('Failed to download PDF')
+        logger.error(f"Failed to download PDF from {file_url}")
+        return fail_job(job, 'Failed to download PDF')
+
+    pdf_size_bytes.observe(len(job['pdf_bytes']))
+    if not content_hash:
+        load_cached_result(job, hashlib.sha256(job['pdf_bytes']).hexdigest())
+    return True
+
+
+@timed_stage('extract')
+def stage_extract(job: Dict[str, Any]) -> bool:
+    """Stage: extract text from the PDF and parse the paystub fields"""
+    if job.get('cached'):
+        return True
+
+    file_url = job['file_url']
+    # The PDF is not needed after this stage
+    pdf_bytes = job.pop('pdf_bytes')
+
+    logger.info(f"Extracting text from {file_url}")
+    extracted = run_cpu(job, extract_and_parse_pdf, pdf_bytes)
+
+    if not extracted['text_length'] and extracted['page_count'] and OCR_ENABLED:
+        # A readable PDF without a text layer is most likely a scan
+        logger.info(f"No text layer in {file_url}, falling back to OCR")
+        extracted = ocr_extractor.extract_and_parse(pdf_bytes)
+
+    if extracted['page_count']:
+        pdf_pages.observe(extracted['page_count'])
+    if extracted.get('parse_seconds'):
+        stage_seconds.observe(extracted['parse_seconds'], 'parse')
+
+    if not extracted['text_length']:
+        logger.error(f"Failed to extract text from {file_url}")
+        return fail_job(job, 'Failed to extract text from PDF')
+
+    job['data'] = extracted['data']
+    if not job['data']:
+        logger.error("Failed to parse paystub data")
+        return fail_job(job, 'Failed to parse paystub data')
+    return True
+
+
+@timed_stage('check')
+def stage_check(job: Dict[str, Any]) -> bool:
+    """Stage: run the compliance checks on the parsed data"""
+    if job.get('cached'):
+        return True
+
+    logger.info("Performing compliance checks")
+    job['compliance_results'] = processor.perform_compliance_checks(job['data'], job['user_input'])
+
+    if RESULT_CACHE_ENABLED:
+        result_cache.set(
+            compliance_cache_key(job['content_hash'], job['user_input']),
+            {'data': job['data'], 'compliance_results': job['compliance_results']}
+        )
+    return True
+
+
+@timed_stage('render')
+def stage_render(job: Dict[str, Any]) -> bool:
+    """Stage: render the compliance report PDF"""
+    logger.info("Generating compliance report")
+    job['report_bytes'] = run_cpu(job, render_report, job['data'], job['compliance_results'], job['user_input'])
+    report_size_bytes.observe(len(job['report_bytes']))
+    return True
+
+
+@timed_stage('email')
+def stage_email(job: Dict[str, Any]) -> bool:
+    """Stage: email the report; the final status is recorded once it has been sent"""
+    email = job['email']
+    logger.info(f"Sending email to {email}")
+    # The report is not needed after this stage
+    report_bytes = job.pop('report_bytes')
+    report_key = compliance_cache_key(job['content_hash'], job['user_input'])
+    if IN_MEMORY_PROCESSING:
+        deliver_email(job, processor.report_message(email, report_bytes, report_key))
+    else:
+        report_path = processor.save_report(report_bytes, spool_directory(job))
+        finish_job(job, processor.send_email_report(email, report_path, report_key))
+    return True
+
+
+@timed_stage('rollup')
+def stage_rollup(job: Dict[str, Any]) -> bool:
+    """Stage: add the paystub to the user's running compliance totals"""
+    if not ROLLUPS_ENABLED:
+        return True
+
+    try:
+        compliance_rollups.record(
+            job['email'],
+            job['content_hash'],
+            job['data'],
+            job['compliance_results'],
+            job['user_input'].get('pay_date')
+        )
+    except Exception as e:
+        # The report is already out; a missed rollup is picked up when the stub is reprocessed
+        logger.error(f"Failed to update compliance rollup for {job['file_url']}: {e}")
+        logger.error(traceback.format_exc())
+    return True
+
+
+def deliver_email(job: Dict[str, Any], msg: Message, message: str = 'Paystub processing completed successfully'):
+    """
+    Send a job's final email and record its status.
+
+    Final attempts go through the outbox so the worker does not wait for SMTP;
+    earlier attempts of durable queue jobs wait so a failed send can be retried.
+
+    :param job: Job context
+    :param msg: The email
+    :param message: Status message once the email has been sent
+    """
+    if MAIL_OUTBOX_ENABLED and job['final_attempt']:
+        try:
+            mail_outbox.submit(msg, lambda email_sent: finish_job(job, email_sent, message))
+            return
+        except QueueFullError as e:
+            logger.warning(f"{e}; sending the email for {job['file_url']} directly")
+    finish_job(job, processor.send_message(msg), message)
+
+
+def job_result(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The parsed data and check results kept on the status document, from which /report renders"""
+    return {
+        'data': job['data'],
+        'compliance_results': job['compliance_results'],
+        'user_input': job['user_input'],
+        'report_key': compliance_cache_key(job['content_hash'], job['user_input'])
+    }
+
+
+def finish_job(job: Dict[str, Any], email_sent: bool, message: str = 'Paystub processing completed successfully'):
+    """Record the final status once the report email has been attempted"""
+    file_url = job['file_url']
+    email = job['email']
+    # Paystub jobs keep their result so the report can be fetched again later
+    fields = {'result': job_result(job)} if 'compliance_results' in job else {}
+    if email_sent:
+        # Update status to completed
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='completed',
+            message=message,
+            **fields
+        )
+        logger.info(f"Processing completed for {file_url}")
+    elif not job['final_attempt']:
+        raise RetryableJobError('Failed to send email')
+    else:
+        # Update status to completed but with email failure
+        processor.update_processing_status(
+            file_url=file_url,
+            email=email,
+            status='completed_with_errors',
+            message='Processing completed but failed to send email',
+            **fields
+        )
+        logger.warning(f"Processing completed but email sending failed for {file_url}")
+
+
+# Processing stages in order; each returns False when it ended the job early
+PIPELINE_STAGES = [
+    ('download', stage_download),
+    ('extract', stage_extract),
+    ('check', stage_check),
+    ('render', stage_render),
+    ('email', stage_email),
+    ('rollup', stage_rollup)
+]
+
+
+def handle_job_error(job: Dict[str, Any], error: Exception):
+    """Record an unexpected stage error, raising RetryableJobError if retries remain"""
+    logger.error(f"Error processing paystub: {error}")
+    logger.error(traceback.format_exc())
+
+    if not job['final_attempt']:
+        processor.update_processing_status(
+            file_url=job['file_url'],
+            email=job['email'],
+            status='processing',
+            message=f'Retrying after error: {str(error)}',
+            # The retry may run in another worker process
+            write_through=True
+        )
+        raise RetryableJobError(str(error)) from error
+
+    # Update status to failed
+    fail_job(job, f'Error processing paystub: {str(error)}')
+
+
+def process_paystub_async(
+    file_url: str,
+    email: str,
+    user_input: Dict[str, Any] = None,
+    final_attempt: bool = True,
+    profile: bool = False,
+    trace_memory: bool = False,
+    resume: Dict[str, Any] = None
+):
+    """Process the paystub asynchronously, running every stage on the calling thread.
+
+    When ``final_attempt`` is False (a durable queue job with retries left),
+    transient failures raise RetryableJobError instead of marking the job failed.
+    ``profile`` and ``trace_memory`` are passed to create_job. ``resume``
+    holds the stage to start at and the results of the earlier stages, for a
+    job handed over by a sync request (see resume_job).
+    """
+    job = create_job(file_url, email, user_input, final_attempt, profile, trace_memory)
+    start = 0
+    if resume:
+        resume = dict(resume)
+        start = resume.pop('start')
+        job.update(resume)
+    run_stages(job, start)
+
+
+def run_stages(job: Dict[str, Any], start: int = 0):
+    """Run PIPELINE_STAGES from index start on the calling thread, then clean up the job"""
+    try:
+        for _, stage in PIPELINE_STAGES[start:]:
+            if not stage(job):
+                return
+    except Exception as e:
+        handle_job_error(job, e)
+    finally:
+        cleanup_job(job)
+
+
+class StagePipeline:
+    """Run processing stages on separate worker pools connected by queues.
+
+    I/O-bound stages (download, email) get many threads while CPU-bound stages
+    get about one per core, so a slow SMTP server does not hold up PDF parsing
+    for other jobs.
+    """
+
+    def __init__(self, stages, concurrency: Dict[str, int], max_in_flight: int):
+        """Initialize the pipeline; stage threads start on first submit"""
+        self.stages = stages
+        self.max_in_flight = max(1, max_in_flight)
+        self._queues = [queue.Queue() for _ in stages]
+        self._lock = threading.Lock()
+        self._started = False
+        self._in_flight = 0
+        self._rejected = 0
+        self._stats = {
+            name: {
+                'concurrency': max(1, concurrency.get(name, 1)),
+                'busy': 0,
+                'processed': 0,
+                'failed': 0,
+                'service_seconds_total': 0.0,
+                'wait_seconds_total': 0.0
+            }
+            for name, _ in stages
+        }
+
+    def _ensure_started(self):
+        """Start the stage worker threads if they are not running yet"""
+        with self._lock:
+            if self._started:
+                return
+            for index, (name, _) in enumerate(self.stages):
+                for i in range(self._stats[name]['concurrency']):
+                    threading.Thread(
+                        target=self._stage_loop,
+                        args=(index,),
+                        name=f"stage-{name}-{i}",
+                        daemon=True
+                    ).start()
+            self._started = True
+            logger.info("Started processing pipeline: " + ", ".join(
+                f"{name}={self._stats[name]['concurrency']}" for name, _ in self.stages
+            ))
+
+    def submit(self, job: Dict[str, Any], start: int = 0) -> None:
+        """
+        Admit a job into the first stage, or into a later one for a job that already ran the earlier stages.
+
+        :param job: Job context from create_job()
+        :param start: Index of the stage to start at
+        :raises QueueFullError: If too many jobs are already in flight
+        """
+        self._ensure_started()
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self._rejected += 1
+                raise QueueFullError(f"Processing pipeline is full ({self.max_in_flight} jobs in flight)")
+            self._in_flight += 1
+        self._queues[start].put((job, time.monotonic()))
+
+    def _stage_loop(self, index: int):
+        """Run one stage's jobs and hand them on to the next stage"""
+        name, stage = self.stages[index]
+        stats = self._stats[name]
+        while True:
+            job, enqueued_at = self._queues[index].get()
+            started_at = time.monotonic()
+            queue_wait_seconds.observe(started_at - enqueued_at, f"pipeline_{name}")
+            with self._lock:
+                stats['busy'] += 1
+                stats['wait_seconds_total'] += started_at - enqueued_at
+
+            proceed = False
+            try:
+                proceed = stage(job)
+            except Exception as e:
+                with self._lock:
+                    stats['failed'] += 1
+                try:
+                    handle_job_error(job, e)
+                except Exception:
+                    logger.error(f"Failed to record error for {job['file_url']}")
+            finally:
+                with self._lock:
+                    stats['busy'] -= 1
+                    stats['processed'] += 1
+                    stats['service_seconds_total'] += time.monotonic() - started_at
+
+            if proceed and index + 1 < len(self.stages):
+                self._queues[index + 1].put((job, time.monotonic()))
+            else:
+                cleanup_job(job)
+                with self._lock:
+                    self._in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-stage queue depth, saturation and timing statistics"""
+        with self._lock:
+            stages = {}
+            for index, (name, _) in enumerate(self.stages):
+                stats = self._stats[name]
+                processed = stats['processed']
+                stages[name] = {
+                    'concurrency': stats['concurrency'],
+                    'busy': stats['busy'],
+                    'queue_depth': self._queues[index].qsize(),
+                    'saturation': round(stats['busy'] / stats['concurrency'], 4),
+                    'processed': processed,
+                    'failed': stats['failed'],
+                    'service_seconds_avg': round(stats['service_seconds_total'] / processed, 4) if processed else 0.0,
+                    'wait_seconds_avg': round(stats['wait_seconds_total'] / processed, 4) if processed else 0.0
+                }
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'rejected': self._rejected,
+                'stages': stages
+            }
+
+
+def create_stage_pipeline() -> Optional[StagePipeline]:
+    """Create the stage pipeline when PROCESSING_MODE is 'pipeline', otherwise None"""
+    if PROCESSING_MODE != 'pipeline':
+        return None
+
+    cpus = available_cpus()
+    concurrency = {
+        'download': STAGE_DOWNLOAD_CONCURRENCY,
+        'extract': STAGE_EXTRACT_CONCURRENCY or cpus,
+        'check': STAGE_CHECK_CONCURRENCY or cpus,
+        'render': STAGE_RENDER_CONCURRENCY or cpus,
+        'email': STAGE_EMAIL_CONCURRENCY,
+        'rollup': STAGE_ROLLUP_CONCURRENCY
+    }
+    return StagePipeline(PIPELINE_STAGES, concurrency, PIPELINE_MAX_IN_FLIGHT)
+
+
+# Per-stage worker pools (None when whole jobs run on job_executor)
+stage_pipeline = create_stage_pipeline()
+
+
+def queue_depths() -> Dict[tuple, int]:
+    """Items waiting in each queue of this process, and in the durable queue when there is one"""
+    depths = {
+        ('jobs',): job_executor.stats()['queue_depth'],
+        ('mail_outbox',): mail_outbox.stats()['queue_depth']
+    }
+    if stage_pipeline is not None:
+        for name, stage in stage_pipeline.stats()['stages'].items():
+            depths[(f"pipeline_{name}",)] = stage['queue_depth']
+    if job_queue is not None:
+        depths[('durable',)] = job_queue.stats()['pending']
+    return depths
+
+
+def busy_workers() -> Dict[tuple, int]:
+    """Worker threads currently running a job or stage"""
+    busy = {('jobs',): job_executor.stats()['active']}
+    if stage_pipeline is not None:
+        for name, stage in stage_pipeline.stats()['stages'].items():
+            busy[(f"pipeline_{name}",)] = stage['busy']
+    return busy
+
+
+metrics.gauge('queue_depth', 'Items waiting in each queue', queue_depths, ('queue',))
+metrics.gauge('busy_workers', 'Worker threads currently running a job or stage', busy_workers, ('pool',))
+metrics.gauge(
+    'status_writes_pending', 'Status updates buffered but not yet written', lambda: status_writer.stats()['pending']
+)
+metrics.gauge(
+    'status_subscribers', 'Clients waiting for status changes', lambda: status_broker.stats()['subscribers']
+)
+metrics.gauge('resident_memory_bytes', 'Resident set size of this process', resident_memory_bytes)
+metrics.gauge(
+    'traced_memory_bytes', 'Allocations traced by tracemalloc (0 when not tracing)',
+    lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+)
+
+
+def tmp_usage(field: str):
+    """Read one field of the latest temp directory sample, by directory"""
+    sample = tmp_monitor.latest()
+    if sample is None:
+        return {}
+    return {(directory,): usage[field] for directory, usage in sample['directories'].items()}
+
+
+metrics.gauge('tmp_bytes', 'Bytes in each temp directory at the last sample', lambda: tmp_usage('bytes'), ('directory',))
+metrics.gauge('tmp_files', 'Files in each temp directory at the last sample', lambda: tmp_usage('files'), ('directory',))
+metrics.gauge(
+    'tmp_stale_files', 'Files older than TMP_STALE_AGE in each temp directory', lambda: tmp_usage('stale_files'),
+    ('directory',)
+)
+
+
+# Job fields the stages after 'check' read, carried over when a job is resumed from the durable queue
+RESUME_FIELDS = ('content_hash', 'cached', 'data', 'compliance_results')
+
+
+def resume_job(job: Dict[str, Any], start: int):
+    """
+    Continue a job from stage index start in the background.
+
+    With a durable queue the job is queued with the results it has so far,
+    so a worker process finishes it with the queue's retries and lease
+    recovery; otherwise it goes to this process's background workers.
+    """
+    if job_queue is not None:
+        payload = {
+            'type': 'process_paystub',
+            'file_url': job['file_url'],
+            'email': job['email'],
+            'user_input': job['user_input'],
+            'resume': {'start': start, **{field: job[field] for field in RESUME_FIELDS if field in job}}
+        }
+        if 'profiler' in job:
+            payload['profile'] = True
+        try:
+            job_queue.enqueue(payload)
+            cleanup_job(job)
+            return
+        except Exception as e:
+            logger.error(f"Failed to queue {job['file_url']}, finishing it in this process: {e}")
+
+    try:
+        if stage_pipeline is not None:
+            stage_pipeline.submit(job, start)
+        else:
+            job_executor.submit(run_stages, job, start)
+    except QueueFullError as e:
+        # The job has already been admitted once; finish it here rather than drop it
+        logger.warning(f"{e}; finishing {job['file_url']} on the calling thread")
+        run_stages(job, start)
+
+
+class SyncProcessor:
+    """Run the first stages of a paystub job while the request waits, up to a latency budget.
+
+    When the budget runs out the request returns and the same job carries on
+    with the remaining stages in the background (see resume_job), so no work
+    is repeated.
+    """
+
+    def __init__(self, stages, workers: int):
+        """
+        Initialize the processor; threads start on first use.
+
+        :param stages: Leading PIPELINE_STAGES to run while the request waits
+        :param workers: Threads running sync jobs
+        """
+        self.stages = stages
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sync')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'completed': 0, 'failed': 0, 'fell_back': 0, 'rejected': 0}
+
+    def run(self, job: Dict[str, Any], budget: float) -> Optional[bool]:
+        """
+        Run the stages and wait up to budget seconds for them.
+
+        :param job: Job context from create_job()
+        :param budget: Seconds to wait
+        :return: True when the checks completed, False when a stage ended the job
+            (job['error'] says why), None when the job continues in the background
+        :raises QueueFullError: If the sync workers are backed up; use the background path instead
+        :raises Exception: Whatever a stage raised within the budget
+        """
+        with self._lock:
+            if self._pending >= 2 * self.workers:
+                self._stats['rejected'] += 1
+                raise QueueFullError(f"Sync workers are busy ({self._pending} jobs pending)")
+            self._pending += 1
+
+        handoff = {'waiting': True, 'done': threading.Event(), 'outcome': None, 'error': None}
+        self._pool.submit(self._work, job, handoff)
+        handoff['done'].wait(budget)
+
+        with self._lock:
+            if not handoff['done'].is_set():
+                # From here on _work owns the job
+                handoff['waiting'] = False
+                self._stats['fell_back'] += 1
+                return None
+        if handoff['error'] is not None:
+            raise handoff['error']
+        return handoff['outcome']
+
+    def _work(self, job: Dict[str, Any], handoff: Dict[str, Any]):
+        """Run the stages, then hand the result to the waiting request or carry on in the background"""
+        outcome, error = False, None
+        try:
+            outcome = all(stage(job) for _, stage in self.stages)
+        except Exception as e:
+            error = e
+
+        with self._lock:
+            self._pending -= 1
+            waiting = handoff['waiting']
+            if waiting:
+                handoff['outcome'], handoff['error'] = outcome, error
+                self._stats['completed' if outcome else 'failed'] += 1
+                handoff['done'].set()
+
+        if waiting:
+            # The request records the result; only the rollup is left
+            if outcome:
+                stage_rollup(job)
+            cleanup_job(job)
+        elif error is not None:
+            try:
+                handle_job_error(job, error)
+            finally:
+                cleanup_job(job)
+        elif outcome:
+            resume_job(job, len(self.stages))
+        else:
+            cleanup_job(job)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many sync jobs finished in time, fell back or were turned away"""
+        with self._lock:
+            return {'workers': self.workers, 'pending': self._pending, **self._stats}
+
+
+# Download, extract and check run while /process-paystub waits in sync mode
+sync_processor = SyncProcessor(PIPELINE_STAGES[:3], SYNC_WORKERS)
+
+
+RegisterSegment = namedtuple('RegisterSegment', ['index', 'text', 'first_page', 'last_page'])
+
+
+def iter_register_pages(pdf_path: str, page_count: int):
+    """
+    Yield (page number, text) for a register, extracting windows of pages in parallel.
+
+    Only one window (REGISTER_PAGES_PER_TASK pages per CPU worker) is held at a time.
+    """
+    window = REGISTER_PAGES_PER_TASK * cpu_runner.workers
+    for window_start in range(0, page_count, window):
+        starts = list(range(window_start, min(page_count, window_start + window), REGISTER_PAGES_PER_TASK))
+        chunks = cpu_runner.map(
+            extract_page_range_text,
+            [pdf_path] * len(starts),
+            starts,
+            [REGISTER_PAGES_PER_TASK] * len(starts)
+        )
+        for start, texts in zip(starts, chunks):
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+
+
+def split_register(pages, boundary):
+    """
+    Split a stream of page texts into one segment per employee.
+
+    A segment runs from one match of ``boundary`` (the employee label) to the
+    next, so employees may share a page or span several. Text before the first
+    label (register headers) is dropped. Only the current employee's text is
+    buffered.
+
+    :param pages: Iterable of (page number, text)
+    :param boundary: Compiled pattern that marks the start of an employee
+    :return: Generator of RegisterSegment
+    """
+    buffer = ""
+    page_starts = []  # (offset in buffer, page number) of each page in the buffer
+    in_segment = False
+    index = 0
+
+    def page_at(offset):
+        return [number for start, number in page_starts if start <= offset][-1]
+
+    def drop_before(offset):
+        nonlocal buffer, page_starts
+        page_starts = [(0, page_at(offset))] + [
+            (start - offset, number) for start, number in page_starts if start > offset
+        ]
+        buffer = buffer[offset:]
+
+    for page_number, text in pages:
+        page_starts.append((len(buffer), page_number))
+        buffer += text + "\n"
+
+        starts = [match.start() for match in boundary.finditer(buffer)]
+        if not starts:
+            if not in_segment:
+                # Header pages; keep a tail in case a label is split across pages
+                drop_before(max(0, len(buffer) - 256))
+            continue
+
+        if in_segment and starts[0] != 0:
+            starts.insert(0, 0)
+        in_segment = True
+
+        for start, end in zip(starts, starts[1:]):
+            yield RegisterSegment(index, buffer[start:end], page_at(start), page_at(end - 1))
+            index += 1
+
+        # Keep the last employee, whose text may continue on the next page
+        drop_before(starts[-1])
+
+    if in_segment:
+        yield RegisterSegment(index, buffer, page_starts[0][1], page_starts[-1][1])
+
+
+class StreamedResults:
+    """Stream per-item job results to a Firestore subcollection and a spooled CSV summary"""
+
+    def __init__(self, job: Dict[str, Any], subcollection: str, columns: List[str], counters: List[str]):
+        """
+        Open the results subcollection and the CSV file in the job's spool directory.
+
+        :param job: Job context
+        :param subcollection: Subcollection of the job's status document
+        :param columns: CSV header
+        :param counters: Names of the summary counters; 'items' is always counted
+        """
+        self.job = job
+        doc_id = processor.generate_document_id(job['file_url'])
+        self.collection = db.collection('processing_status').document(doc_id).collection(subcollection)
+        self.summary = {'items': 0, **{name: 0 for name in counters}}
+        self._csv_file = open(
+            os.path.join(spool_directory(job), f'{subcollection}_summary.csv'), 'w+', newline=''
+        )
+        self._writer = csv.writer(self._csv_file)
+        self._writer.writerow(columns)
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, document: Dict[str, Any], row: List[Any], counts: Dict[str, int]):
+        """Write one result as soon as it is ready and add it to the summary"""
+        document['updated_at'] = firestore.SERVER_TIMESTAMP
+        self.collection.document(doc_id).set(document)
+
+        with self._lock:
+            self._writer.writerow(row)
+            self.summary['items'] += 1
+            for name, count in counts.items():
+                self.summary[name] += count
+            processed = self.summary['items']
+
+        if processed % REGISTER_PROGRESS_EVERY == 0:
+            processor.update_processing_status(
+                file_url=self.job['file_url'],
+                email=self.job['email'],
+                status='processing',
+                message=f'Processed {processed} {self.collection.id}'
+            )
+
+    def close(self) -> bytes:
+        """Close the CSV file and return its contents"""
+        with self._lock:
+            if self._csv_file.closed:
+                return b""
+            self._csv_file.seek(0)
+            contents = self._csv_file.read().encode('utf-8')
+            self._csv_file.close()
+            return contents
+
+
+class RegisterResults(StreamedResults):
+    """Per-employee payroll register results"""
+
+    CSV_COLUMNS = [
+        'index', 'first_page', 'last_page', 'employee_name', 'total_hours', 'gross_pay', 'net_pay',
+        'minimum_wage', 'overtime_compliant', 'total_compensation_valid', 'incomplete', 'flagged'
+    ]
+
+    def __init__(self, job: Dict[str, Any]):
+        """Open the employees subcollection"""
+        super().__init__(job, 'employees', self.CSV_COLUMNS, ['flagged', 'incomplete'])
+        # Inputs of the combined report for flagged employees, capped to keep memory flat
+        self.flagged_reports = []
+
+    def add_employee(self, segment: RegisterSegment, analysis: Dict[str, Any]):
+        """Record one employee's result"""
+        data = analysis['data']
+        checks = analysis['compliance_results']
+        incomplete = any(data.get(field) is None for field in processor.REQUIRED_FIELDS)
+        flagged = not incomplete and not (
+            checks['minimum_wage'] and checks['overtime_compliant'] and checks['total_compensation_valid']
+        )
+
+        self.add(
+            f"{segment.index:06d}",
+            {
+                'index': segment.index,
+                'first_page': segment.first_page,
+                'last_page': segment.last_page,
+                'data': data,
+                'compliance_results': checks,
+                'incomplete': incomplete,
+                'flagged': flagged
+            },
+            [
+                segment.index, segment.first_page, segment.last_page,
+                data.get('employee_name'), data.get('total_hours'), data.get('gross_pay'), data.get('net_pay'),
+                checks['minimum_wage'], checks['overtime_compliant'], checks['total_compensation_valid'],
+                incomplete, flagged
+            ],
+            {'flagged': int(flagged), 'incomplete': int(incomplete)}
+        )
+        if flagged:
+            with self._lock:
+                if len(self.flagged_reports) < REGISTER_REPORT_MAX_EMPLOYEES:
+                    self.flagged_reports.append((segment.index, data, checks))
+
+
+def process_register_segment(results: RegisterResults, segment: RegisterSegment, user_input: Dict[str, Any]):
+    """Analyze one employee segment and record the result"""
+    results.add_employee(segment, cpu_runner.run(analyze_register_segment, segment.text, user_input))
+
+
+def process_register_async(
+    file_url: str,
+    email: str,
+    user_input: Dict[str, Any] = None,
+    final_attempt: bool = True
+):
+    """Process a multi-employee payroll register.
+
+    Pages are extracted a window at a time and split into employees as they
+    stream in; each employee is parsed and checked on REGISTER_WORKERS threads
+    and its result written to Firestore as soon as it is ready, so memory use
+    does not grow with the register. The summary is emailed as CSV at the end,
+    together with one PDF holding the reports of the flagged employees.
+    """
+    job = create_job(file_url, email, user_input, final_attempt)
+    results = None
+    try:
+        # Registers go through the spool directory so page windows can be read by process workers
+        pdf_path = processor.download_pdf(file_url, spool_directory(job))
+        if not pdf_path:
+            if not final_attempt:
+                raise RetryableJobError('Failed to download PDF')
+            fail_job(job, 'Failed to download PDF')
+            return
+
+        processor._validate_pdf_file(pdf_path)
+        with open(pdf_path, 'rb') as f:
+            page_count = len(PyPDF2.PdfReader(f).pages)
+        if REGISTER_MAX_PAGES and page_count > REGISTER_MAX_PAGES:
+            fail_job(job, f'Payroll register exceeds {REGISTER_MAX_PAGES} pages')
+            return
+
+        results = RegisterResults(job)
+        segments = split_register(
+            iter_register_pages(pdf_path, page_count),
+            re.compile(REGISTER_BOUNDARY_PATTERN, re.IGNORECASE)
+        )
+
+        with ThreadPoolExecutor(max_workers=REGISTER_WORKERS, thread_name_prefix='register') as pool:
+            pending = set()
+            for segment in segments:
+                # Bound the segments held in memory while workers catch up
+                if len(pending) >= 2 * REGISTER_WORKERS:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(pool.submit(process_register_segment, results, segment, job['user_input']))
+            for future in pending:
+                future.result()
+
+        summary_csv = results.close()
+        summary = dict(results.summary, employees=results.summary['items'])
+        if not summary['employees']:
+            fail_job(job, 'No employees found in payroll register')
+            return
+
+        logger.info(f"Processed {summary['employees']} employees from {file_url}")
+        flagged_report = None
+        if results.flagged_reports:
+            # One PDF for the employer, a page per flagged employee in register order
+            flagged_report = cpu_runner.run(render_reports, [
+                (data, checks, job['user_input']) for _, data, checks in sorted(results.flagged_reports, key=lambda r: r[0])
+            ], True)
+        deliver_email(
+            job,
+            processor.register_summary_message(email, summary, summary_csv, flagged_report),
+            f"Processed {summary['employees']} employees; {summary['flagged']} with possible compliance issues"
+        )
+    except Exception as e:
+        handle_job_error(job, e)
+    finally:
+        if results is not None:
+            results.close()
+        cleanup_job(job)
+
+
+Punch = namedtuple('Punch', ['employee_id', 'start', 'end'])
+
+WorkweekSummary = namedtuple('WorkweekSummary', [
+    'employee_id', 'week_start', 'total_hours', 'overtime_hours', 'shift_count', 'long_shift_days'
+])
+
+
+def timesheet_format(file_url: str) -> Optional[str]:
+    """Return 'csv' or 'jsonl' from a punch export's name (optionally .gz), or None"""
+    name = file_url.lower()
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def iter_punch_records(stream, fmt: str):
+    """
+    Yield one dict per row of a CSV or JSONL punch export, reading line by line.
+
+    :param stream: Text stream
+    :param fmt: 'csv' or 'jsonl'
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield {}  # Counted as a bad row by the parser
+    else:
+        raise ValueError(f"Unsupported timesheet format: {fmt}")
+
+
+class PunchParser:
+    """Turn raw punch export rows into Punch tuples, counting rows that cannot be used.
+
+    Timestamps are kept as the workplace's clock time: a UTC offset, where an
+    export has one, is dropped so rows with and without offsets compare.
+    """
+
+    # Accepted column names for each field, first match wins
+    COLUMNS = {
+        'employee_id': ('employee_id', 'employee', 'emp_id', 'id'),
+        'start': ('clock_in', 'punch_in', 'start', 'start_time', 'in'),
+        'end': ('clock_out', 'punch_out', 'end', 'end_time', 'out')
+    }
+
+    def __init__(self, max_shift_hours: float = TIMESHEET_MAX_SHIFT_HOURS):
+        """Initialize the parser"""
+        self.max_shift = timedelta(hours=max_shift_hours)
+        self.rows = 0
+        self.bad_rows = 0
+        self._mappings = {}  # row keys -> (employee, start, end) column names
+
+    def _mapping(self, keys) -> Optional[tuple]:
+        """Match a row's columns to the punch fields once per distinct header"""
+        keys = tuple(keys)
+        if keys not in self._mappings:
+            normalized = {str(key).strip().lower(): key for key in keys if key is not None}
+            mapping = tuple(
+                next((normalized[name] for name in names if name in normalized), None)
+                for names in self.COLUMNS.values()
+            )
+            self._mappings[keys] = mapping if None not in mapping else None
+        return self._mappings[keys]
+
+    def parse(self, record: Dict[str, Any]) -> Optional[Punch]:
+        """Convert one row, or return None if it is incomplete or invalid"""
+        self.rows += 1
+        mapping = self._mapping(record.keys()) if isinstance(record, dict) else None
+        if mapping is None:
+            self.bad_rows += 1
+            return None
+
+        employee_key, start_key, end_key = mapping
+        try:
+            employee_id = str(record[employee_key]).strip()
+            start = datetime.fromisoformat(str(record[start_key]).strip()).replace(tzinfo=None)
+            end = datetime.fromisoformat(str(record[end_key]).strip()).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            self.bad_rows += 1
+            return None
+
+        if not employee_id or not start < end <= start + self.max_shift:
+            self.bad_rows += 1
+            return None
+        return Punch(employee_id, start, end)
+
+    def iter_punches(self, records):
+        """Yield the usable punches from a stream of rows"""
+        for record in records:
+            punch = self.parse(record)
+            if punch is not None:
+                yield punch
+
+
+class TimesheetAggregator:
+    """Group a stream of punches into per-employee workweeks as it goes.
+
+    Each employee's week is finished as soon as one of their punches falls in
+    a later week, so punches must be chronological per employee (exports
+    sorted by employee or by time both are). Memory holds one open week per
+    employee, however many rows the export has. A punch for an already
+    finished week is counted in ``out_of_order`` and skipped.
+
+    A day's spread of hours runs from its first clock-in to its last
+    clock-out, breaks included; overnight shifts count toward the day they
+    started.
+    """
+
+    def __init__(self, jurisdiction: Dict[str, Any] = None, week_start: int = TIMESHEET_WEEK_START):
+        """
+        Initialize the aggregator.
+
+        :param jurisdiction: 'state' and 'city' used to resolve each day's long shift threshold
+        :param week_start: First day of the workweek (0 = Monday)
+        """
+        self.jurisdiction = {
+            key: value for key, value in (jurisdiction or {}).items() if key in ('state', 'city')
+        }
+        self.week_start = week_start
+        self.out_of_order = 0
+        self._open = {}  # employee -> [week start, {day: [first in, last out]}, hours, shifts]
+
+    def add(self, punch: Punch) -> Optional[WorkweekSummary]:
+        """Add a punch; returns the employee's previous week if this punch finished it"""
+        day = punch.start.date()
+        week_start = day - timedelta(days=(day.weekday() - self.week_start) % 7)
+
+        finished = None
+        week = self._open.get(punch.employee_id)
+        if week is None or week_start > week[0]:
+            if week is not None:
+                finished = self._summarize(punch.employee_id, week)
+            week = self._open[punch.employee_id] = [week_start, {}, 0.0, 0]
+        elif week_start < week[0]:
+            self.out_of_order += 1
+            return None
+
+        span = week[1].get(day)
+        if span is None:
+            week[1][day] = [punch.start, punch.end]
+        else:
+            span[0] = min(span[0], punch.start)
+            span[1] = max(span[1], punch.end)
+        week[2] += (punch.end - punch.start).total_seconds() / 3600
+        week[3] += 1
+        return finished
+
+    def flush(self):
+        """Finish and yield every open week"""
+        open_weeks, self._open = self._open, {}
+        for employee_id, week in open_weeks.items():
+            yield self._summarize(employee_id, week)
+
+    def _summarize(self, employee_id: str, week: list) -> WorkweekSummary:
+        """Compute a finished week's totals and long shift days"""
+        week_start, days, hours, shifts = week
+        long_shift_days = 0
+        for day, (first_in, last_out) in days.items():
+            rule = wage_rules.resolve(dict(self.jurisdiction, pay_date=day.isoformat()))
+            if (last_out - first_in).total_seconds() / 3600 > rule['long_shift_threshold']:
+                long_shift_days += 1
+
+        total_hours = round(hours, 2)
+        return WorkweekSummary(
+            employee_id, week_start, total_hours, round(max(0.0, total_hours - 40), 2), shifts, long_shift_days
+        )
+
+
+def iter_workweek_summaries(punches, aggregator: TimesheetAggregator):
+    """Yield workweek summaries from a punch stream as soon as each week is finished"""
+    for punch in punches:
+        finished = aggregator.add(punch)
+        if finished is not None:
+            yield finished
+    yield from aggregator.flush()
+
+
+def workweek_compliance_input(summary: WorkweekSummary, jurisdiction: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the user_input perform_hours_checks needs from a workweek summary"""
+    return dict(
+        jurisdiction,
+        pay_date=summary.week_start.isoformat(),
+        shifts_exceeded_10_hours=summary.long_shift_days > 0,
+        exceeded_shifts_count=summary.long_shift_days
+    )
+
+
+class TimesheetResults(StreamedResults):
+    """Per-employee, per-workweek timesheet results"""
+
+    CSV_COLUMNS = [
+        'employee_id', 'week_start', 'total_hours', 'overtime_hours', 'shift_count',
+        'long_shift_days', 'additional_pay_owed'
+    ]
+
+    def __init__(self, job: Dict[str, Any]):
+        """Open the workweeks subcollection"""
+        super().__init__(job, 'workweeks', self.CSV_COLUMNS, ['long_shift_days', 'overtime_weeks'])
+
+    def add_workweek(self, summary: WorkweekSummary, checks: Dict[str, Any]):
+        """Record one employee's workweek"""
+        additional_pay_owed = checks.get('additional_pay_owed', 0.0)
+        employee_key = re.sub(r'[^\w.-]', '_', summary.employee_id)
+        self.add(
+            f"{employee_key}_{summary.week_start.isoformat()}",
+            {
+                **summary._asdict(),
+                'week_start': summary.week_start.isoformat(),
+                'compliance_results': checks
+            },
+            [
+                summary.employee_id, summary.week_start.isoformat(), summary.total_hours,
+                summary.overtime_hours, summary.shift_count, summary.long_shift_days, additional_pay_owed
+            ],
+            {'long_shift_days': summary.long_shift_days, 'overtime_weeks': int(summary.overtime_hours > 0)}
+        )
+
+
+def process_timesheet_async(
+    file_url: str,
+    email: str,
+    user_input: Dict[str, Any] = None,
+    final_attempt: bool = True
+):
+    """Ingest a punch export and check spread of hours and weekly overtime per employee.
+
+    The export is streamed from Cloud Storage and parsed row by row; each
+    workweek is checked and written out as soon as it is finished, so
+    multi-GB files run in memory proportional to the number of employees.
+    """
+    job = create_job(file_url, email, user_input, final_attempt)
+    results = None
+    try:
+        fmt = timesheet_format(file_url)
+        if fmt is None:
+            fail_job(job, 'Timesheet must be a .csv or .jsonl file (optionally .gz)')
+            return
+
+        jurisdiction = {key: job['user_input'][key] for key in ('state', 'city') if job['user_input'].get(key)}
+        results = TimesheetResults(job)
+        parser = PunchParser()
+        aggregator = TimesheetAggregator(jurisdiction)
+
+        with processor.storage_service.open_text(file_url, TIMESHEET_READ_CHUNK) as stream:
+            punches = parser.iter_punches(iter_punch_records(stream, fmt))
+            for summary in iter_workweek_summaries(punches, aggregator):
+                checks = processor.perform_hours_checks(workweek_compliance_input(summary, jurisdiction))
+                results.add_workweek(summary, checks)
+
+        summary_csv = results.close()
+        totals = results.summary
+        logger.info(
+            f"Ingested {parser.rows} punch rows from {file_url}: {totals['items']} workweeks, "
+            f"{parser.bad_rows} bad rows, {aggregator.out_of_order} out of order"
+        )
+        if not totals['items']:
+            fail_job(job, 'No usable punches found in timesheet')
+            return
 
+        msg = processor.csv_summary_message(
+            email,
+            "Your Timesheet Compliance Summary",
+            f"We checked {totals['items']} employee workweeks from {parser.rows} punch rows: "
+            f"{totals['long_shift_days']} days exceeded the spread of hours limit and "
+            f"{totals['overtime_weeks']} workweeks had overtime. "
+            f"{parser.bad_rows + aggregator.out_of_order} rows could not be used.\n\n"
+            "Please find the per-workweek results attached.",
+            "timesheet_summary.csv",
+            summary_csv
+        )
+        deliver_email(
+            job,
+            msg,
+            f"Processed {totals['items']} workweeks; {totals['long_shift_days']} long shift days"
+        )
+    except Exception as e:
+        handle_job_error(job, e)
+    finally:
+        if results is not None:
+            results.close()
+        cleanup_job(job)
 
-# Create a global instance of the processor
-processor = PaystubProcessor()
 
-# Define routes
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    """Serve the static React app files"""
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+def run_job(payload: Dict[str, Any], final_attempt: bool = True):
+    """Dispatch a durable queue job payload to its handler"""
+    job_type = payload.get('type')
+    if job_type == 'process_paystub':
+        process_paystub_async(
+            payload['file_url'],
+            payload['email'],
+            payload.get('user_input') or {},
+            final_attempt=final_attempt,
+            profile=payload.get('profile', False),
+            trace_memory=payload.get('trace_memory', False),
+            resume=payload.get('resume')
+        )
+    elif job_type == 'process_register':
+        process_register_async(
+            payload['file_url'],
+            payload['email'],
+            payload.get('user_input') or {},
+            final_attempt=final_attempt
+        )
+    elif job_type == 'process_timesheet':
+        process_timesheet_async(
+            payload['file_url'],
+            payload['email'],
+            payload.get('user_input') or {},
+            final_attempt=final_attempt
+        )
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        raise ValueError(f"Unknown job type: {job_type}")
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint."""
-    return jsonify({'status': 'healthy'})
+@app.route('/compliance-batch', methods=['POST'])
+def compliance_batch():
+    """Run the compliance checks over columnar pay period data for employer audits."""
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
+
+    data = request.get_json()
+    columns = {}
+    for name in ('net_pay', 'gross_pay', 'total_hours'):
+        if not isinstance(data.get(name), list):
+            return jsonify({'error': f'{name} must be a list'}), 400
+        columns[name] = [value or 0 for value in data[name]]
+    for name in ('exceeded_shifts_count', 'shifts_exceeded_10_hours'):
+        if data.get(name) is not None:
+            columns[name] = data[name]
+
+    rows = len(columns['net_pay'])
+    if rows > BATCH_MAX_ROWS:
+        return jsonify({'error': f'Batch exceeds {BATCH_MAX_ROWS} rows'}), 400
+
+    # One wage rule applies to the whole batch
+    jurisdiction, jurisdiction_error = parse_jurisdiction(data)
+    if jurisdiction_error:
+        return jsonify({'error': jurisdiction_error}), 400
+    rule = wage_rules.resolve(jurisdiction)
+
+    try:
+        results = processor.perform_compliance_checks_batch(rule=rule, **columns)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
 
-@app.route('/api', methods=['GET'])
-def api_info():
     return jsonify({
-        'message': 'API is running',
-        'version': '1.0.0'
+        'rows': rows,
+        'wage_rule': rule,
+        'results': {name: values.tolist() for name, values in results.items()}
     })
 
-@app.route('/upload-paystub', methods=['POST'])
-def upload_paystub():
-    """Handle paystub file upload.
-    Uploads the file to Google Cloud Storage and forwards the URL to the backend.
-    """
-    # Log all incoming request details for debugging
-    logger.info(f"Request headers: {request.headers}")
-    logger.info(f"Request content type: {request.content_type}")
+@app.route('/queue-stats', methods=['GET'])
+def queue_stats():
+    """Report background job queue depth and wait times."""
+    stats = job_executor.stats()
+    if stage_pipeline is not None:
+        stats['pipeline'] = stage_pipeline.stats()
+    if job_queue is not None:
+        stats['durable_queue'] = job_queue.stats()
+    stats['sync'] = sync_processor.stats()
+    stats['result_cache'] = result_cache.stats()
+    stats['report_cache'] = report_cache.stats()
+    stats['smtp_pool'] = smtp_pool.stats()
+    stats['mail_outbox'] = mail_outbox.stats()
+    stats['status_writer'] = status_writer.stats()
+    stats['status_broker'] = status_broker.stats()
+    stats['status_cache'] = status_cache.stats()
+    stats['ocr_cache'] = ocr_extractor.cache.stats()
+    return jsonify(stats)
 
-    if 'file' not in request.files:
-        logger.error("No file part in the request")
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files['file']
-    
-    if file.filename == '':
-        logger.error("No selected file")
-        return jsonify({"error": "No selected file"}), 400
-    
-    if file:
-        # Log file details
-        logger.info(f"Received file: {file.filename}")
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    """Serve stage latencies, sizes, failures and queue depths in the Prometheus text format."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        try:
-            # Upload to Google Cloud Storage
-            storage_service = StorageService(BUCKET_ID)
-            filename, signed_url = storage_service.upload_file(file)
-            
-            # Store this file URL in Firestore with initial status
-            processor.update_processing_status(
-                file_url=filename,
-                email=request.form.get('email', ''),
-                status='uploaded',
-                message='File uploaded, pending processing'
-            )
-            
-            return jsonify({
-                "file_url": filename,
-                "signed_url": signed_url,
-                "status": "uploaded",
-                "message": "File uploaded successfully"
-            })
-            
-        except Exception as e:
-            logger.error(f"Error in upload: {e}")
-            logger.error(traceback.format_exc())
-            return jsonify({"error": str(e)}), 500
+@app.route('/admin/profile', methods=['GET'])
+@require_admin
+def sample_profile():
+    """Sample all thread stacks for a few seconds and return them collapsed for flamegraphs."""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', PROFILE_SAMPLE_INTERVAL))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    if seconds <= 0 or seconds > PROFILE_MAX_SECONDS:
+        return jsonify({'error': f'seconds must be between 0 and {PROFILE_MAX_SECONDS:g}'}), 400
+    if interval < PROFILE_SAMPLE_INTERVAL:
+        return jsonify({'error': f'interval must be at least {PROFILE_SAMPLE_INTERVAL:g}'}), 400
 
-@app.route('/process-paystub', methods=['POST'])
-def process_paystub():
-    """Process a paystub PDF and generate a compliance report."""
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 400
-    
-    data = request.get_json()
-    
-    file_url = data.get('file_url')
-    email = data.get('email')
-    
-    # Get shift information if available
-    user_input = {
-        'shifts_exceeded_10_hours': data.get('shifts_exceeded_10_hours', False),
-        'exceeded_shifts_count': int(data.get('exceeded_shifts_count', 0))
-    }
-    
-    if not file_url:
-        return jsonify({'error': 'file_url is required'}), 400
-    
-    if not email:
-        return jsonify({'error': 'email is required'}), 400
-    
-    # Validate email
-    email_validation_error = processor.validate_email(email)
-    if email_validation_error:
-        return jsonify({'error': f'Invalid email: {email_validation_error}'}), 400
-    
-    # Update status to processing
-    processor.update_processing_status(
-        file_url=file_url,
-        email=email,
-        status='processing',
-        message='Starting paystub processing'
+    try:
+        result = stack_sampler.sample(
+            seconds,
+            interval,
+            thread_prefix=request.args.get('threads', ''),
+            include_idle=request.args.get('idle', 'false').lower() in ['true', '1', 't']
+        )
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 409
+
+    logger.info(f"Sampled {result['samples']} times in {result['seconds']}s (overhead {result['overhead']:.2%})")
+    if request.args.get('format') == 'json':
+        return jsonify(result)
+    collapsed = "".join(
+        f"{stack} {count}\n" for stack, count in sorted(result['stacks'].items(), key=lambda item: -item[1])
     )
-    
+    response = Response(collapsed, mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(result['samples'])
+    response.headers['X-Profile-Overhead'] = str(result['overhead'])
+    return response
+
+@app.route('/admin/job-profile', methods=['GET'])
+@require_admin
+def job_profile():
+    """Return the cProfile capture of a job run with "profile": true, as text or as a pstats file."""
+    file_url = request.args.get('file_url')
+    if not file_url:
+        return jsonify({'error': 'file_url parameter is required'}), 400
+
     try:
-        # Process the file asynchronously
-        from threading import Thread
-        thread = Thread(target=process_paystub_async, args=(file_url, email, user_input))
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({
-            'status': 'processing',
-            'message': 'Paystub processing started',
-            'file_url': file_url
-        })
-    
+        doc_id = processor.generate_document_id(file_url)
+        snapshot = db.collection(PROFILE_COLLECTION).document(doc_id).get()
     except Exception as e:
-        logger.error(f"Error starting processing: {e}")
+        logger.error(f"Failed to read profile: {e}")
         logger.error(traceback.format_exc())
-        
-        # Update status to failed
-        processor.update_processing_status(
-            file_url=file_url,
-            email=email,
-            status='failed',
-            message=f'Error starting processing: {str(e)}'
+        return jsonify({'error': 'Failed to read profile', 'details': str(e)}), 500
+    if not snapshot.exists:
+        return jsonify({'error': 'No profile for this file'}), 404
+
+    document = snapshot.to_dict()
+    if request.args.get('format') == 'pstats':
+        if not document.get('pstats'):
+            return jsonify({'error': 'Profile was too large to store; only the summary is available'}), 404
+        return Response(
+            zlib.decompress(document['pstats']),
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{doc_id}.prof"'}
         )
-        
-        return jsonify({
-            'error': 'Failed to start processing',
-            'details': str(e)
-        }), 500
+    return Response(document.get('summary', ''), mimetype='text/plain')
+
+@app.route('/admin/memory', methods=['GET'])
+@require_admin
+def memory_report():
+    """Trace allocations for a few seconds and report the top allocation sites, traced jobs and temp usage."""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if seconds < 0 or seconds > PROFILE_MAX_SECONDS:
+        return jsonify({'error': f'seconds must be between 0 and {PROFILE_MAX_SECONDS:g}'}), 400
+    group = request.args.get('group', 'lineno')
+    if group not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': "group must be 'lineno', 'filename' or 'traceback'"}), 400
 
+    tmp_monitor.ensure_started()
+    report = allocation_tracer.snapshot(seconds, group)
+    report['rss_bytes'] = resident_memory_bytes()
+    report['jobs'] = allocation_tracer.stats()
+    report['tmp'] = {'now': tmp_monitor.measure(), **tmp_monitor.stats()}
+    return jsonify(report)
+
+@app.route('/compliance-history', methods=['GET'])
+def compliance_history():
+    """Return a user's running compliance totals for a year, month by month.
+
+    An email address alone is easy to guess, so the caller must also pass the
+    file_url of one of that user's uploads, like /report.
+    """
+    file_url = request.args.get('file_url')
+    email = request.args.get('email')
+    if not file_url or not email:
+        return jsonify({'error': 'file_url and email parameters are required'}), 400
 
-def process_paystub_async(file_url: str, email: str, user_input: Dict[str, Any] = None):
-    """Process the paystub asynchronously."""
-    if user_input is None:
-        user_input = {}
-        
     try:
-        # Download the PDF
-        logger.info(f"Downloading PDF from {file_url}")
-        pdf_path = processor.download_pdf(file_url)
-        
-        if not pdf_path:
-            logger.error(f"Failed to download PDF from {file_url}")
-            processor.update_processing_status(
-                file_url=file_url,
-                email=email,
-                status='failed',
-                message='Failed to download PDF'
-            )
-            return
-        
-        # Extract text from PDF
-        logger.info(f"Extracting text from {pdf_path}")
-        text = processor.extract_pdf_text(pdf_path)
-        
-        if not text:
-            logger.error(f"Failed to extract text from {pdf_path}")
-            processor.update_processing_status(
-                file_url=file_url,
-                email=email,
-                status='failed',
-                message='Failed to extract text from PDF'
-            )
-            return
-        
-        # Parse paystub data
-        logger.info("Parsing paystub data")
-        data = processor.parse_paystub_data(text)
-        
-        if not data:
-            logger.error("Failed to parse paystub data")
-            processor.update_processing_status(
-                file_url=file_url,
-                email=email,
-                status='failed',
-                message='Failed to parse paystub data'
-            )
-            return
-        
-        # Perform compliance checks
-        logger.info("Performing compliance checks")
-        compliance_results = processor.perform_compliance_checks(data, user_input)
-        
-        # Generate compliance report
-        logger.info("Generating compliance report")
-        report_path = processor.generate_compliance_report(data, compliance_results, user_input)
-        
-        # Send email with report
-        logger.info(f"Sending email to {email}")
-        email_sent = processor.send_email_report(email, report_path)
-        
-        if email_sent:
-            # Update status to completed
-            processor.update_processing_status(
-                file_url=file_url,
-                email=email,
-                status='completed',
-                message='Paystub processing completed successfully'
-            )
-            logger.info(f"Processing completed for {file_url}")
+        year = int(request.args.get('year', date.today().year))
+    except ValueError:
+        return jsonify({'error': 'year must be an integer'}), 400
+    if not 1900 <= year <= 9999:
+        return jsonify({'error': 'year is out of range'}), 400
+
+    try:
+        doc = db.collection('processing_status').document(processor.generate_document_id(file_url)).get()
+        status = doc.to_dict() if doc.exists else {}
+        if status.get('email') != email:
+            return jsonify({'error': 'No compliance history available for this file'}), 404
+
+        return jsonify(compliance_rollups.history(email, year))
+    except Exception as e:
+        logger.error(f"Failed to read compliance history: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Failed to read compliance history', 'details': str(e)}), 500
+
+@app.route('/register-results', methods=['GET'])
+def register_results():
+    """Stream the per-employee results of a payroll register as newline-delimited JSON.
+
+    Results appear while the register is still processing; pass ``after`` (the
+    last index received) to fetch only newer ones.
+    """
+    file_url = request.args.get('file_url')
+    if not file_url:
+        return jsonify({'error': 'file_url parameter is required'}), 400
+
+    try:
+        after = int(request.args.get('after', -1))
+    except ValueError:
+        return jsonify({'error': 'after must be an integer'}), 400
+
+    doc_id = processor.generate_document_id(file_url)
+    employees = db.collection('processing_status').document(doc_id).collection('employees')
+
+    def generate():
+        for doc in employees.where('index', '>', after).order_by('index').stream():
+            yield json.dumps(doc.to_dict(), default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/report', methods=['GET'])
+def compliance_report():
+    """Serve the compliance report PDF of a processed paystub, rendering it on first request."""
+    file_url = request.args.get('file_url')
+    email = request.args.get('email')
+    if not file_url or not email:
+        return jsonify({'error': 'file_url and email parameters are required'}), 400
+
+    try:
+        doc = db.collection('processing_status').document(processor.generate_document_id(file_url)).get()
+        status = doc.to_dict() if doc.exists else {}
+        result = status.get('result')
+        if status.get('email') != email or not result:
+            return jsonify({
+                'error': 'No report available for this file',
+                'status': status.get('status', 'unknown') if status.get('email') == email else 'unknown'
+            }), 404
+
+        cached = report_cache.get(result['report_key'])
+        if cached is not None:
+            report_bytes = cached['pdf']
         else:
-            # Update status to completed but with email failure
-            processor.update_processing_status(
-                file_url=file_url,
-                email=email,
-                status='completed_with_errors',
-                message='Processing completed but failed to send email'
+            report_bytes = cpu_runner.run(
+                render_report, result['data'], result['compliance_results'], result['user_input']
             )
-            logger.warning(f"Processing completed but email sending failed for {file_url}")
-        
+            report_cache.set(result['report_key'], {'pdf': report_bytes})
+
+        return Response(
+            report_bytes,
+            mimetype='application/pdf',
+            headers={'Content-Disposition': 'inline; filename=compliance_report.pdf'}
+        )
     except Exception as e:
-        logger.error(f"Error processing paystub: {e}")
+        logger.error(f"Error rendering report: {e}")
         logger.error(traceback.format_exc())
-        
-        # Update status to failed
-        processor.update_processing_status(
-            file_url=file_url,
-            email=email,
-            status='failed',
-            message=f'Error processing paystub: {str(e)}'
-        )
+        return jsonify({
+            'error': 'Failed to render report',
+            'details': str(e)
+        }), 500
 
 @app.route('/check-status', methods=['GET'])
 def check_status():
-    """Check the status of a paystub processing job."""
+    """Check the status of a paystub processing job.
+
+    Pass ``wait`` (seconds) and ``since`` (the ``event_id`` of the status
+    already shown) to hold the request until the status changes or the wait
+    is over, instead of polling.
+    """
     file_url = request.args.get('file_url')
     
     if not file_url:
         return jsonify({'error': 'file_url is required'}), 400
+
+    try:
+        wait = min(float(request.args.get('wait', 0)), STATUS_LONG_POLL_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
     
     try:
         # Get the document ID for the file URL
         doc_id = processor.generate_document_id(file_url)
+
+        if wait > 0:
+            try:
+                subscription = status_broker.subscribe(doc_id)
+            except QueueFullError as e:
+                # Too many held requests; answer right away instead
+                logger.warning(f"Not holding status request for {file_url}: {e}")
+            else:
+                try:
+                    deadline = time.monotonic() + wait
+                    event = subscription.get(wait)
+                    if event is not None and event['event_id'] == request.args.get('since'):
+                        event = subscription.get(max(0, deadline - time.monotonic())) or event
+                finally:
+                    status_broker.unsubscribe(subscription)
+
+                if event is None:
+                    return jsonify({
+                        'status': 'unknown',
+                        'message': 'No processing status found for this file'
+                    }), 404
+                return jsonify(event)
         
-        # Get the document from Firestore
-        doc_ref = db.collection('processing_status').document(doc_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return jsonify({
-                'status': 'unknown',
-                'message': 'No processing status found for this file'
-            }), 404
-        
-        # Get the document data
-        data = doc.to_dict()
+        # A status still buffered in this process is newer than the stored one
+        data = status_writer.pending(doc_id)
+        if data is None:
+            # Get the document from Firestore
+            doc_ref = db.collection('processing_status').document(doc_id)
+            doc = doc_ref.get()
+
+            if not doc.exists:
+                return jsonify({
+                    'status': 'unknown',
+                    'message': 'No processing status found for this file'
+                }), 404
+
+            # Get the document data
+            data = doc.to_dict()
         
-        return jsonify({
-            'status': data.get('status', 'unknown'),
-            'message': data.get('message', ''),
-            'file_url': data.get('file_url', file_url)
-        })
+        return jsonify(status_event({'file_url': file_url, **data}))
     
     except Exception as e:
         logger.error(f"Error checking status: {e}")
@@ -824,6 +6056,126 @@ def check_status():
             'details': str(e)
         }), 500
 
+def lookup_statuses(doc_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Look up many status documents with at most one Firestore round trip.
+
+    Statuses still buffered in this process come first, then the status
+    cache; the rest are fetched together with get_all, reading only the
+    status and message fields.
+
+    :param doc_ids: Processing status document IDs
+    :return: Document (status and message) by ID, None for documents that do not exist
+    """
+    statuses = {}
+    missing = []
+    for doc_id in dict.fromkeys(doc_ids):
+        document = status_writer.pending(doc_id)
+        if document is None:
+            cached, document = status_cache.get(doc_id)
+            if not cached:
+                missing.append(doc_id)
+                continue
+        statuses[doc_id] = document
+
+    if missing:
+        collection = db.collection('processing_status')
+        found = {}
+        for snapshot in db.get_all([collection.document(doc_id) for doc_id in missing], field_paths=['status', 'message']):
+            found[snapshot.id] = snapshot.to_dict() if snapshot.exists else None
+        for doc_id in missing:
+            statuses[doc_id] = found.get(doc_id)
+            status_cache.set(doc_id, statuses[doc_id])
+    return statuses
+
+@app.route('/check-status-batch', methods=['POST'])
+def check_status_batch():
+    """Check the status of many processing jobs in one request, e.g. for an employer dashboard."""
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 400
+
+    file_urls = request.get_json().get('file_urls')
+    if not isinstance(file_urls, list) or not all(isinstance(file_url, str) and file_url for file_url in file_urls):
+        return jsonify({'error': 'file_urls must be a list of file URLs'}), 400
+    if len(file_urls) > STATUS_BATCH_MAX_FILES:
+        return jsonify({'error': f'Batch exceeds {STATUS_BATCH_MAX_FILES} file URLs'}), 400
+
+    try:
+        doc_ids = [processor.generate_document_id(file_url) for file_url in file_urls]
+        statuses = lookup_statuses(doc_ids)
+    except Exception as e:
+        logger.error(f"Error checking statuses: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            'error': 'Failed to check processing statuses',
+            'details': str(e)
+        }), 500
+
+    results = []
+    for file_url, doc_id in zip(file_urls, doc_ids):
+        document = statuses[doc_id]
+        if document is None:
+            document = {'status': 'unknown', 'message': 'No processing status found for this file'}
+        results.append(status_event({**document, 'file_url': file_url}))
+    return jsonify({'count': len(results), 'results': results})
+
+@app.route('/status-events', methods=['GET'])
+def status_events():
+    """Stream the status of a processing job as Server-Sent Events.
+
+    The current status is sent first, then each change once. The stream ends
+    after a final status (the client should close its EventSource then) or
+    after STATUS_STREAM_TIMEOUT seconds; EventSource reconnects with
+    Last-Event-ID, and a client that already has the final status gets 204.
+    """
+    file_url = request.args.get('file_url')
+    if not file_url:
+        return jsonify({'error': 'file_url is required'}), 400
+
+    doc_id = processor.generate_document_id(file_url)
+    last_event_id = request.headers.get('Last-Event-ID')
+    try:
+        subscription = status_broker.subscribe(doc_id, [last_event_id] if last_event_id else ())
+    except QueueFullError as e:
+        logger.warning(f"Rejecting status stream for {file_url}: {e}")
+        response = jsonify({
+            'error': 'Server busy',
+            'details': str(e),
+            'retry_after': JOB_RETRY_AFTER
+        })
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response, 503
+
+    latest = subscription.latest
+    if latest is not None and latest['event_id'] == last_event_id and latest['status'] in StatusWriter.TERMINAL_STATUSES:
+        status_broker.unsubscribe(subscription)
+        return '', 204
+
+    def generate():
+        deadline = time.monotonic() + STATUS_STREAM_TIMEOUT
+        try:
+            # Reconnect delay for EventSource
+            yield f"retry: {int(STATUS_STREAM_HEARTBEAT * 1000)}\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.get(min(STATUS_STREAM_HEARTBEAT, remaining))
+                if event is None:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event['event_id']}\nevent: status\ndata: {json.dumps(event)}\n\n"
+                if event['status'] in StatusWriter.TERMINAL_STATUSES:
+                    return
+        finally:
+            status_broker.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/test-download', methods=['GET'])
 def test_download():
     file_url = request.args.get('file_url')
@@ -0,0 +1,14 @@
+"""Shared setup for the test suite.
+
+server_new builds its Google Cloud clients at import time; the emulator hosts
+below only let it do so without credentials. Nothing in the tests talks to
+Google Cloud.
+"""
+import os
+import sys
+
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', 'localhost:8681')
+os.environ.setdefault('STORAGE_EMULATOR_HOST', 'http://localhost:9023')
+os.environ.setdefault('GOOGLE_CLOUD_PROJECT', 'test')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
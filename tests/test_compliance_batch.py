@@ -0,0 +1,53 @@
+"""Tests that /compliance-batch matches the single paystub checks row for row"""
+import pytest
+
+import server_new
+
+ROWS = {
+    'net_pay': [900.0, 300.0, 2000.0, 0],
+    'gross_pay': [1200.0, 400.0, 2600.0, 500.0],
+    'total_hours': [40.0, 40.0, 50.0, 20.0],
+    'exceeded_shifts_count': [3, 0, 2, 1],
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server_new.limiter, 'enabled', False)
+    return server_new.app.test_client()
+
+
+def scalar_results(columns, flags=None):
+    results = []
+    for i in range(len(columns['net_pay'])):
+        user_input = {'state': 'NY', 'pay_date': '2025-06-01', 'exceeded_shifts_count': columns['exceeded_shifts_count'][i]}
+        if flags is not None:
+            user_input['shifts_exceeded_10_hours'] = flags[i]
+        data = {field: columns[field][i] for field in ('net_pay', 'gross_pay', 'total_hours')}
+        checks = server_new.processor.perform_compliance_checks(data, user_input)
+        checks.setdefault('additional_pay_owed', 0.0)
+        del checks['wage_rule']
+        results.append(checks)
+    return results
+
+
+def batch_results(client, columns):
+    response = client.post('/compliance-batch', json=dict(columns, state='NY', pay_date='2025-06-01'))
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    return [{name: values[i] for name, values in results.items()} for i in range(len(columns['net_pay']))]
+
+
+def test_batch_without_the_long_shift_flag_matches_single_stubs(client):
+    results = batch_results(client, ROWS)
+
+    assert results == scalar_results(ROWS)
+    assert not any(row['long_shift_additional_pay_violation'] for row in results)
+
+
+def test_batch_with_the_long_shift_flag_matches_single_stubs(client):
+    flags = [True, True, False, True]
+    results = batch_results(client, dict(ROWS, shifts_exceeded_10_hours=flags))
+
+    assert results == scalar_results(ROWS, flags)
+    assert [row['long_shift_additional_pay_violation'] for row in results] == [True, False, False, True]
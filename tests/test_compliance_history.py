@@ -0,0 +1,109 @@
+"""Tests for compliance rollups and access to /compliance-history"""
+import pytest
+
+import server_new
+from benchmarks import MemoryFirestore
+
+FILE_URL = f"{server_new.UPLOAD_PREFIX}{'a' * 64}/{'b' * 32}.pdf"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server_new, 'db', MemoryFirestore(0))
+    monkeypatch.setattr(server_new, 'status_writer', server_new.StatusWriter('processing_status', 0, 500))
+    monkeypatch.setattr(server_new.limiter, 'enabled', False)
+    monkeypatch.setattr(server_new.compliance_rollups, 'history', lambda email, year: {'email': email, 'year': year})
+    server_new.processor.update_processing_status(FILE_URL, 'owner@example.com', 'completed', write_through=True)
+    return server_new.app.test_client()
+
+
+def test_history_requires_an_upload_of_the_user(client):
+    response = client.get('/compliance-history', query_string={'email': 'owner@example.com'})
+    assert response.status_code == 400
+
+
+def test_history_is_hidden_from_other_emails(client):
+    response = client.get(
+        '/compliance-history', query_string={'file_url': FILE_URL, 'email': 'someone@example.com'}
+    )
+    assert response.status_code == 404
+
+
+def test_history_is_hidden_for_unknown_uploads(client):
+    unknown = f"{server_new.UPLOAD_PREFIX}{'a' * 64}/{'c' * 32}.pdf"
+    response = client.get('/compliance-history', query_string={'file_url': unknown, 'email': 'owner@example.com'})
+    assert response.status_code == 404
+
+
+def test_history_of_the_upload_owner(client):
+    response = client.get(
+        '/compliance-history', query_string={'file_url': FILE_URL, 'email': 'owner@example.com', 'year': 2026}
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {'email': 'owner@example.com', 'year': 2026}
+
+
+STUB = 'c' * 64
+DATA = {'total_hours': 40.0, 'gross_pay': 1200.0, 'net_pay': 900.0}
+CHECKS = {'minimum_wage': True, 'overtime_compliant': True, 'long_shift_additional_pay_violation': False}
+
+
+@pytest.fixture
+def rollups(monkeypatch):
+    monkeypatch.setattr(server_new, 'db', MemoryFirestore(0))
+    return server_new.ComplianceRollups('compliance_rollups')
+
+
+def month(history, period):
+    return next(totals for totals in history['months'] if totals['period'] == period)
+
+
+def test_recording_a_stub_again_does_not_count_it_twice(rollups):
+    assert rollups.record('owner@example.com', STUB, DATA, CHECKS, '2025-03-14')
+    before = rollups.history('owner@example.com', 2025)
+
+    assert not rollups.record('Owner@Example.com ', STUB, DATA, CHECKS, '2025-03-14')
+    # Without a pay date the stub keeps the period it was recorded under
+    assert not rollups.record('owner@example.com', STUB, DATA, CHECKS)
+
+    history = rollups.history('owner@example.com', 2025)
+    assert history == before
+    assert history['all_time']['stubs'] == history['year']['stubs'] == month(history, '2025-03')['stubs'] == 1
+    assert history['all_time']['gross_pay'] == 1200.0
+
+
+def test_changed_pay_date_moves_the_contribution(rollups):
+    rollups.record('owner@example.com', STUB, DATA, CHECKS, '2025-03-14')
+    assert rollups.record('owner@example.com', STUB, DATA, CHECKS, '2025-04-01')
+
+    history = rollups.history('owner@example.com', 2025)
+    assert month(history, '2025-03')['stubs'] == 0
+    assert month(history, '2025-03')['net_pay'] == 0.0
+    assert month(history, '2025-04')['stubs'] == 1
+    assert month(history, '2025-04')['net_pay'] == 900.0
+    assert history['year']['stubs'] == history['all_time']['stubs'] == 1
+
+    rollups.record('owner@example.com', STUB, DATA, CHECKS, '2024-12-31')
+    assert rollups.history('owner@example.com', 2025)['year']['stubs'] == 0
+    assert rollups.history('owner@example.com', 2024)['year']['stubs'] == 1
+
+
+def test_changed_results_apply_the_difference(rollups):
+    rollups.record('owner@example.com', STUB, DATA, CHECKS, '2025-03-14')
+    rollups.record('owner@example.com', 'd' * 64, DATA, CHECKS, '2025-03-28')
+
+    failing = dict(CHECKS, minimum_wage=False, long_shift_additional_pay_violation=True, additional_pay_owed=46.5)
+    assert rollups.record('owner@example.com', STUB, dict(DATA, gross_pay=1300.0), failing, '2025-03-14')
+
+    totals = month(rollups.history('owner@example.com', 2025), '2025-03')
+    assert totals['stubs'] == 2
+    assert totals['gross_pay'] == 2500.0
+    assert totals['minimum_wage_violations'] == 1
+    assert totals['long_shift_violations'] == 1
+    assert totals['additional_pay_owed'] == 46.5
+
+    # Fixing the results takes the violations back out
+    rollups.record('owner@example.com', STUB, DATA, CHECKS, '2025-03-14')
+    totals = rollups.history('owner@example.com', 2025)['all_time']
+    assert (totals['stubs'], totals['gross_pay'], totals['minimum_wage_violations']) == (2, 2400.0, 0)
+    assert totals['additional_pay_owed'] == 0.0
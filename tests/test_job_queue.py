@@ -0,0 +1,146 @@
+"""Tests for SQLiteJobQueue leases, retries and dead-lettering, and the worker's lease heartbeat"""
+import sqlite3
+import time
+
+import pytest
+
+import server_new
+import worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return server_new.SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), max_attempts=3, retry_backoff=10)
+
+
+def job_row(queue, job_id):
+    with sqlite3.connect(queue.path) as conn:
+        return conn.execute(
+            'SELECT status, attempts, available_at, last_error FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+
+
+def test_lease_hides_job_until_acked(queue):
+    job_id = queue.enqueue({'type': 'paystub'})
+
+    job = queue.lease(60)
+    assert job.id == job_id
+    assert job.payload == {'type': 'paystub'}
+    assert job.attempts == 1
+    assert queue.lease(60) is None
+
+    assert queue.ack(job)
+    assert job_row(queue, job_id) is None
+    assert queue.stats()['pending'] == 0
+
+
+def test_expired_lease_is_leased_again(queue):
+    queue.enqueue({'type': 'paystub'})
+    first = queue.lease(0.05)
+    time.sleep(0.1)
+
+    second = queue.lease(60)
+    assert second.id == first.id
+    assert second.attempts == 2
+    assert second.lease_token != first.lease_token
+
+
+def test_ack_with_stale_token_reports_lost_lease(queue):
+    queue.enqueue({'type': 'paystub'})
+    first = queue.lease(0.05)
+    time.sleep(0.1)
+    second = queue.lease(60)
+
+    assert not queue.ack(first)
+    assert not queue.fail(first, 'late failure')
+    assert not queue.extend_lease(first, 60)
+    assert job_row(queue, second.id)[0] == 'leased'
+
+    assert queue.ack(second)
+    assert job_row(queue, second.id) is None
+
+
+def test_extend_lease_keeps_job_hidden(queue):
+    queue.enqueue({'type': 'paystub'})
+    job = queue.lease(0.1)
+    for _ in range(4):
+        time.sleep(0.05)
+        assert queue.extend_lease(job, 0.1)
+        assert queue.lease(60) is None
+    assert queue.ack(job)
+
+
+def test_fail_retries_with_exponential_backoff(queue):
+    job_id = queue.enqueue({'type': 'paystub'})
+
+    for attempt, delay in ((1, 10), (2, 20)):
+        job = queue.lease(60)
+        assert job.attempts == attempt
+        before = time.time()
+        assert queue.fail(job, 'temporary')
+        status, attempts, available_at, last_error = job_row(queue, job_id)
+        assert (status, attempts, last_error) == ('pending', attempt, 'temporary')
+        assert before + delay <= available_at <= time.time() + delay
+        assert queue.lease(60) is None
+
+        # Make the job due again instead of waiting out the backoff
+        with sqlite3.connect(queue.path) as conn:
+            conn.execute('UPDATE jobs SET available_at = 0 WHERE id = ?', (job_id,))
+
+
+def test_fail_on_last_attempt_dead_letters(queue):
+    job_id = queue.enqueue({'type': 'paystub'})
+    queue.retry_backoff = 0
+
+    for _ in range(queue.max_attempts):
+        job = queue.lease(60)
+        assert queue.fail(job, 'broken')
+
+    assert job_row(queue, job_id)[0] == 'dead'
+    assert queue.lease(60) is None
+    assert queue.stats()['dead'] == 1
+
+
+def test_expired_lease_on_last_attempt_dead_letters(queue):
+    job_id = queue.enqueue({'type': 'paystub'})
+    queue.max_attempts = 1
+    queue.lease(0.05)
+    time.sleep(0.1)
+
+    assert queue.lease(60) is None
+    assert job_row(queue, job_id)[0] == 'dead'
+    assert job_row(queue, job_id)[3] == 'Lease expired on final attempt'
+
+
+def test_worker_heartbeat_keeps_long_job_leased(queue, monkeypatch):
+    job_id = queue.enqueue({'type': 'paystub'})
+    runs = []
+    stolen = []
+
+    def slow_job(payload, final_attempt):
+        runs.append(payload)
+        # Outlive the visibility timeout several times over while another worker polls
+        for _ in range(6):
+            time.sleep(0.1)
+            stolen.append(queue.lease(60))
+
+    monkeypatch.setattr(worker, 'run_job', slow_job)
+    queue_worker = worker.QueueWorker(queue, 1, 0.01, visibility_timeout=0.15, heartbeat_interval=0.03)
+    queue_worker._run_job(queue.lease(0.15))
+
+    assert len(runs) == 1
+    assert stolen == [None] * 6
+    assert job_row(queue, job_id) is None
+
+
+def test_worker_fails_job_on_error(queue, monkeypatch):
+    job_id = queue.enqueue({'type': 'paystub'})
+
+    def broken_job(payload, final_attempt):
+        raise server_new.RetryableJobError('SMTP unavailable')
+
+    monkeypatch.setattr(worker, 'run_job', broken_job)
+    worker.QueueWorker(queue, 1, 0.01)._run_job(queue.lease(60))
+
+    status, attempts, _, last_error = job_row(queue, job_id)
+    assert (status, attempts, last_error) == ('pending', 1, 'SMTP unavailable')
@@ -0,0 +1,66 @@
+"""Tests for rasterizing and OCR'ing scanned PDFs in batches"""
+import numpy as np
+import pytest
+from fpdf import FPDF
+from PIL import Image
+
+import server_new
+from benchmarks import MemoryFirestore
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Record rasterization requests; each page renders as an image of its page number"""
+    calls = []
+
+    def convert_from_bytes(pdf_bytes, dpi, first_page, last_page, grayscale, thread_count):
+        calls.append((dpi, first_page, last_page, thread_count))
+        return [Image.new('L', (dpi, 10), page) for page in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(server_new, 'convert_from_bytes', convert_from_bytes, raising=False)
+    return calls
+
+
+def extractor(workers: int) -> server_new.OCRExtractor:
+    return server_new.OCRExtractor(
+        server_new.CPUStageRunner('thread', workers, 'spawn'), server_new.ResultCache('ocr_test', 100), 'eng', 0
+    )
+
+
+def scanned_pdf(pages: int) -> bytes:
+    pdf = FPDF()
+    for _ in range(pages):
+        pdf.add_page()
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def test_pages_with_the_same_dpi_render_in_one_request(renders):
+    images = extractor(4).render_pages(b'%PDF', 3, [200, 200, 200, 300])
+
+    assert renders == [(200, 3, 5, 3), (300, 6, 6, 1)]
+    assert [int(image[0, 0]) for image in images] == [3, 4, 5, 6]
+    assert [image.shape for image in images] == [(10, 200)] * 3 + [(10, 300)]
+
+
+def test_ocr_renders_one_request_per_batch(renders, monkeypatch):
+    monkeypatch.setattr(server_new, 'db', MemoryFirestore(0))
+    # Only the last page has the fields, so every batch is read
+    monkeypatch.setattr(
+        server_new, 'ocr_page_image',
+        lambda image, lang: 'Employee Name: Jane Doe\nTotal Hours: 40\nGross Pay: $800.00\nNet Pay: $700.00'
+        if int(image[0, 0]) == 5 else f'Page {int(image[0, 0])}'
+    )
+    ocr = extractor(2)
+    ocr._available = True
+
+    result = ocr.extract_and_parse(scanned_pdf(5))
+
+    assert [(first, last) for _, first, last, _ in renders] == [(1, 2), (3, 4), (5, 5)]
+    assert result['pages_read'] == result['ocr_pages'] == 5
+    assert result['data']['net_pay'] == 700.0
+
+    # Rendered pages seen before are served from the cache
+    renders.clear()
+    result = ocr.extract_and_parse(scanned_pdf(5))
+    assert result['ocr_cache_hits'] == 5
+    assert np.isclose(result['data']['gross_pay'], 800.0)
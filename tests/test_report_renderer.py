@@ -0,0 +1,54 @@
+"""Tests that rendered compliance reports are PDFs readers can open"""
+import io
+
+from PyPDF2 import PdfReader
+
+import server_new
+from benchmarks import synthetic_reports
+
+
+def read(pdf_bytes: bytes) -> PdfReader:
+    assert pdf_bytes.startswith(b'%PDF-1.5')
+    return PdfReader(io.BytesIO(pdf_bytes), strict=True)
+
+
+def test_reports_round_trip():
+    renderer = server_new.report_renderer
+    reports = synthetic_reports(5)
+
+    for i, pdf_bytes in enumerate(renderer.render_batch(reports)):
+        reader = read(pdf_bytes)
+        text = ''.join(page.extract_text() for page in reader.pages)
+
+        assert len(reader.pages) >= 1
+        assert f'Employee: Employee {i}' in text
+        for check in server_new.ReportRenderer.CHECKS:
+            assert check.replace('_', ' ').title() in text
+        assert 'Rules applied' in text
+        # Dates are written like FPDF 1.7 writes them, without a UTC offset
+        assert reader.metadata['/CreationDate'].startswith('D:')
+
+
+def test_combined_report_has_a_page_per_report():
+    renderer = server_new.report_renderer
+    reports = synthetic_reports(4, seed=2)
+    # Keep every report on one page so pages line up with reports
+    for _, checks, _ in reports:
+        checks['long_shift_additional_pay_violation'] = False
+
+    reader = read(renderer.render_batch(reports, combined=True))
+
+    assert len(reader.pages) == 4
+    for i, page in enumerate(reader.pages):
+        assert f'Employee: Employee {i}' in page.extract_text()
+    assert renderer.render_batch([], combined=True) == b''
+
+
+def test_render_matches_single_report_in_batch():
+    renderer = server_new.report_renderer
+    report = synthetic_reports(1, seed=3)[0]
+
+    single = read(renderer.render(*report))
+    batched = read(renderer.render_batch([report], combined=True))
+
+    assert [page.extract_text() for page in single.pages] == [page.extract_text() for page in batched.pages]
@@ -0,0 +1,102 @@
+"""Tests for when StatusBroker follows a document with a Firestore listener"""
+import pytest
+
+import server_new
+
+FILE_URL = f"{server_new.UPLOAD_PREFIX}{'a' * 64}/{'b' * 32}.pdf"
+DOC_ID = server_new.processor.generate_document_id(FILE_URL)
+
+
+class ListenedDocument:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.doc_id = doc_id
+
+    def on_snapshot(self, callback):
+        self.db.listeners[self.doc_id] = callback
+        return self
+
+    def unsubscribe(self):
+        self.db.listeners.pop(self.doc_id, None)
+
+
+class ListenedFirestore:
+    """Firestore stand-in that records listeners so tests can push snapshots"""
+
+    def __init__(self):
+        self.listeners = {}
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return ListenedDocument(self, doc_id)
+
+
+class Snapshot:
+    exists = True
+
+    def __init__(self, document):
+        self.document = document
+
+    def to_dict(self):
+        return self.document
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = ListenedFirestore()
+    monkeypatch.setattr(server_new, 'db', db)
+    return db
+
+
+@pytest.fixture
+def broker(monkeypatch, db):
+    broker = server_new.StatusBroker(10, 100, listen=True, local_jobs=True)
+    monkeypatch.setattr(server_new, 'status_broker', broker)
+    return broker
+
+
+def status(name):
+    return {'file_url': FILE_URL, 'status': name, 'message': name}
+
+
+def test_upload_status_published_here_still_gets_a_listener(db, broker):
+    # The upload hit this instance but the job may run on another one
+    broker.publish(DOC_ID, status('uploaded'))
+    subscription = broker.subscribe(DOC_ID)
+
+    assert subscription.get(0)['status'] == 'uploaded'
+    assert DOC_ID in db.listeners
+    db.listeners[DOC_ID]([Snapshot(status('completed'))], [], None)
+    assert subscription.get(0)['status'] == 'completed'
+
+
+def test_job_running_here_needs_no_listener(db, broker):
+    server_new.create_job(FILE_URL, 'owner@example.com')
+    broker.publish(DOC_ID, status('processing'))
+    subscription = broker.subscribe(DOC_ID)
+
+    assert subscription.get(0)['status'] == 'processing'
+    assert db.listeners == {}
+    broker.publish(DOC_ID, status('completed'))
+    assert subscription.get(0)['status'] == 'completed'
+
+
+def test_rejected_job_is_followed_again(db, broker):
+    server_new.create_job(FILE_URL, 'owner@example.com')
+    broker.job_rejected(DOC_ID)
+    broker.publish(DOC_ID, status('uploaded'))
+    broker.subscribe(DOC_ID)
+
+    assert DOC_ID in db.listeners
+
+
+def test_jobs_in_worker_processes_are_always_followed(db, monkeypatch):
+    broker = server_new.StatusBroker(10, 100, listen=True, local_jobs=False)
+    monkeypatch.setattr(server_new, 'status_broker', broker)
+    server_new.create_job(FILE_URL, 'owner@example.com')
+    broker.publish(DOC_ID, status('processing'))
+    broker.subscribe(DOC_ID)
+
+    assert DOC_ID in db.listeners
@@ -0,0 +1,86 @@
+"""Tests for sync requests that run past their budget"""
+import threading
+import time
+
+import pytest
+
+import server_new
+
+FILE_URL = f"{server_new.UPLOAD_PREFIX}{'a' * 64}/{'b' * 32}.pdf"
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = server_new.SQLiteJobQueue(str(tmp_path / 'jobs.sqlite3'), max_attempts=3, retry_backoff=10)
+    monkeypatch.setattr(server_new, 'job_queue', queue)
+    return queue
+
+
+def lease_when_queued(queue, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.lease(60)
+        if job is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError('No job was queued')
+
+
+def test_overrun_sync_job_is_handed_to_the_durable_queue(queue):
+    release = threading.Event()
+
+    def slow_download(job):
+        release.wait(5)
+        job['content_hash'] = 'a' * 64
+        return True
+
+    def extract(job):
+        job['data'] = {'net_pay': 700.0}
+        return True
+
+    def check(job):
+        job['compliance_results'] = {'minimum_wage': True}
+        return True
+
+    sync = server_new.SyncProcessor([('download', slow_download), ('extract', extract), ('check', check)], 1)
+    job = server_new.create_job(FILE_URL, 'owner@example.com', {'state': 'NY'})
+
+    assert sync.run(job, 0.01) is None
+    release.set()
+    leased = lease_when_queued(queue)
+
+    assert leased.payload == {
+        'type': 'process_paystub',
+        'file_url': FILE_URL,
+        'email': 'owner@example.com',
+        'user_input': {'state': 'NY'},
+        'resume': {
+            'start': 3,
+            'content_hash': 'a' * 64,
+            'data': {'net_pay': 700.0},
+            'compliance_results': {'minimum_wage': True}
+        }
+    }
+    assert sync.stats()['fell_back'] == 1
+
+
+def test_resumed_job_runs_only_the_remaining_stages(monkeypatch):
+    ran = []
+
+    def stage(name):
+        def run(job):
+            ran.append((name, job.get('data'), job.get('compliance_results')))
+            return True
+        return run
+
+    monkeypatch.setattr(server_new, 'PIPELINE_STAGES', [(name, stage(name)) for name in ('download', 'check', 'render')])
+
+    server_new.run_job({
+        'type': 'process_paystub',
+        'file_url': FILE_URL,
+        'email': 'owner@example.com',
+        'user_input': {},
+        'resume': {'start': 2, 'content_hash': 'a' * 64, 'data': {'net_pay': 700.0}, 'compliance_results': {}}
+    })
+
+    assert ran == [('render', {'net_pay': 700.0}, {})]
@@ -0,0 +1,108 @@
+"""Tests for parsing punch exports, aggregating workweeks and the checks recorded on them"""
+from datetime import date, datetime
+
+import server_new
+
+PAY_CHECKS = {'minimum_wage', 'overtime_compliant', 'total_compensation_valid'}
+
+
+def summary(long_shift_days: int, total_hours: float = 52.0) -> server_new.WorkweekSummary:
+    return server_new.WorkweekSummary(
+        'E1', date(2026, 9, 7), total_hours, round(max(0.0, total_hours - 40), 2), 5, long_shift_days
+    )
+
+
+def test_workweek_checks_leave_out_pay_checks():
+    checks = server_new.processor.perform_hours_checks(server_new.workweek_compliance_input(summary(0), {}))
+
+    assert not PAY_CHECKS & set(checks)
+    assert checks['long_shift_additional_pay_violation'] is False
+    assert checks['additional_pay_owed'] == 0.0
+
+
+def test_workweek_checks_owe_pay_for_long_shift_days():
+    checks = server_new.processor.perform_hours_checks(server_new.workweek_compliance_input(summary(2), {}))
+    rule = checks['wage_rule']
+
+    assert checks['long_shift_additional_pay_violation'] is True
+    assert checks['additional_pay_owed'] == 2 * rule['minimum_wage'] * rule['long_shift_bonus']
+
+
+def test_paystub_checks_still_include_long_shifts():
+    user_input = {'shifts_exceeded_10_hours': True, 'exceeded_shifts_count': 3}
+    data = {'total_hours': 40.0, 'gross_pay': 1200.0, 'net_pay': 900.0}
+    checks = server_new.processor.perform_compliance_checks(data, user_input)
+    rule = checks['wage_rule']
+
+    assert PAY_CHECKS <= set(checks)
+    assert checks['minimum_wage'] and checks['overtime_compliant'] and checks['total_compensation_valid']
+    assert checks['long_shift_additional_pay_violation'] is True
+    assert checks['additional_pay_owed'] == 3 * rule['minimum_wage'] * rule['long_shift_bonus']
+
+
+def punch(start: str, end: str, employee_id: str = 'E1') -> server_new.Punch:
+    return server_new.Punch(employee_id, datetime.fromisoformat(start), datetime.fromisoformat(end))
+
+
+def test_parser_counts_bad_rows():
+    parser = server_new.PunchParser(max_shift_hours=16)
+    rows = [
+        {'Employee': 'E1', 'Clock In': '2026-09-08T08:00:00', 'Clock Out': '2026-09-08T17:00:00'},
+        {'employee': 'E1', 'clock_in': '2026-09-08T08:00:00', 'clock_out': '2026-09-08T17:00:00'},
+        {'employee': 'E1', 'clock_in': 'yesterday', 'clock_out': '2026-09-08T17:00:00'},
+        {'employee': 'E1', 'clock_in': '2026-09-08T17:00:00', 'clock_out': '2026-09-08T08:00:00'},
+        {'employee': 'E1', 'clock_in': '2026-09-08T08:00:00', 'clock_out': '2026-09-09T08:00:00'},
+        {'employee': ' ', 'clock_in': '2026-09-08T08:00:00', 'clock_out': '2026-09-08T17:00:00'},
+        {'employee': 'E1', 'clock_in': None, 'clock_out': '2026-09-08T17:00:00'},
+        ['E1', '2026-09-08T08:00:00', '2026-09-08T17:00:00'],
+    ]
+
+    punches = list(parser.iter_punches(rows))
+
+    assert punches == [punch('2026-09-08T08:00:00', '2026-09-08T17:00:00')]
+    assert (parser.rows, parser.bad_rows) == (8, 7)
+
+
+def test_parser_accepts_rows_mixing_offsets_and_local_times():
+    parser = server_new.PunchParser()
+    rows = [
+        {'employee': 'E1', 'in': '2026-09-08T08:00:00+00:00', 'out': '2026-09-08T17:00:00'},
+        {'employee': 'E1', 'in': '2026-09-09T08:00:00', 'out': '2026-09-09T12:00:00-04:00'},
+    ]
+
+    punches = list(parser.iter_punches(rows))
+
+    assert parser.bad_rows == 0
+    assert punches == [
+        punch('2026-09-08T08:00:00', '2026-09-08T17:00:00'),
+        punch('2026-09-09T08:00:00', '2026-09-09T12:00:00'),
+    ]
+    summaries = list(server_new.iter_workweek_summaries(punches, server_new.TimesheetAggregator({'state': 'NY'})))
+    assert [(s.total_hours, s.shift_count) for s in summaries] == [(13.0, 2)]
+
+
+def test_aggregator_totals_workweeks_and_spread_of_hours():
+    aggregator = server_new.TimesheetAggregator({'state': 'NY'})
+    punches = [
+        # Monday: 10 hours worked over an 11 hour spread
+        punch('2026-09-07T08:00:00', '2026-09-07T12:00:00'),
+        punch('2026-09-07T13:00:00', '2026-09-07T19:00:00'),
+        punch('2026-09-08T08:00:00', '2026-09-08T16:00:00'),
+        punch('2026-09-09T08:00:00', '2026-09-09T16:00:00'),
+        punch('2026-09-10T08:00:00', '2026-09-10T16:00:00'),
+        # Overnight from Saturday counts toward Saturday and is a 9 hour spread
+        punch('2026-09-12T22:00:00', '2026-09-13T07:00:00'),
+        punch('2026-09-08T08:00:00', '2026-09-08T18:00:00', employee_id='E2'),
+        # The next week finishes E1's first one; a punch back in it is skipped
+        punch('2026-09-14T09:00:00', '2026-09-14T10:00:00'),
+        punch('2026-09-11T08:00:00', '2026-09-11T16:00:00'),
+    ]
+
+    summaries = list(server_new.iter_workweek_summaries(punches, aggregator))
+
+    assert summaries == [
+        server_new.WorkweekSummary('E1', date(2026, 9, 7), 43.0, 3.0, 6, 1),
+        server_new.WorkweekSummary('E1', date(2026, 9, 14), 1.0, 0.0, 1, 0),
+        server_new.WorkweekSummary('E2', date(2026, 9, 7), 10.0, 0.0, 1, 0),
+    ]
+    assert aggregator.out_of_order == 1
@@ -0,0 +1,161 @@
+"""Tests for content-addressed uploads with a per-upload handle"""
+import io
+
+import google.auth.credentials
+import pytest
+
+import server_new
+from benchmarks import MemoryBucket, MemoryFirestore
+
+
+class MetadataServerCredentials:
+    """Like Cloud Run's credentials: no private key, and the account is known once refreshed"""
+
+    def __init__(self):
+        self.service_account_email = 'default'
+        self.token = None
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        return self.token is not None
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.service_account_email = 'backend@project.iam.gserviceaccount.com'
+        self.token = f'token-{self.refreshes}'
+
+
+class KeyCredentials(google.auth.credentials.Signing):
+    """Like a service account key: signs locally"""
+
+    signer = signer_email = key_id = None
+
+    def sign_bytes(self, message):
+        return b'signature'
+
+
+class MemoryStorageClient:
+    def __init__(self, bucket, credentials=None):
+        self._bucket = bucket
+        self._credentials = credentials or MetadataServerCredentials()
+
+    def bucket(self, bucket_id):
+        return self._bucket
+
+
+class SigningBucket(MemoryBucket):
+    """Records the arguments each URL was signed with"""
+
+    def __init__(self):
+        super().__init__()
+        self.signing = []
+
+    def blob(self, name):
+        blob = super().blob(name)
+        sign = blob.generate_signed_url
+
+        def generate_signed_url(**kwargs):
+            self.signing.append(kwargs)
+            return sign(**kwargs)
+
+        blob.generate_signed_url = generate_signed_url
+        return blob
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    bucket = MemoryBucket()
+    monkeypatch.setattr(server_new.storage, 'Client', lambda: MemoryStorageClient(bucket))
+    monkeypatch.setattr(server_new, 'db', MemoryFirestore(0))
+    monkeypatch.setattr(server_new, 'status_writer', server_new.StatusWriter('processing_status', 0, 500))
+    monkeypatch.setattr(server_new.limiter, 'enabled', False)
+    return bucket
+
+
+def upload(client, data: bytes, filename: str, email: str) -> str:
+    response = client.post(
+        '/upload-paystub',
+        data={'file': (io.BytesIO(data), filename), 'email': email},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['file_url']
+
+
+def test_identical_uploads_share_the_object_but_not_the_job(bucket):
+    client = server_new.app.test_client()
+    pdf = b'%PDF-1.4 identical paystub'
+
+    first = upload(client, pdf, 'stub.pdf', 'first@example.com')
+    second = upload(client, pdf, 'copy.pdf', 'second@example.com')
+
+    assert first != second
+    assert list(bucket.objects) == [server_new.upload_object_name(first)]
+    assert server_new.upload_object_name(second) == server_new.upload_object_name(first)
+    assert server_new.content_hash_from_url(first) == server_new.content_hash_from_url(second)
+
+    statuses = server_new.db.documents
+    first_id = server_new.processor.generate_document_id(first)
+    second_id = server_new.processor.generate_document_id(second)
+    assert first_id != second_id
+    assert statuses[first_id]['email'] == 'first@example.com'
+    assert statuses[second_id]['email'] == 'second@example.com'
+
+
+def test_handle_downloads_the_stored_object(bucket):
+    client = server_new.app.test_client()
+    pdf = b'%PDF-1.4 paystub'
+    file_url = upload(client, pdf, 'stub.pdf', 'user@example.com')
+
+    assert server_new.StorageService(server_new.BUCKET_ID).download_bytes(file_url) == pdf
+
+
+def test_object_names_are_their_own_object():
+    legacy = f"{server_new.UPLOAD_PREFIX}{'a' * 64}.pdf"
+    assert server_new.upload_object_name(legacy) == legacy
+    assert server_new.content_hash_from_url(legacy) == 'a' * 64
+    assert server_new.upload_object_name('paystub_uploads/1234_stub.pdf') == 'paystub_uploads/1234_stub.pdf'
+    assert server_new.content_hash_from_url('paystub_uploads/1234_stub.pdf') is None
+
+
+@pytest.mark.parametrize('filename, fmt', [
+    ('punches.csv', 'csv'),
+    ('Punches.JSONL', 'jsonl'),
+    ('punches.ndjson.gz', 'jsonl'),
+    ('stub.pdf', None),
+    ('scan', None),
+])
+def test_uploads_keep_timesheet_extensions(bucket, filename, fmt):
+    client = server_new.app.test_client()
+    file_url = upload(client, b'employee_id,clock_in,clock_out\n', filename, 'user@example.com')
+
+    assert server_new.timesheet_format(file_url) == fmt
+    assert server_new.timesheet_format(server_new.upload_object_name(file_url)) == fmt
+    if fmt is None:
+        assert file_url.endswith('.pdf')
+
+
+def test_urls_without_a_key_are_signed_by_iam(monkeypatch):
+    bucket = SigningBucket()
+    credentials = MetadataServerCredentials()
+    monkeypatch.setattr(server_new.storage, 'Client', lambda: MemoryStorageClient(bucket, credentials))
+    service = server_new.StorageService(server_new.BUCKET_ID)
+
+    service.signed_url('compliance_reports/a.pdf', 3600)
+    service.signed_url('compliance_reports/b.pdf', 3600)
+
+    assert credentials.refreshes == 1
+    assert [(kwargs['service_account_email'], kwargs['access_token']) for kwargs in bucket.signing] == [
+        ('backend@project.iam.gserviceaccount.com', 'token-1')
+    ] * 2
+
+
+def test_urls_with_a_key_are_signed_locally(monkeypatch):
+    bucket = SigningBucket()
+    monkeypatch.setattr(server_new.storage, 'Client', lambda: MemoryStorageClient(bucket, KeyCredentials()))
+
+    server_new.StorageService(server_new.BUCKET_ID).signed_url('compliance_reports/a.pdf', 3600)
+
+    assert 'service_account_email' not in bucket.signing[0]
+    assert 'access_token' not in bucket.signing[0]
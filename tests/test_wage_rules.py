@@ -0,0 +1,42 @@
+"""Tests for resolving wage rules and the long shift pay they owe"""
+import numpy as np
+
+import server_new
+
+LONG_SHIFTS = {'shifts_exceeded_10_hours': True, 'exceeded_shifts_count': 3}
+PAY = {'total_hours': 40.0, 'gross_pay': 1200.0, 'net_pay': 900.0}
+
+
+def test_california_has_no_spread_of_hours_bonus():
+    rule = server_new.wage_rules.resolve({'state': 'CA', 'pay_date': '2025-06-01'})
+
+    assert rule['name'] == 'California Labor Code'
+    assert rule['minimum_wage'] == 16.5
+    assert rule['long_shift_bonus'] == 0
+
+
+def test_new_york_city_inherits_the_state_bonus():
+    rule = server_new.wage_rules.resolve({'state': 'NY', 'city': 'New York City', 'pay_date': '2025-06-01'})
+
+    assert rule['minimum_wage'] == 16.5
+    assert (rule['long_shift_threshold'], rule['long_shift_bonus']) == (10, 1)
+
+
+def test_long_shifts_in_california_owe_nothing():
+    checks = server_new.processor.perform_compliance_checks(PAY, dict(LONG_SHIFTS, state='CA'))
+
+    assert checks['long_shift_additional_pay_violation'] is False
+    assert 'additional_pay_owed' not in checks
+
+    batch = server_new.processor.perform_compliance_checks_batch(
+        [900.0], [1200.0], [40.0], [3], [True], rule=checks['wage_rule']
+    )
+    assert not batch['long_shift_additional_pay_violation'][0]
+    assert batch['additional_pay_owed'][0] == 0.0
+
+
+def test_long_shifts_in_new_york_owe_the_bonus():
+    checks = server_new.processor.perform_compliance_checks(PAY, dict(LONG_SHIFTS, state='NY', pay_date='2025-06-01'))
+
+    assert checks['long_shift_additional_pay_violation'] is True
+    assert np.isclose(checks['additional_pay_owed'], 3 * 15.5)
@@ -0,0 +1,186 @@
+"""Standalone worker that processes paystub jobs from the durable job queue.
+
+Run it next to the web tier with the same environment:
+
+    JOB_QUEUE_BACKEND=sqlite python worker.py
+
+The web tier enqueues jobs from /process-paystub; any number of workers lease
+them, retry failures with backoff and finish in-flight jobs before exiting on
+SIGTERM. A running job's lease is extended every JOB_HEARTBEAT_INTERVAL
+seconds, so jobs longer than JOB_VISIBILITY_TIMEOUT are not handed to a second
+worker; jobs left unfinished by a crashed worker reappear once their lease
+expires. Set WORKER_METRICS_PORT to serve the
+worker's stage latencies on /metrics for Prometheus.
+"""
+import os
+import signal
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from server_new import (
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_VISIBILITY_TIMEOUT,
+    MAIL_OUTBOX_DRAIN_TIMEOUT,
+    JobQueue,
+    LeasedJob,
+    RetryableJobError,
+    cpu_runner,
+    job_queue,
+    logger,
+    mail_outbox,
+    metrics,
+    ocr_extractor,
+    run_job,
+    status_writer,
+)
+
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '2'))
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '1.0'))
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '0'))  # 0 disables the metrics endpoint
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the worker's metrics registry on /metrics"""
+
+    def do_GET(self):
+        """Render the metrics, or 404 for any other path"""
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Scrapes are too frequent to log"""
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving worker metrics on port {port}")
+    return server
+
+
+class QueueWorker:
+    """Lease jobs from a JobQueue and run them on a fixed number of threads"""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int,
+        poll_interval: float,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL
+    ):
+        """Initialize the worker"""
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        # The lease must be extended well before it can expire
+        self.heartbeat_interval = min(heartbeat_interval, visibility_timeout / 3)
+        self._stopping = threading.Event()
+
+    def stop(self, signum=None, frame=None):
+        """Stop leasing new jobs; in-flight jobs are allowed to finish"""
+        if not self._stopping.is_set():
+            logger.info(f"Worker received signal {signum}, draining in-flight jobs")
+        self._stopping.set()
+
+    def run(self):
+        """Run the worker threads until stop() is called and they have drained"""
+        threads = [
+            threading.Thread(target=self._loop, name=f"queue-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info(f"Worker started with {self.concurrency} threads")
+
+        for thread in threads:
+            thread.join()
+        logger.info("Worker stopped")
+
+    def _loop(self):
+        """Lease and run jobs until the worker is stopped"""
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.lease(self.visibility_timeout)
+            except Exception as e:
+                logger.error(f"Failed to lease job: {e}")
+                self._stopping.wait(self.poll_interval)
+                continue
+
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+
+            self._run_job(job)
+
+    def _run_job(self, job: LeasedJob):
+        """Run a single leased job, extending its lease while it runs, and acknowledge or fail it"""
+        final_attempt = job.attempts >= self.queue.max_attempts
+        logger.info(f"Running job {job.id} (attempt {job.attempts})")
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, done), name=f"lease-heartbeat-{job.id[:8]}", daemon=True
+        )
+        heartbeat.start()
+
+        error = None
+        try:
+            run_job(job.payload, final_attempt=final_attempt)
+        except RetryableJobError as e:
+            error = str(e)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            logger.error(traceback.format_exc())
+            error = str(e)
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if error is None:
+            self.queue.ack(job)
+        else:
+            self.queue.fail(job, error)
+
+    def _heartbeat(self, job: LeasedJob, done: threading.Event):
+        """Extend the job's lease every heartbeat_interval seconds until done is set or the lease is lost"""
+        while not done.wait(self.heartbeat_interval):
+            try:
+                if not self.queue.extend_lease(job, self.visibility_timeout):
+                    return
+            except Exception as e:
+                logger.error(f"Failed to extend the lease of job {job.id}: {e}")
+
+
+def main():
+    """Entry point for the worker process"""
+    if job_queue is None:
+        raise SystemExit("worker.py requires a durable queue, e.g. JOB_QUEUE_BACKEND=sqlite")
+
+    worker = QueueWorker(job_queue, WORKER_CONCURRENCY, WORKER_POLL_INTERVAL)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+    try:
+        worker.run()
+    finally:
+        # Jobs acknowledged on their final attempt may still have an email queued
+        mail_outbox.flush(MAIL_OUTBOX_DRAIN_TIMEOUT)
+        status_writer.flush()
+        cpu_runner.shutdown()
+        ocr_extractor.runner.shutdown()
+
+
+if __name__ == '__main__':
+    main()